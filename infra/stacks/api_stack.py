@@ -6,6 +6,8 @@ from pathlib import Path
 from aws_cdk import (
     Stack,
     Duration,
+    RemovalPolicy,
+    aws_dynamodb as dynamodb,
     aws_lambda as _lambda,
     aws_apigatewayv2_alpha as apigw,
     aws_apigatewayv2_integrations_alpha as integrations,
@@ -47,6 +49,18 @@ class ApiStack(Stack):
                 "or export MODEL_ID=<bedrock-model-id> before running CDK."
             )
 
+        # Server-side conversation history (src/conversations.py): one item
+        # per turn, newest-first queries, expired sessions removed by TTL.
+        conversations = dynamodb.Table(
+            self,
+            "Conversations",
+            partition_key=dynamodb.Attribute(name="session_id", type=dynamodb.AttributeType.STRING),
+            sort_key=dynamodb.Attribute(name="seq", type=dynamodb.AttributeType.NUMBER),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at",
+            removal_policy=RemovalPolicy.DESTROY,
+        )
+
         fn = PythonFunction(
             self,
             "TimeseriesAgent",
@@ -58,17 +72,20 @@ class ApiStack(Stack):
             timeout=Duration.seconds(10),
             environment={
                 "MODEL_ID": model_id,
+                "CONVERSATION_STORE": f"dynamodb:{conversations.table_name}",
             },
         )
 
         # Only Bedrock permissions are needed while Timestream is disabled.
         fn.add_to_role_policy(
             iam.PolicyStatement(
-                actions=["bedrock:InvokeModel"],
+                actions=["bedrock:InvokeModel", "bedrock:InvokeModelWithResponseStream"],
                 resources=["*"],  # or specific model ARN
             )
         )
 
+        conversations.grant_read_write_data(fn)
+
         api = apigw.HttpApi(
             self,
             "PublicAPI",
@@ -0,0 +1,179 @@
+"""
+Local stand-in for the bedrock-runtime client that injects faults, for
+exercising resilience.py without Bedrock (tests, local_server.py).
+
+    BEDROCK_STUB="throttle=0.3,error=0.05,latency_ms=200,slow=0.1,slow_ms=4000,seed=7"
+
+    throttle    share of calls failing with ThrottlingException
+    error       share of calls failing with ServiceUnavailableException
+    latency_ms  time every call takes before it answers
+    slow        share of calls that take slow_ms instead (a slow replica)
+    seed        fixes the random sequence
+
+Replies are shaped for the model's provider (providers.py), carry the
+x-amzn-bedrock-*-token-count headers, and stream in a few chunks. Prompt
+cache points are honoured like Bedrock does: a prefix seen before is
+reported as cache reads, a new one as cache writes.
+"""
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+import hashlib
+import io
+import json
+import random
+import threading
+import time
+import uuid
+
+from botocore.exceptions import ClientError
+
+import providers
+
+
+@dataclass
+class Faults:
+    throttle: float = 0.0
+    error: float = 0.0
+    latency_ms: int = 50
+    slow: float = 0.0
+    slow_ms: int = 3000
+    seed: Optional[int] = None
+
+
+_KINDS = {"throttle": float, "error": float, "latency_ms": int, "slow": float, "slow_ms": int, "seed": int}
+
+
+def parse_spec(spec: str) -> Faults:
+    """"throttle=0.3,latency_ms=200,..." -> Faults."""
+    faults = Faults()
+    for item in filter(None, (part.strip() for part in (spec or "").split(","))):
+        key, sep, value = item.partition("=")
+        if not sep or key not in _KINDS:
+            raise ValueError(f"BEDROCK_STUB entries must look like <fault>=<value>, got {item!r}")
+        setattr(faults, key, _KINDS[key](float(value)))
+    return faults
+
+
+def _blocks(request: Dict) -> Iterator[Dict]:
+    for part in (request.get("system"), *(m.get("content") for m in request.get("messages") or [])):
+        if isinstance(part, list):
+            yield from part
+
+
+def _tokens(texts: List[str]) -> int:
+    return sum(len(t) for t in texts) // 4
+
+
+def _body_for(provider: str, text: str, input_tokens: int, output_tokens: int) -> Dict:
+    if provider == "anthropic":
+        return {"content": [{"type": "text", "text": text}], "model": "stub", "stop_reason": "end_turn",
+                "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens}}
+    if provider == "meta":
+        return {"generation": text, "prompt_token_count": input_tokens,
+                "generation_token_count": output_tokens, "stop_reason": "stop"}
+    if provider == "mistral":
+        return {"outputs": [{"text": text, "stop_reason": "stop"}]}
+    if provider == "amazon":
+        return {"inputTextTokenCount": input_tokens,
+                "results": [{"outputText": text, "tokenCount": output_tokens, "completionReason": "FINISH"}]}
+    return {"content": text, "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens}}
+
+
+class FaultyBedrock:
+    """invoke_model / invoke_model_with_response_stream / converse(_stream) with injected faults."""
+
+    def __init__(self, faults: Optional[Faults] = None, answer: str = "[stub] Your recent readings look stable."):
+        self.faults = faults or Faults()
+        self.answer = answer
+        self.calls: List[Dict] = []      # {model_id, outcome, ms} per call, for assertions
+        self._random = random.Random(self.faults.seed)
+        self._lock = threading.Lock()
+        self._prefixes: Set[str] = set()
+
+    def _usage(self, request: Dict) -> Dict[str, int]:
+        """Token counts for `request`, splitting off the prefixes its cache points make reusable."""
+        texts, points = [], []
+        for block in _blocks(request):
+            if "cachePoint" in block:          # converse: point after the previous block
+                points.append(len(texts))
+                continue
+            texts.append(block.get("text", ""))
+            if "cache_control" in block:       # anthropic: point after this block
+                points.append(len(texts))
+        if not texts:                          # a plain prompt string (meta, mistral, titan, ...)
+            texts = [json.dumps(request)]
+        read = write = 0
+        if points:
+            # like Bedrock, a hit may end at any earlier block boundary, not only at a point
+            keys = [hashlib.sha1("\0".join(texts[:n]).encode()).hexdigest() for n in range(points[-1] + 1)]
+            with self._lock:
+                hit = max((n for n, key in enumerate(keys) if key in self._prefixes), default=0)
+                self._prefixes.update(keys[p] for p in points)
+            read = _tokens(texts[:hit])
+            write = _tokens(texts[:points[-1]]) - read
+        return {"input": max(1, _tokens(texts) - read - write), "output": len(self.answer.split()),
+                "cache_read": read, "cache_write": write}
+
+    def _call(self, operation: str, model_id: str, request: Dict) -> Tuple[Dict, Dict[str, int]]:
+        """Sleep and maybe raise as configured; returns (response metadata, token counts)."""
+        with self._lock:
+            roll, slow = self._random.random(), self._random.random() < self.faults.slow
+        ms = self.faults.slow_ms if slow else self.faults.latency_ms
+        outcome = "ok"
+        if roll < self.faults.throttle:
+            outcome, ms = "ThrottlingException", min(ms, 20)
+        elif roll < self.faults.throttle + self.faults.error:
+            outcome = "ServiceUnavailableException"
+        time.sleep(ms / 1000)
+        with self._lock:
+            self.calls.append({"model_id": model_id, "outcome": outcome, "ms": ms})
+        if outcome != "ok":
+            raise ClientError({"Error": {"Code": outcome, "Message": "injected by bedrock_stub"}}, operation)
+        usage = self._usage(request)
+        headers = {f"x-amzn-bedrock-{kind}-token-count": str(usage[key])
+                   for kind, key in (("input", "input"), ("output", "output"),
+                                     ("cache-read-input", "cache_read"), ("cache-write-input", "cache_write"))}
+        return {"RequestId": str(uuid.uuid4()), "HTTPHeaders": headers}, usage
+
+    def invoke_model(self, modelId: str, body, **kwargs) -> Dict:
+        meta, usage = self._call("InvokeModel", modelId, json.loads(body))
+        reply = _body_for(providers.provider_of(modelId), self.answer, usage["input"], usage["output"])
+        return {"body": io.BytesIO(json.dumps(reply).encode()), "ResponseMetadata": meta}
+
+    def _chunks(self) -> Iterator[str]:
+        words = self.answer.split(" ")
+        for i in range(0, len(words), 3):
+            yield " ".join(words[i:i + 3]) + (" " if i + 3 < len(words) else "")
+
+    def invoke_model_with_response_stream(self, modelId: str, body, **kwargs) -> Dict:
+        meta, usage = self._call("InvokeModelWithResponseStream", modelId, json.loads(body))
+        events = [{"chunk": {"bytes": json.dumps({"type": "content_block_delta",
+                                                  "delta": {"type": "text_delta", "text": text}}).encode()}}
+                  for text in self._chunks()]
+        metrics = {"inputTokenCount": usage["input"], "outputTokenCount": usage["output"],
+                   "cacheReadInputTokenCount": usage["cache_read"], "cacheWriteInputTokenCount": usage["cache_write"]}
+        events.append({"chunk": {"bytes": json.dumps({"type": "message_stop",
+                                                      "amazon-bedrock-invocationMetrics": metrics}).encode()}})
+        return {"body": iter(events), "ResponseMetadata": meta}
+
+    @staticmethod
+    def _converse_usage(usage: Dict[str, int]) -> Dict[str, int]:
+        return {"inputTokens": usage["input"], "outputTokens": usage["output"],
+                "cacheReadInputTokens": usage["cache_read"], "cacheWriteInputTokens": usage["cache_write"]}
+
+    def converse(self, modelId: str, **kwargs) -> Dict:
+        meta, usage = self._call("Converse", modelId, kwargs)
+        return {"output": {"message": {"role": "assistant", "content": [{"text": self.answer}]}},
+                "usage": self._converse_usage(usage), "stopReason": "end_turn", "ResponseMetadata": meta}
+
+    def converse_stream(self, modelId: str, **kwargs) -> Dict:
+        meta, usage = self._call("ConverseStream", modelId, kwargs)
+        events = [{"contentBlockDelta": {"delta": {"text": text}}} for text in self._chunks()]
+        events.append({"metadata": {"usage": self._converse_usage(usage)}})
+        return {"stream": iter(events), "ResponseMetadata": meta}
+
+
+def from_spec(spec: str) -> Optional[FaultyBedrock]:
+    """"" -> None (use the real client), else a FaultyBedrock configured by `spec`."""
+    return FaultyBedrock(parse_spec(spec)) if spec else None
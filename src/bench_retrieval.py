@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Recall@k vs latency report for the dense searchers of a built index.
+
+    python bench_retrieval.py ./rag_index --k 10 --ef 16,32,64,128,256 --rerank 0,16,64
+
+Queries are index rows perturbed with Gaussian noise (so a row is not
+trivially its own nearest neighbour); ground truth is the exact flat search.
+Compare the p95 column against the <250 ms retrieval budget.
+"""
+from __future__ import annotations
+from typing import Callable, Dict, List, Tuple
+import argparse
+import time
+
+import numpy as np
+
+import hnsw
+import quantize
+import vector_index
+
+Search = Callable[[np.ndarray, int], List[Tuple[int, float]]]
+
+
+def sample_queries(index: vector_index.VectorIndex, n: int, noise: float, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(index), size=min(n, len(index)), replace=False)
+    q = np.asarray(index.vectors[np.sort(rows)], dtype=np.float32)
+    q += rng.normal(scale=noise / np.sqrt(index.dim), size=q.shape).astype(np.float32)
+    return vector_index.normalize_rows(q)
+
+
+def evaluate(search: Search, queries: np.ndarray, truth: List[List[int]], k: int) -> Dict:
+    lat, hits = [], 0
+    for q, gt in zip(queries, truth):
+        t = time.perf_counter()
+        got = search(q, k)
+        lat.append((time.perf_counter() - t) * 1000)
+        hits += len({r for r, _ in got} & set(gt))
+    lat_ms = np.asarray(lat)
+    return {
+        "recall": hits / max(1, sum(len(gt) for gt in truth)),
+        "p50_ms": float(np.percentile(lat_ms, 50)),
+        "p95_ms": float(np.percentile(lat_ms, 95)),
+    }
+
+
+def main(argv=None) -> None:
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("index", help="index directory")
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--noise", type=float, default=0.5, help="query perturbation (L2 norm)")
+    ap.add_argument("--ef", default="16,32,64,128,256", help="comma-separated efSearch values")
+    ap.add_argument("--rerank", default="0,16,64,256",
+                    help="comma-separated rerank depths for quantised codes (0 = no rerank)")
+    args = ap.parse_args(argv)
+
+    index = vector_index.VectorIndex(args.index)
+    queries = sample_queries(index, args.queries, args.noise)
+    truth = [[r for r, _ in index.search(q, args.k)] for q in queries]
+
+    rows = [("flat", "-", evaluate(index.search, queries, truth, args.k))]
+    graph = hnsw.load(index)
+    if graph is not None:
+        for ef in (int(x) for x in args.ef.split(",") if x):
+            rows.append(("hnsw", str(ef), evaluate(lambda q, k: graph.search(q, k, ef=ef), queries, truth, args.k)))
+    quant = quantize.load(index)
+    if quant is not None:
+        for depth in (int(x) for x in args.rerank.split(",") if x):
+            quant.rerank = depth
+            rows.append((quant.mode, str(depth), evaluate(quant.search, queries, truth, args.k)))
+
+    print(f"{len(index)} rows, dim {index.dim}, {len(queries)} queries, k={args.k}")
+    if quant is not None:
+        full = index.vectors.nbytes
+        print(f"scan bytes: {index.vectors.dtype} {full / 2**20:.1f} MiB, "
+              f"{quant.mode} {quant.codes.nbytes / 2**20:.1f} MiB ({full / quant.codes.nbytes:.1f}x smaller)")
+    print(f"{'searcher':<10}{'ef/rr':>6}{'recall@k':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for name, ef, r in rows:
+        print(f"{name:<10}{ef:>6}{r['recall']:>10.3f}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
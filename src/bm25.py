@@ -0,0 +1,159 @@
+"""
+Okapi BM25 inverted index stored next to the vector index.
+
+Files (all memory-mapped except the vocabulary):
+
+    bm25_vocab.json    {"k1", "b", "avgdl", "n", "index_gen", "terms": {term: id}}
+    bm25_indptr.npy    (V + 1,) int64   CSR offsets into the posting arrays
+    bm25_rows.npy      (P,) int32       index row of each posting
+    bm25_weights.npy   (P,) float16     precomputed idf * tf-saturation impact
+
+Impacts are baked in at build time, so scoring a query is a gather over the
+query terms' posting slices plus one np.bincount. Query terms that occur in
+more than MAX_DF_RATIO of the chunks are skipped (their idf is close to zero
+and their posting lists are the longest), unless nothing else is left.
+"""
+from __future__ import annotations
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+import json
+import os
+import re
+
+import numpy as np
+
+import vector_index
+
+VOCAB_FILE = "bm25_vocab.json"
+INDPTR_FILE = "bm25_indptr.npy"
+ROWS_FILE = "bm25_rows.npy"
+WEIGHTS_FILE = "bm25_weights.npy"
+
+K1 = 1.2
+B = 0.75
+MAX_DF_RATIO = 0.5
+
+# keeps clinical tokens like "hba1c", "2.5", "type-2" intact
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[.\-][a-z0-9]+)*")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have how i in is it its me my of on or "
+    "that the this to was what when which with you your".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN_RE.findall(text.lower()) if t not in _STOPWORDS]
+
+
+def _save(path: str, arr: np.ndarray) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as fh:
+        np.save(fh, arr)
+    os.replace(tmp, path)
+
+
+def build(path: str, docs: Iterable[Tuple[int, str]], n_rows: int, k1: float = K1, b: float = B,
+          index_gen: Optional[str] = None) -> Dict:
+    """
+    Build the BM25 files in `path` from (row, text) pairs. Rows not supplied
+    (e.g. tombstoned ones) simply have no postings. `index_gen` is the
+    generation of the vector index the rows belong to.
+    """
+    terms: Dict[str, int] = {}
+    post_terms, post_rows, post_tf = array("i"), array("i"), array("i")
+    doclen = np.zeros(n_rows, dtype=np.float32)
+
+    for row, text in docs:
+        toks = tokenize(text)
+        doclen[row] = len(toks)
+        for term, tf in Counter(toks).items():
+            post_terms.append(terms.setdefault(term, len(terms)))
+            post_rows.append(row)
+            post_tf.append(tf)
+
+    t_ids = np.asarray(post_terms, dtype=np.int32)
+    rows = np.asarray(post_rows, dtype=np.int32)
+    tf = np.asarray(post_tf, dtype=np.float32)
+    order = np.lexsort((rows, t_ids))
+    t_ids, rows, tf = t_ids[order], rows[order], tf[order]
+
+    counts = np.bincount(t_ids, minlength=len(terms))
+    df = counts.astype(np.float32)
+    n_docs = max(int(np.count_nonzero(doclen)), 1)
+    avgdl = float(doclen[doclen > 0].mean()) if doclen.any() else 1.0
+    idf = np.log1p((n_docs - df + 0.5) / (df + 0.5))
+    norm = k1 * (1.0 - b + b * doclen[rows] / avgdl)
+    weights = (idf[t_ids] * tf * (k1 + 1.0) / (tf + norm)).astype(np.float16)
+
+    indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+
+    os.makedirs(path, exist_ok=True)
+    _save(os.path.join(path, INDPTR_FILE), indptr)
+    _save(os.path.join(path, ROWS_FILE), rows)
+    _save(os.path.join(path, WEIGHTS_FILE), weights)
+    vocab = {"k1": k1, "b": b, "avgdl": avgdl, "n": n_rows, "docs": n_docs, "index_gen": index_gen,
+             "terms": terms}
+    tmp = os.path.join(path, VOCAB_FILE) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(vocab, fh, separators=(",", ":"))
+    os.replace(tmp, os.path.join(path, VOCAB_FILE))
+    return {"terms": len(terms), "postings": int(rows.shape[0])}
+
+
+class BM25Index:
+    def __init__(self, path: str):
+        with open(os.path.join(path, VOCAB_FILE), encoding="utf-8") as fh:
+            vocab = json.load(fh)
+        self.terms: Dict[str, int] = vocab["terms"]
+        self.n = int(vocab["n"])
+        self.index_gen: Optional[str] = vocab.get("index_gen")
+        self.max_df = max(1, int(vocab.get("docs", self.n) * MAX_DF_RATIO))
+        self.indptr = np.load(os.path.join(path, INDPTR_FILE))
+        self.rows = np.load(os.path.join(path, ROWS_FILE), mmap_mode="r")
+        self.weights = np.load(os.path.join(path, WEIGHTS_FILE), mmap_mode="r")
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """Return up to k (row, bm25) pairs with a positive score, best first."""
+        ids = {self.terms[t] for t in tokenize(query) if t in self.terms}
+        if not ids or k <= 0:
+            return []
+        selective = {i for i in ids if self.indptr[i + 1] - self.indptr[i] <= self.max_df}
+        ids = selective or ids
+        rows = np.concatenate([self.rows[self.indptr[i]:self.indptr[i + 1]] for i in ids])
+        weights = np.concatenate([self.weights[self.indptr[i]:self.indptr[i + 1]] for i in ids])
+        weights = weights.astype(np.float32)
+        if rows.shape[0] * 8 > self.n:
+            # dense accumulate beats sorting once postings are a sizeable fraction of rows
+            scores = np.bincount(rows, weights=weights, minlength=self.n)
+            cand = np.flatnonzero(scores)
+            scores = scores[cand]
+        else:
+            cand, inverse = np.unique(rows, return_inverse=True)
+            scores = np.bincount(inverse, weights=weights)
+        k = min(k, cand.shape[0])
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k] if k < cand.shape[0] else np.arange(cand.shape[0])
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(cand[i]), float(scores[i])) for i in top]
+
+
+def load(path: str, index: Optional[vector_index.VectorIndex] = None) -> Optional[BM25Index]:
+    """The BM25 files in `path`; ValueError if they were not built from `index` (when given)."""
+    if not os.path.exists(os.path.join(path, VOCAB_FILE)):
+        return None
+    lexical = BM25Index(path)
+    if index is not None:
+        vector_index.check_built_from(index, lexical.index_gen, lexical.n, "BM25 files")
+    return lexical
+
+
+def reciprocal_rank_fusion(rankings: Iterable[List[Tuple[int, float]]], k: int = 60) -> List[Tuple[int, float]]:
+    """Fuse ranked (row, score) lists: score(row) = sum 1 / (k + rank)."""
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, (row, _) in enumerate(ranking, 1):
+            fused[row] = fused.get(row, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda kv: kv[1], reverse=True)
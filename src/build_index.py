@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+Offline index build job: source documents -> chunks -> embeddings -> index.
+
+    python build_index.py ./knowledge_base --out ./rag_index \\
+        --embedder bedrock:amazon.titan-embed-text-v2:0:512
+
+Text extraction and chunking run in a process pool (CPU bound); embedding
+batches run on a bounded thread pool (network bound), so at most
+`--embed-concurrency` requests are in flight and at most twice that many
+batches are buffered. Chunks stream straight into the index writer.
+
+Re-runs are incremental: manifest.json records each source file's sha256
+and the index rows it produced. Only added/changed files are re-chunked,
+chunks whose text hash already exists reuse their stored vector, rows of
+changed/deleted files are tombstoned, and the delta is appended to a copy
+of the existing rows. Once tombstones exceed `--compact-ratio` the merge
+drops dead rows instead. Pass `--full` to rebuild from scratch.
+
+The BM25 sidecar (bm25.py) is re-derived from the live chunk texts after
+every write; that is a tokenisation pass only, no embedding calls. With
+`--ann hnsw` the HNSW graph (hnsw.py) is extended with the appended rows,
+or rebuilt after a compaction; `--quant int8|pq` (quantize.py) likewise
+encodes only the appended rows.
+"""
+from __future__ import annotations
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from functools import partial
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+import argparse
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+import bm25
+import chunking
+import embedder as emb
+import hnsw
+import quantize
+import retrieval
+import vector_index
+
+logger = logging.getLogger("build_index")
+
+EMBED_MODEL_ID = os.getenv("EMBED_MODEL_ID", "amazon.titan-embed-text-v2:0")
+EMBED_DIM = os.getenv("EMBED_DIM", "512")
+DEFAULT_EMBEDDER = f"bedrock:{EMBED_MODEL_ID}:{EMBED_DIM}"
+
+MANIFEST_FILE = "manifest.json"
+DEFAULT_COMPACT_RATIO = 0.25
+
+OnAdded = Callable[[int, List[Dict]], None]
+
+
+def iter_chunks(paths: Iterable[str], root: str, chunk_chars: int, overlap: int, workers: int) -> Iterator[Dict]:
+    """Yield chunks for every source file, extracted in a process pool."""
+    work = partial(chunking.process_file, root=root, chunk_chars=chunk_chars, overlap=overlap)
+    if workers <= 1:
+        for path in paths:
+            yield from work(path)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for chunks in pool.map(work, paths, chunksize=8):
+            yield from chunks
+
+
+def batched(items: Iterable[Dict], size: int) -> Iterator[List[Dict]]:
+    batch: List[Dict] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _embed_batch(embedder: emb.Embedder, batch: List[Dict]) -> Tuple[np.ndarray, List[Dict]]:
+    return embedder.embed([c["text"] for c in batch]), batch
+
+
+def embed_into(writer: vector_index.IndexWriter, chunks: Iterable[Dict], embedder: emb.Embedder,
+               batch_size: int, concurrency: int, on_added: Optional[OnAdded] = None) -> int:
+    """
+    Embed `chunks` with bounded concurrency and append them to `writer`.
+    `on_added(first_row, batch)` is called after each batch is written.
+    """
+    pending: Set[Future] = set()
+    written = 0
+
+    def _drain(done):
+        nonlocal written
+        for fut in done:
+            vecs, batch = fut.result()
+            first = writer.add(vecs, batch)
+            if on_added:
+                on_added(first, batch)
+            written += len(batch)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for batch in batched(chunks, batch_size):
+            if len(pending) >= concurrency * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                _drain(done)
+            pending.add(pool.submit(_embed_batch, embedder, batch))
+        done, _ = wait(pending)
+        _drain(done)
+    return written
+
+
+def _track_rows(files: Dict[str, Dict]) -> OnAdded:
+    def _on_added(first: int, batch: List[Dict]) -> None:
+        for row, chunk in enumerate(batch, first):
+            files[chunk["source"]]["rows"].append(row)
+    return _on_added
+
+
+def load_manifest(path: str) -> Optional[Dict]:
+    try:
+        with open(os.path.join(path, MANIFEST_FILE), encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_manifest(path: str, manifest: Dict) -> None:
+    tmp = os.path.join(path, MANIFEST_FILE) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(manifest, fh, separators=(",", ":"))
+    os.replace(tmp, os.path.join(path, MANIFEST_FILE))
+
+
+def _hash_sources(source: str) -> Dict[str, str]:
+    return {
+        os.path.relpath(p, source): chunking.file_hash(p)
+        for p in chunking.iter_source_files(source)
+    }
+
+
+def _current(load, *args) -> bool:
+    """Whether a sidecar loads and matches the index generation (see vector_index.check_built_from)."""
+    try:
+        return load(*args) is not None
+    except ValueError:
+        return False
+
+
+def build_lexical(out: str) -> Dict:
+    """(Re)build the BM25 files from the live rows of the index at `out`."""
+    index = vector_index.VectorIndex(out)
+    dead = index.tombstones
+    docs = (
+        (row, index.record(row)["text"])
+        for row in range(len(index))
+        if dead is None or not dead[row]
+    )
+    return bm25.build(out, docs, len(index), index_gen=index.gen)
+
+
+def build_quant(out: str, quant: str, resume: bool, pq_m: int) -> Optional[Dict]:
+    if quant == "none":
+        quantize.remove(out)
+        return None
+    return quantize.build(out, quant, pq_m=pq_m, resume=resume)
+
+
+def build_ann(out: str, ann: str, resume: bool, hnsw_m: int, ef_construction: int) -> Optional[Dict]:
+    if ann != "hnsw":
+        hnsw.remove(out)  # a graph from an earlier --ann hnsw run would now be stale
+        return None
+    return hnsw.build(out, M=hnsw_m, ef_construction=ef_construction, resume=resume)
+
+
+def build(source: str, out: str, embedder: emb.Embedder, chunk_chars: int = chunking.DEFAULT_CHUNK_CHARS,
+          overlap: int = chunking.DEFAULT_OVERLAP, workers: int = os.cpu_count() or 1,
+          batch_size: int = 32, concurrency: int = 8, dtype: str = "float32", ann: str = "none",
+          hnsw_m: int = hnsw.DEFAULT_M, ef_construction: int = hnsw.DEFAULT_EF_CONSTRUCTION,
+          quant: str = "none", pq_m: int = quantize.DEFAULT_PQ_M) -> Dict:
+    """Full rebuild of the index at `out` from every file under `source`."""
+    t0 = time.time()
+    shas = _hash_sources(source)
+    files = {rel: {"sha": sha, "rows": []} for rel, sha in shas.items()}
+    meta = {"embedder": embedder.spec, "chunk_chars": chunk_chars, "overlap": overlap}
+    with vector_index.IndexWriter(out, dtype=dtype, extra_meta=meta) as writer:
+        chunks = iter_chunks([os.path.join(source, rel) for rel in shas], source, chunk_chars, overlap, workers)
+        n = embed_into(writer, chunks, embedder, batch_size, concurrency, _track_rows(files))
+    _write_manifest(out, dict(meta, dtype=dtype, files=files))
+    lexical = build_lexical(out)
+    graph = build_ann(out, ann, False, hnsw_m, ef_construction)
+    codes = build_quant(out, quant, False, pq_m)
+    return {"mode": "full", "files": len(files), "chunks": n, "embedded": n, "bm25": lexical,
+            "hnsw": graph, "quant": codes, "seconds": round(time.time() - t0, 2)}
+
+
+def update(source: str, out: str, embedder: emb.Embedder, chunk_chars: int = chunking.DEFAULT_CHUNK_CHARS,
+           overlap: int = chunking.DEFAULT_OVERLAP, workers: int = os.cpu_count() or 1,
+           batch_size: int = 32, concurrency: int = 8, dtype: str = "float32",
+           compact_ratio: float = DEFAULT_COMPACT_RATIO, ann: str = "none",
+           hnsw_m: int = hnsw.DEFAULT_M, ef_construction: int = hnsw.DEFAULT_EF_CONSTRUCTION,
+           quant: str = "none", pq_m: int = quantize.DEFAULT_PQ_M) -> Dict:
+    """
+    Incremental rebuild: embed only chunks of added/changed files whose text
+    is not already in the index. Falls back to build() when there is no
+    compatible previous index.
+    """
+    old = vector_index.load_index(out)
+    manifest = load_manifest(out)
+    meta = {"embedder": embedder.spec, "chunk_chars": chunk_chars, "overlap": overlap}
+    if (old is None or manifest is None
+            or any(manifest.get(k) != v for k, v in dict(meta, dtype=dtype).items())):
+        return build(source, out, embedder, chunk_chars, overlap, workers, batch_size, concurrency, dtype,
+                     ann, hnsw_m, ef_construction, quant, pq_m)
+
+    t0 = time.time()
+    shas = _hash_sources(source)
+    old_files: Dict[str, Dict] = manifest["files"]
+    changed = [rel for rel, sha in shas.items() if old_files.get(rel, {}).get("sha") != sha]
+    removed = [rel for rel in old_files if rel not in shas]
+
+    stale = np.asarray(
+        sorted(r for rel in changed + removed for r in old_files.get(rel, {}).get("rows", [])),
+        dtype=np.int64,
+    )
+    # vectors of stale rows are reusable when the same text reappears
+    reusable = {old.record(int(r))["hash"]: int(r) for r in stale}
+
+    dead = np.zeros(len(old), dtype=bool) if old.tombstones is None else old.tombstones.copy()
+    dead[stale] = True
+    compact = len(old) > 0 and dead.mean() > compact_ratio
+    if not changed and not removed and not compact:
+        if not _current(bm25.load, out, old):
+            build_lexical(out)
+        if ann == "hnsw" and not _current(hnsw.load, old):
+            build_ann(out, ann, False, hnsw_m, ef_construction)
+        have = quantize.load_meta(out) or {}
+        if (have.get("mode", "none") != quant or (quant == "pq" and have.get("m") != pq_m)
+                or (quant != "none" and not _current(quantize.load, old))):
+            build_quant(out, quant, False, pq_m)
+        return {"mode": "unchanged", "files": len(shas), "seconds": round(time.time() - t0, 2)}
+
+    files = {rel: {"sha": sha, "rows": []} for rel, sha in shas.items()}
+    on_added = _track_rows(files)
+    reused = 0
+
+    def _needs_embedding(chunks: Iterable[Dict], writer: vector_index.IndexWriter) -> Iterator[Dict]:
+        nonlocal reused
+        for chunk in chunks:
+            row = reusable.get(chunk["hash"])
+            if row is None:
+                yield chunk
+                continue
+            on_added(writer.add(old.vectors[row], [chunk]), [chunk])
+            reused += 1
+
+    with vector_index.IndexWriter(out, dim=old.dim, dtype=dtype, extra_meta=meta) as writer:
+        if compact:
+            live = np.flatnonzero(~dead)
+            writer.extend_from(old, live)
+            remap = np.full(len(old), -1, dtype=np.int64)
+            remap[live] = np.arange(live.shape[0])
+        else:
+            writer.extend_from(old)
+            writer.tombstone(np.flatnonzero(dead))
+            remap = np.arange(len(old), dtype=np.int64)
+        for rel, entry in old_files.items():
+            if rel in files and rel not in changed:
+                files[rel]["rows"] = remap[np.asarray(entry["rows"], dtype=np.int64)].tolist()
+
+        chunks = iter_chunks([os.path.join(source, rel) for rel in changed], source, chunk_chars, overlap, workers)
+        embedded = embed_into(writer, _needs_embedding(chunks, writer), embedder, batch_size, concurrency, on_added)
+
+    _write_manifest(out, dict(meta, dtype=dtype, files=files))
+    lexical = build_lexical(out)
+    graph = build_ann(out, ann, not compact, hnsw_m, ef_construction)
+    codes = build_quant(out, quant, not compact, pq_m)
+    return {"mode": "compact" if compact else "incremental", "files": len(files),
+            "changed": len(changed), "removed": len(removed), "tombstoned": int(stale.shape[0]),
+            "reused": reused, "embedded": embedded, "bm25": lexical, "hnsw": graph, "quant": codes,
+            "seconds": round(time.time() - t0, 2)}
+
+
+def main(argv=None) -> None:
+    ap = argparse.ArgumentParser(description="Build the local RAG index consumed by the Lambda.")
+    ap.add_argument("source", help="directory of .md/.txt/.html/.json/.jsonl/.pdf documents")
+    ap.add_argument("--out", default=retrieval.DEFAULT_INDEX_DIR, help="index directory (default: %(default)s)")
+    ap.add_argument("--embedder", default=DEFAULT_EMBEDDER, help="embedder spec (default: %(default)s)")
+    ap.add_argument("--chunk-chars", type=int, default=chunking.DEFAULT_CHUNK_CHARS)
+    ap.add_argument("--overlap", type=int, default=chunking.DEFAULT_OVERLAP,
+                    help="characters shared by consecutive chunks, at most half of --chunk-chars (default: %(default)s)")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="chunking processes")
+    ap.add_argument("--embed-batch", type=int, default=32)
+    ap.add_argument("--embed-concurrency", type=int, default=8, help="embedding batches in flight")
+    ap.add_argument("--dtype", choices=("float32", "float16"), default="float32")
+    ap.add_argument("--full", action="store_true", help="ignore the manifest and rebuild everything")
+    ap.add_argument("--compact-ratio", type=float, default=DEFAULT_COMPACT_RATIO,
+                    help="drop dead rows once this fraction is tombstoned (default: %(default)s)")
+    ap.add_argument("--ann", choices=("none", "hnsw"), default="none", help="approximate NN graph to build")
+    ap.add_argument("--hnsw-m", type=int, default=hnsw.DEFAULT_M)
+    ap.add_argument("--hnsw-ef-construction", type=int, default=hnsw.DEFAULT_EF_CONSTRUCTION)
+    ap.add_argument("--quant", choices=("none", "int8", "pq"), default="none",
+                    help="compressed codes for the scan phase (full-precision rerank)")
+    ap.add_argument("--pq-m", type=int, default=quantize.DEFAULT_PQ_M, help="PQ sub-spaces; must divide dim")
+    args = ap.parse_args(argv)
+    if args.chunk_chars <= 0:
+        ap.error("--chunk-chars must be positive")
+    if not 0 <= args.overlap <= args.chunk_chars // 2:
+        ap.error("--overlap must be >= 0 and at most half of --chunk-chars")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    common = dict(
+        chunk_chars=args.chunk_chars, overlap=args.overlap, workers=args.workers,
+        batch_size=args.embed_batch, concurrency=args.embed_concurrency, dtype=args.dtype,
+        ann=args.ann, hnsw_m=args.hnsw_m, ef_construction=args.hnsw_ef_construction,
+        quant=args.quant, pq_m=args.pq_m,
+    )
+    embedder = emb.from_spec(args.embedder)
+    if args.full:
+        stats = build(args.source, args.out, embedder, **common)
+    else:
+        stats = update(args.source, args.out, embedder, compact_ratio=args.compact_ratio, **common)
+    logger.info("built %s: %s", args.out, stats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+Small in-process caches that live at module scope and therefore survive
+across warm invocations of the same Lambda container.
+
+TTLCache is a bounded LRU whose entries also expire after `ttl` seconds.
+Expiry uses wall-clock time so entries persisted to /tmp remain meaningful
+after the module is re-imported in the same sandbox.
+"""
+from __future__ import annotations
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterator, Optional, Tuple
+import hashlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+
+class TTLCache:
+    def __init__(self, maxsize: int = 512, ttl: float = 3600.0, clock: Callable[[], float] = time.time):
+        self.maxsize = int(maxsize)
+        self.ttl = float(ttl)
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[0] > self.clock():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any, expires_at: Optional[float] = None) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (self.clock() + self.ttl if expires_at is None else expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> Any:
+        with self._lock:
+            item = self._data.pop(key, None)
+            return item[1] if item else None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def items(self) -> Iterator[Tuple[Hashable, float, Any]]:
+        """(key, expires_at, value) for live entries, least recently used first."""
+        now = self.clock()
+        with self._lock:
+            snapshot = list(self._data.items())
+        for key, (expires_at, value) in snapshot:
+            if expires_at > now:
+                yield key, expires_at, value
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._data)}
+
+
+class VectorCache(TTLCache):
+    """
+    TTLCache of str -> float32 vector that can be persisted to an .npz file
+    (no pickle), e.g. under /tmp to be picked up by a re-initialised module.
+    maybe_save() rewrites the file at most every `save_every_s` seconds, so
+    the request path does not serialise the whole cache on each miss.
+    """
+
+    def __init__(self, maxsize: int = 512, ttl: float = 3600.0, path: str = "",
+                 save_every_s: float = 60.0, clock: Callable[[], float] = time.time):
+        super().__init__(maxsize, ttl, clock)
+        self.path = path
+        self.save_every_s = float(save_every_s)
+        self.dirty = False
+        self._saved_at = self.clock()
+
+    def put(self, key: Hashable, value: Any, expires_at: Optional[float] = None) -> None:
+        super().put(key, value, expires_at)
+        self.dirty = True
+
+    def load(self) -> int:
+        """Merge entries from `path`; a missing or unreadable file is ignored."""
+        if not self.path or not os.path.exists(self.path):
+            return 0
+        try:
+            with np.load(self.path, allow_pickle=False) as npz:
+                keys, expiry, vectors = npz["keys"], npz["expires"], npz["vectors"]
+        except (OSError, ValueError, KeyError):
+            return 0
+        now = self.clock()
+        loaded = 0
+        for key, expires_at, vec in zip(keys.tolist(), expiry.tolist(), vectors):
+            if expires_at > now:
+                TTLCache.put(self, key, vec, expires_at)
+                loaded += 1
+        return loaded
+
+    def save(self) -> bool:
+        """Write live entries to `path` atomically if anything changed since the last save."""
+        if not self.path or not self.dirty:
+            return False
+        entries = list(self.items())
+        if not entries:
+            return False
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as fh:
+            np.savez(
+                fh,
+                keys=np.array([k for k, _, _ in entries], dtype=str),
+                expires=np.array([e for _, e, _ in entries], dtype=np.float64),
+                vectors=np.stack([np.asarray(v, dtype=np.float32) for _, _, v in entries]),
+            )
+        os.replace(tmp, self.path)
+        self.dirty = False
+        self._saved_at = self.clock()
+        return True
+
+    def maybe_save(self) -> bool:
+        """save() if the last one is at least `save_every_s` old."""
+        if self.clock() - self._saved_at < self.save_every_s:
+            return False
+        return self.save()
+
+
+def fingerprint(*parts: Any) -> str:
+    """Stable hash of JSON-serialisable parts (order-sensitive)."""
+    blob = json.dumps(parts, ensure_ascii=False, separators=(",", ":"), sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier cache of model responses.
+
+    exact     key = fingerprint(scope, question); scope is everything else
+              that shapes the prompt (model, system prompt, context, history)
+    semantic  optional: within the same scope, a question whose embedding has
+              cosine >= `min_sim` with a cached question reuses its answer
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: float = 900.0, min_sim: float = 0.0,
+                 per_scope: int = 32):
+        self.exact = TTLCache(maxsize, ttl)
+        self.scopes = TTLCache(maxsize, ttl)   # scope -> (question vectors, exact keys)
+        self.min_sim = float(min_sim)
+        self.per_scope = int(per_scope)
+        self.counts = {"exact": 0, "semantic": 0, "misses": 0}
+
+    @property
+    def semantic(self) -> bool:
+        return 0.0 < self.min_sim <= 1.0
+
+    def get(self, scope: str, question: str,
+            qvec: Optional[np.ndarray] = None) -> Tuple[Optional[Dict], Optional[str]]:
+        """Return (value, tier) where tier is "exact", "semantic" or None on a miss."""
+        value, tier = self._lookup(scope, question, qvec)
+        self.counts[tier or "misses"] += 1
+        return value, tier
+
+    def _lookup(self, scope: str, question: str, qvec: Optional[np.ndarray]) -> Tuple[Optional[Dict], Optional[str]]:
+        hit = self.exact.get(fingerprint(scope, question))
+        if hit is not None:
+            return hit, "exact"
+        if not self.semantic or qvec is None:
+            return None, None
+        entry = self.scopes.get(scope)
+        if entry is None:
+            return None, None
+        mat, keys = entry
+        sims = mat @ np.asarray(qvec, dtype=np.float32)
+        best = int(np.argmax(sims))
+        if sims[best] < self.min_sim:
+            return None, None
+        hit = self.exact.get(keys[best])
+        return (hit, "semantic") if hit is not None else (None, None)
+
+    def put(self, scope: str, question: str, value: Dict, qvec: Optional[np.ndarray] = None) -> None:
+        key = fingerprint(scope, question)
+        self.exact.put(key, value)
+        if not self.semantic or qvec is None:
+            return
+        vec = np.asarray(qvec, dtype=np.float32).reshape(1, -1)
+        entry = self.scopes.pop(scope)
+        if entry is not None and entry[0].shape[1] == vec.shape[1]:
+            mat, keys = entry
+            mat, keys = np.vstack([mat, vec])[-self.per_scope:], (keys + [key])[-self.per_scope:]
+        else:
+            mat, keys = vec, [key]
+        self.scopes.put(scope, (mat, keys))
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self.counts, size=len(self.exact))
@@ -0,0 +1,225 @@
+"""
+Document loading and overlap-aware chunking for the index build job.
+
+Everything here is a plain top-level function so it can run inside a
+ProcessPoolExecutor worker.
+"""
+from __future__ import annotations
+from datetime import datetime, timezone
+from html.parser import HTMLParser
+from typing import Dict, Iterator, List, Optional, Tuple
+import hashlib
+import json
+import os
+import re
+
+SUPPORTED_EXTS = {".md", ".markdown", ".txt", ".html", ".htm", ".json", ".jsonl", ".pdf"}
+
+DEFAULT_CHUNK_CHARS = 800
+DEFAULT_OVERLAP = 150
+
+# paragraph breaks first, then sentence ends; the delimiter stays with the left unit
+_UNIT_RE = re.compile(r".+?(?:\n\s*\n|(?<=[.!?])\s+|$)", re.S)
+_MD_TITLE_RE = re.compile(r"^\s*#\s+(.+)$", re.M)
+_WS_RE = re.compile(r"[ \t]+")
+
+
+class _HTMLText(HTMLParser):
+    _SKIP = {"script", "style", "noscript", "head"}
+    _BLOCK = {"p", "div", "br", "li", "h1", "h2", "h3", "h4", "h5", "h6", "tr", "section", "article"}
+
+    def __init__(self):
+        super().__init__()
+        self.parts: List[str] = []
+        self.title = ""
+        self._skip = 0
+        self._in_title = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "title":
+            self._in_title = True
+        if tag in self._SKIP:
+            self._skip += 1
+        elif tag in self._BLOCK:
+            self.parts.append("\n\n")
+
+    def handle_endtag(self, tag):
+        if tag == "title":
+            self._in_title = False
+        if tag in self._SKIP and self._skip:
+            self._skip -= 1
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title += data
+        elif not self._skip:
+            self.parts.append(data)
+
+
+def _clean(text: str) -> str:
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    text = _WS_RE.sub(" ", text)
+    return re.sub(r"\n{3,}", "\n\n", text).strip()
+
+
+def _file_date(path: str) -> str:
+    return datetime.fromtimestamp(os.path.getmtime(path), tz=timezone.utc).date().isoformat()
+
+
+def _doc_from_mapping(obj: Dict, doc_id: str, fallback_title: str, date: str) -> Optional[Dict]:
+    text = obj.get("text") or obj.get("content") or obj.get("body")
+    if not isinstance(text, str) or not text.strip():
+        return None
+    return {
+        "doc_id": str(obj.get("id") or doc_id),
+        "title": str(obj.get("title") or fallback_title),
+        "url": obj.get("url") or obj.get("source") or "",
+        "date": str(obj.get("date") or date),
+        "text": _clean(text),
+    }
+
+
+def load_documents(path: str, root: str) -> List[Dict]:
+    """
+    Convert one source file to plain-text documents
+    {doc_id, title, url, date, text}. JSON/JSONL files may hold many.
+    """
+    rel = os.path.relpath(path, root)
+    name = os.path.splitext(os.path.basename(path))[0]
+    ext = os.path.splitext(path)[1].lower()
+    date = _file_date(path)
+
+    if ext == ".pdf":
+        try:
+            from pypdf import PdfReader  # optional; only needed for PDF sources
+        except ImportError as err:
+            raise RuntimeError(f"{rel}: install pypdf to index PDF sources") from err
+        text = "\n\n".join(page.extract_text() or "" for page in PdfReader(path).pages)
+        return [{"doc_id": rel, "title": name, "url": "", "date": date, "text": _clean(text)}]
+
+    with open(path, encoding="utf-8", errors="replace") as fh:
+        raw = fh.read()
+
+    if ext in (".html", ".htm"):
+        parser = _HTMLText()
+        parser.feed(raw)
+        title = _clean(parser.title) or name
+        return [{"doc_id": rel, "title": title, "url": "", "date": date, "text": _clean("".join(parser.parts))}]
+
+    if ext == ".json":
+        obj = json.loads(raw)
+        items = obj if isinstance(obj, list) else [obj]
+        docs = (_doc_from_mapping(o, f"{rel}#{i}", name, date) for i, o in enumerate(items) if isinstance(o, dict))
+        return [d for d in docs if d]
+
+    if ext == ".jsonl":
+        out = []
+        for i, line in enumerate(raw.splitlines()):
+            if line.strip():
+                doc = _doc_from_mapping(json.loads(line), f"{rel}#{i}", name, date)
+                if doc:
+                    out.append(doc)
+        return out
+
+    m = _MD_TITLE_RE.search(raw) if ext in (".md", ".markdown") else None
+    title = m.group(1).strip() if m else name
+    return [{"doc_id": rel, "title": title, "url": "", "date": date, "text": _clean(raw)}]
+
+
+def chunk_spans(text: str, chunk_chars: int = DEFAULT_CHUNK_CHARS, overlap: int = DEFAULT_OVERLAP) -> List[Tuple[int, int]]:
+    """
+    Split `text` into (start, end) spans of at most ~chunk_chars, breaking on
+    paragraph/sentence boundaries. Consecutive spans share up to `overlap`
+    trailing characters of whole sentences; a sentence longer than a chunk is
+    hard-split with the same overlap. Raises ValueError unless
+    chunk_chars > 0 and 0 <= overlap <= chunk_chars // 2 (so every span
+    advances by at least half a chunk).
+    """
+    if chunk_chars <= 0:
+        raise ValueError(f"chunk_chars must be positive, got {chunk_chars}")
+    if not 0 <= overlap <= chunk_chars // 2:
+        raise ValueError(f"overlap must be in [0, chunk_chars // 2], got {overlap} for chunk_chars={chunk_chars}")
+    if not text:
+        return []
+
+    units: List[Tuple[int, int]] = []
+    for m in _UNIT_RE.finditer(text):
+        s, e = m.span()
+        if e <= s:
+            continue
+        while e - s > chunk_chars:
+            units.append((s, s + chunk_chars))
+            s += chunk_chars - overlap
+        units.append((s, e))
+
+    spans: List[Tuple[int, int]] = []
+    i = 0
+    while i < len(units):
+        j = i
+        start = units[i][0]
+        while j + 1 < len(units) and units[j + 1][1] - start <= chunk_chars:
+            j += 1
+        end = units[j][1]
+        spans.append((start, end))
+        if j + 1 >= len(units):
+            break
+        # step back over whole units that fit in the overlap window
+        nxt = j + 1
+        while nxt - 1 > i and end - units[nxt - 1][0] <= overlap:
+            nxt -= 1
+        i = nxt
+    return spans
+
+
+def content_hash(text: str) -> str:
+    """Short, stable fingerprint of a chunk's text (used to skip re-embedding)."""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def file_hash(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def chunk_document(doc: Dict, chunk_chars: int = DEFAULT_CHUNK_CHARS, overlap: int = DEFAULT_OVERLAP) -> List[Dict]:
+    text = doc["text"]
+    out = []
+    for n, (s, e) in enumerate(chunk_spans(text, chunk_chars, overlap)):
+        piece = text[s:e].strip()
+        if not piece:
+            continue
+        out.append({
+            "id": f"{doc['doc_id']}#{n}",
+            "doc_id": doc["doc_id"],
+            "title": doc["title"],
+            "url": doc["url"],
+            "date": doc["date"],
+            "chunk": n,
+            "char_start": s,
+            "char_end": e,
+            "text": piece,
+            "hash": content_hash(piece),
+        })
+    return out
+
+
+def process_file(path: str, root: str, chunk_chars: int, overlap: int) -> List[Dict]:
+    """Worker entry point: load one source file and return its chunks."""
+    rel = os.path.relpath(path, root)
+    chunks: List[Dict] = []
+    for doc in load_documents(path, root):
+        for chunk in chunk_document(doc, chunk_chars, overlap):
+            chunk["source"] = rel
+            chunks.append(chunk)
+    return chunks
+
+
+def iter_source_files(root: str) -> Iterator[str]:
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for fn in sorted(filenames):
+            if os.path.splitext(fn)[1].lower() in SUPPORTED_EXTS:
+                yield os.path.join(dirpath, fn)
@@ -0,0 +1,272 @@
+# conversations.py
+"""
+Server-side conversation history, so a client sends a session id and the new
+question instead of re-sending the whole transcript on every turn.
+
+    MemoryStore     per-process dict (local runs; lost on cold start)
+    SQLiteStore     one local file, e.g. /tmp/conversations.db (stand-in for DynamoDB)
+    DynamoDBStore   table with partition key `session_id` (S) and sort key `seq` (N);
+                    `expires_at` is the table's TTL attribute; seq 0 holds the
+                    session's running summary (history.py)
+
+Each turn is stored with its token count, so `recent()` reads newest-first
+and stops at the token budget: one bounded query, no re-tokenization, and
+the same work on turn 50 as on turn 2.
+
+Expiry is the same in every backend: each turn, and the summary, is kept for
+`ttl` seconds after it was written (DynamoDB's per-item TTL), so a session
+fades out turn by turn rather than living on while it is used.
+
+The handler stores sessions under session_key(owner, session_id), so one
+caller cannot read another's conversation by sending its session id.
+"""
+from __future__ import annotations
+from typing import Iterable, List, Optional, Sequence, Tuple
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from cache import TTLCache
+from utils import HistoryMsg, est_tokens
+
+CONVERSATION_TTL_S = float(os.getenv("CONVERSATION_TTL_S", str(7 * 24 * 3600)))
+MAX_TURNS_PER_SESSION = 200   # memory store only; older turns are dropped
+
+_SESSION_RE = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+
+
+def parse_session_id(value) -> Optional[str]:
+    if value is None or value == "":
+        return None
+    if not isinstance(value, str) or not _SESSION_RE.match(value):
+        raise ValueError("'session_id' must be 1-128 characters of letters, digits, '.', '_', ':' or '-'.")
+    return value
+
+
+def session_key(owner: Optional[str], session_id: str) -> str:
+    """Store key of a client's session id, scoped to the authenticated caller ("" if anonymous)."""
+    return f"{owner or ''}#{session_id}"
+
+
+def _window(rows: Iterable[Tuple[str, str, int]], max_tokens: int) -> List[HistoryMsg]:
+    """Newest-first (role, content, tokens) rows -> oldest-first messages within budget."""
+    out: List[HistoryMsg] = []
+    running = 0
+    for role, content, tokens in rows:
+        running += int(tokens)
+        if running > max_tokens:
+            break
+        out.append({"role": role, "content": content})
+    out.reverse()
+    return out
+
+
+class ConversationStore:
+    name = "base"
+
+    def recent(self, session_id: str, max_tokens: int) -> List[HistoryMsg]:
+        """Most recent turns of the session whose tokens fit `max_tokens`, oldest first."""
+        raise NotImplementedError
+
+    def append(self, session_id: str, messages: Sequence[HistoryMsg]) -> None:
+        raise NotImplementedError
+
+    def clear(self, session_id: str) -> None:
+        raise NotImplementedError
+
+    def get_summary(self, session_id: str) -> str:
+        """Running summary of the turns before the recent window (history.py); "" if none."""
+        raise NotImplementedError
+
+    def put_summary(self, session_id: str, summary: str) -> None:
+        raise NotImplementedError
+
+
+class MemoryStore(ConversationStore):
+    name = "memory"
+
+    def __init__(self, max_sessions: int = 1024, ttl: float = CONVERSATION_TTL_S, clock=time.time):
+        self.sessions = TTLCache(max_sessions, ttl, clock)
+        self.summaries = TTLCache(max_sessions, ttl, clock)
+        self._lock = threading.Lock()
+
+    def recent(self, session_id: str, max_tokens: int) -> List[HistoryMsg]:
+        now = self.sessions.clock()
+        turns = self.sessions.get(session_id) or []
+        return _window((t[:3] for t in reversed(turns) if t[3] > now), max_tokens)
+
+    def append(self, session_id: str, messages: Sequence[HistoryMsg]) -> None:
+        now = self.sessions.clock()
+        expires_at = now + self.sessions.ttl
+        with self._lock:
+            turns = [t for t in self.sessions.get(session_id) or [] if t[3] > now]
+            turns.extend((m["role"], m["content"], est_tokens(m["content"]), expires_at) for m in messages)
+            self.sessions.put(session_id, turns[-MAX_TURNS_PER_SESSION:])   # lives as long as its newest turn
+
+    def clear(self, session_id: str) -> None:
+        self.sessions.pop(session_id)
+        self.summaries.pop(session_id)
+
+    def get_summary(self, session_id: str) -> str:
+        return self.summaries.get(session_id) or ""
+
+    def put_summary(self, session_id: str, summary: str) -> None:
+        self.summaries.put(session_id, summary)
+
+
+class SQLiteStore(ConversationStore):
+    name = "sqlite"
+    _PURGE_EVERY = 256   # appends between deletions of expired turns
+
+    def __init__(self, path: str, ttl: float = CONVERSATION_TTL_S):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._appends = 0
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS summaries ("
+            " session_id TEXT PRIMARY KEY, expires_at REAL NOT NULL, summary TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS turns ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL,"
+            " role TEXT NOT NULL, content TEXT NOT NULL, tokens INTEGER NOT NULL, expires_at REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS turns_session ON turns (session_id, seq);"
+        )
+
+    def recent(self, session_id: str, max_tokens: int) -> List[HistoryMsg]:
+        with self._lock:
+            cur = self._db.execute(
+                "SELECT role, content, tokens FROM turns WHERE session_id = ? AND expires_at > ?"
+                " ORDER BY seq DESC", (session_id, time.time())
+            )
+            return _window(cur, max_tokens)   # the cursor is lazy: stops reading at the budget
+
+    def append(self, session_id: str, messages: Sequence[HistoryMsg]) -> None:
+        expires_at = time.time() + self.ttl
+        rows = [(session_id, m["role"], m["content"], est_tokens(m["content"]), expires_at) for m in messages]
+        with self._lock:
+            with self._db:
+                self._db.execute("BEGIN")
+                self._db.executemany(
+                    "INSERT INTO turns (session_id, role, content, tokens, expires_at) VALUES (?, ?, ?, ?, ?)", rows
+                )
+            self._appends += 1
+            if self._appends % self._PURGE_EVERY == 0:
+                self._purge()
+
+    def get_summary(self, session_id: str) -> str:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT summary FROM summaries WHERE session_id = ? AND expires_at > ?", (session_id, time.time())
+            ).fetchone()
+        return row[0] if row else ""
+
+    def put_summary(self, session_id: str, summary: str) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO summaries (session_id, expires_at, summary) VALUES (?, ?, ?)"
+                " ON CONFLICT(session_id) DO UPDATE SET summary = excluded.summary,"
+                " expires_at = excluded.expires_at",
+                (session_id, time.time() + self.ttl, summary),
+            )
+
+    def _purge(self) -> None:
+        with self._db:
+            self._db.execute("BEGIN")
+            now = time.time()
+            self._db.execute("DELETE FROM turns WHERE expires_at <= ?", (now,))
+            self._db.execute("DELETE FROM summaries WHERE expires_at <= ?", (now,))
+
+    def clear(self, session_id: str) -> None:
+        with self._lock:
+            with self._db:
+                self._db.execute("BEGIN")
+                self._db.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+                self._db.execute("DELETE FROM summaries WHERE session_id = ?", (session_id,))
+
+
+class DynamoDBStore(ConversationStore):
+    name = "dynamodb"
+    PAGE = 16   # items per Query page; most windows fit in one or two pages
+
+    def __init__(self, table_name: str, ttl: float = CONVERSATION_TTL_S, resource=None):
+        import boto3  # only needed when this backend is configured
+        self.table = (resource or boto3.resource("dynamodb")).Table(table_name)
+        self.ttl = ttl
+
+    def _rows(self, session_id: str) -> Iterable[Tuple[str, str, int]]:
+        kwargs = {
+            "KeyConditionExpression": "session_id = :s",
+            "ExpressionAttributeValues": {":s": session_id},
+            "ProjectionExpression": "#r, content, tokens, expires_at",
+            "ExpressionAttributeNames": {"#r": "role"},
+            "ScanIndexForward": False,
+            "Limit": self.PAGE,
+        }
+        now = time.time()
+        while True:
+            page = self.table.query(**kwargs)
+            for item in page.get("Items", []):
+                if "role" not in item:   # seq 0: the session's summary item
+                    continue
+                if float(item.get("expires_at", now + 1)) > now:   # TTL deletion is lazy
+                    yield item["role"], item["content"], int(item["tokens"])
+            if "LastEvaluatedKey" not in page:
+                return
+            kwargs["ExclusiveStartKey"] = page["LastEvaluatedKey"]
+
+    def recent(self, session_id: str, max_tokens: int) -> List[HistoryMsg]:
+        return _window(self._rows(session_id), max_tokens)
+
+    def append(self, session_id: str, messages: Sequence[HistoryMsg]) -> None:
+        seq = time.time_ns()
+        expires_at = int(time.time() + self.ttl)
+        with self.table.batch_writer() as batch:
+            for i, m in enumerate(messages):
+                batch.put_item(Item={
+                    "session_id": session_id, "seq": seq + i, "role": m["role"],
+                    "content": m["content"], "tokens": est_tokens(m["content"]),
+                    "expires_at": expires_at,
+                })
+
+    def get_summary(self, session_id: str) -> str:
+        item = self.table.get_item(Key={"session_id": session_id, "seq": 0}).get("Item") or {}
+        return item.get("summary", "") if float(item.get("expires_at", 0)) > time.time() else ""
+
+    def put_summary(self, session_id: str, summary: str) -> None:
+        self.table.put_item(Item={"session_id": session_id, "seq": 0, "summary": summary,
+                                  "expires_at": int(time.time() + self.ttl)})
+
+    def clear(self, session_id: str) -> None:
+        kwargs = {
+            "KeyConditionExpression": "session_id = :s",
+            "ExpressionAttributeValues": {":s": session_id},
+            "ProjectionExpression": "session_id, seq",
+        }
+        with self.table.batch_writer() as batch:
+            while True:
+                page = self.table.query(**kwargs)
+                for key in page.get("Items", []):
+                    batch.delete_item(Key=key)
+                if "LastEvaluatedKey" not in page:
+                    return
+                kwargs["ExclusiveStartKey"] = page["LastEvaluatedKey"]
+
+
+def from_spec(spec: str) -> Optional[ConversationStore]:
+    """"" -> disabled, "memory", "sqlite:<path>", "dynamodb:<table>"."""
+    kind, _, rest = (spec or "").partition(":")
+    if not kind:
+        return None
+    if kind == "memory":
+        return MemoryStore()
+    if kind == "sqlite":
+        return SQLiteStore(rest or "/tmp/conversations.db")
+    if kind == "dynamodb":
+        if not rest:
+            raise ValueError("dynamodb conversation store needs a table name: dynamodb:<table>")
+        return DynamoDBStore(rest)
+    raise ValueError(f"unknown conversation store spec: {spec!r}")
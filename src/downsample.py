@@ -0,0 +1,157 @@
+"""
+Shape-preserving downsampling of vitals series for the prompt context.
+
+    lttb    Largest-Triangle-Three-Buckets: one point per bucket, the one that
+            forms the largest triangle with the previous pick and the next
+            bucket's mean. Keeps the visual shape (peaks, turns) of a series.
+    minmax  min/max envelope: the lowest and highest point of every bucket.
+
+Values may be one column or several aligned ones (a week table, or a Series'
+observed + predicted); columns are scaled to [0, 1] and NaNs do not count.
+Both return sorted indices into the input.
+
+select_rows / select always keep the latest observed row, keep every forecast
+row after it when they fit (else thin the forecast the same way), and spend
+what is left of the budget on a downsampled history before it.
+"""
+from __future__ import annotations
+from typing import Optional, Sequence
+import warnings
+
+import numpy as np
+
+from series import Series
+
+METHODS = ("lttb", "minmax", "none")
+
+
+def _columns(y: np.ndarray) -> np.ndarray:
+    """2-D float copy with every column scaled to [0, 1] (NaN kept)."""
+    y = np.asarray(y, dtype=np.float64)
+    if y.ndim == 1:
+        y = y[:, None]
+    with warnings.catch_warnings():                         # all-NaN columns
+        warnings.simplefilter("ignore", RuntimeWarning)
+        lo = np.nanmin(y, axis=0)
+        span = np.nanmax(y, axis=0) - lo
+    span[~(span > 0)] = 1.0
+    lo[np.isnan(lo)] = 0.0
+    return (y - lo) / span
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    n = x.shape[0]
+    if n_out >= n:
+        return np.arange(n)
+    if n_out <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if n_out == 1:
+        return np.array([n - 1])
+    if n_out == 2:
+        return np.array([0, n - 1])
+    x = x.astype(np.float64)
+    y = _columns(y)
+    seen = ~np.isnan(y)
+    # interior points 1..n-2 split into n_out-2 buckets
+    edges = (1 + np.arange(n_out - 1) * ((n - 2) / (n_out - 2))).astype(np.int64)
+    edges[-1] = n - 1
+    # per-bucket means of the *next* bucket (the last one looks at the final point)
+    csx = np.concatenate(([0.0], np.cumsum(x)))
+    csy = np.vstack([np.zeros((1, y.shape[1])), np.cumsum(np.where(seen, y, 0.0), axis=0)])
+    csn = np.vstack([np.zeros((1, y.shape[1])), np.cumsum(seen, axis=0)])
+    nxt_lo = np.append(edges[1:-1], n - 1)
+    nxt_hi = np.append(edges[2:], n)
+    mean_x = (csx[nxt_hi] - csx[nxt_lo]) / (nxt_hi - nxt_lo)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_y = (csy[nxt_hi] - csy[nxt_lo]) / (csn[nxt_hi] - csn[nxt_lo])
+
+    out = np.empty(n_out, dtype=np.int64)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for b in range(n_out - 2):
+        lo, hi = edges[b], edges[b + 1]
+        bx, by = x[lo:hi, None], y[lo:hi]
+        area = np.abs((x[a] - mean_x[b]) * (by - y[a]) - (x[a] - bx) * (mean_y[b] - y[a]))
+        a = lo + int(np.argmax(np.where(area == area, area, 0.0).sum(axis=1)))
+        out[b + 1] = a
+    return out
+
+
+def minmax_indices(y: np.ndarray, n_out: int) -> np.ndarray:
+    n = y.shape[0]
+    if n_out >= n:
+        return np.arange(n)
+    if n_out <= 1:
+        return np.array([n - 1])[:max(n_out, 0)]
+    y = _columns(y)
+
+    def envelope(buckets: int) -> np.ndarray:
+        size = -(-n // buckets)
+        grid = np.full((buckets * size, y.shape[1]), np.nan)
+        grid[:n] = y
+        grid = grid.reshape(buckets, size, y.shape[1])
+        valid = ~np.isnan(grid).all(axis=1)                   # (bucket, column)
+        base = np.arange(buckets)[:, None] * size
+        lo = base + np.argmin(np.where(np.isnan(grid), np.inf, grid), axis=1)
+        hi = base + np.argmax(np.where(np.isnan(grid), -np.inf, grid), axis=1)
+        return np.unique(np.concatenate([lo[valid], hi[valid]]))
+
+    # more buckets -> more points; find the most that still fit
+    lo, hi, best = 1, n_out // 2, np.array([n - 1])
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        picked = envelope(mid)
+        if picked.shape[0] <= n_out:
+            best, lo = picked, mid + 1
+        else:
+            hi = mid - 1
+    # with many columns the envelope comes in steps of up to 2 x columns points:
+    # fill the rest of the budget with evenly spread LTTB picks
+    if best.shape[0] < n_out:
+        rest = np.setdiff1d(lttb_indices(np.arange(n), y, n_out), best)
+        take = min(n_out - best.shape[0], rest.shape[0])
+        best = np.union1d(best, rest[np.linspace(0, rest.shape[0] - 1, take).round().astype(np.int64)])
+    return best
+
+
+def _pick(x: np.ndarray, y: np.ndarray, n_out: int, method: str) -> np.ndarray:
+    if n_out <= 0 or x.shape[0] == 0:
+        return np.zeros(0, dtype=np.int64)
+    if method == "minmax":
+        return minmax_indices(y, n_out)
+    return lttb_indices(x, y, n_out)
+
+
+def select_rows(weeks: np.ndarray, values: np.ndarray, observed_cols: Sequence[int],
+                n_keep: int, method: str = "lttb") -> np.ndarray:
+    """
+    Indices of at most `n_keep` rows of a week-aligned table (see
+    utils._week_table) to show; `observed_cols` are the measured columns.
+    """
+    n = weeks.shape[0]
+    if n_keep >= n:
+        return np.arange(n)
+    if method == "none" or n_keep <= 0:
+        return np.arange(n - max(n_keep, 0), n)
+    cols = list(observed_cols)
+    seen = np.flatnonzero(~np.isnan(values[:, cols]).all(axis=1)) if cols else np.zeros(0, np.int64)
+    if seen.size == 0:                                       # forecast only
+        return _pick(weeks, values, n_keep, method)
+    last = int(seen[-1])
+    f_room = min(n - last - 1, n_keep - 1)
+    forecast = last + 1 + _pick(weeks[last + 1:], values[last + 1:], f_room, method)
+    history = _pick(weeks[:last], values[:last], n_keep - 1 - f_room, method)
+    return np.concatenate([history, [last], forecast]).astype(np.int64)
+
+
+def select(series: Series, n_keep: int, method: str = "lttb") -> np.ndarray:
+    """Indices of at most `n_keep` points of `series` to show."""
+    values = np.column_stack([series.observed, series.predicted])
+    return select_rows(series.weeks, values, [0], n_keep, method)
+
+
+def parse_method(name: Optional[str]) -> str:
+    name = (name or "lttb").lower()
+    if name not in METHODS:
+        raise ValueError(f"Unknown downsampling method {name!r}; expected one of {', '.join(METHODS)}.")
+    return name
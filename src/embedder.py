@@ -0,0 +1,163 @@
+"""
+Text embedders shared by the index build job and the Lambda retriever.
+
+An embedder is identified by a spec string that is stored in the index's
+meta.json, so queries are always embedded with the same model as the corpus:
+
+    "bedrock:<model-id>[:<dim>]"   e.g. "bedrock:amazon.titan-embed-text-v2:0:512"
+    "hashing[:<dim>]"              offline feature-hashing embedder (PoC / local runs)
+
+`embed(texts, deadline)` takes the request's pipeline.Deadline on the Lambda;
+network embedders end each call before it (the index build passes none).
+"""
+from __future__ import annotations
+from typing import TYPE_CHECKING, List, Optional, Sequence
+import json
+import re
+import threading
+import zlib
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from cache import TTLCache
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[.\-][a-z0-9]+)*")
+_WS_RE = re.compile(r"\s+")
+
+DEFAULT_DIM = 512
+
+
+class Embedder:
+    """Interface: embed a batch of texts into L2-normalised float32 rows."""
+
+    spec: str = ""
+    dim: int = 0
+
+    def embed(self, texts: Sequence[str], deadline=None) -> np.ndarray:  # pragma: no cover
+        raise NotImplementedError
+
+    def embed_one(self, text: str, deadline=None) -> np.ndarray:
+        return self.embed([text], deadline)[0]
+
+
+class HashingEmbedder(Embedder):
+    """
+    Deterministic bag-of-words/bigrams embedder using the hashing trick.
+    No network, no model weights; quality is lexical only.
+    """
+
+    def __init__(self, dim: int = DEFAULT_DIM):
+        self.dim = int(dim)
+        self.spec = f"hashing:{self.dim}"
+
+    def _features(self, text: str) -> List[str]:
+        toks = _TOKEN_RE.findall(text.lower())
+        return toks + [f"{a} {b}" for a, b in zip(toks, toks[1:])]
+
+    def embed(self, texts: Sequence[str], deadline=None) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for feat in self._features(text):
+                h = zlib.crc32(feat.encode("utf-8"))
+                out[i, h % self.dim] += 1.0 if (h >> 31) & 1 else -1.0
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return out / norms
+
+
+class BedrockEmbedder(Embedder):
+    """Amazon Titan text embeddings via bedrock-runtime InvokeModel."""
+
+    def __init__(self, model_id: str, dim: Optional[int] = None, client=None):
+        self.model_id = model_id
+        self.dim = int(dim) if dim else 0
+        self.spec = f"bedrock:{model_id}" + (f":{self.dim}" if dim else "")
+        self._client = client
+        self._timed = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                import boto3
+                self._client = boto3.client("bedrock-runtime")
+            return self._client
+
+    def _client_until(self, deadline):
+        """`client`, or with a deadline a copy whose read timeout ends before it (resilience.TimedClients)."""
+        if deadline is None:
+            return self.client
+        client = self.client
+        with self._lock:
+            if self._timed is None:
+                import resilience  # botocore; not needed by the offline embedders
+                self._timed = resilience.TimedClients(client)
+        return self._timed.until(deadline)
+
+    def _request(self, text: str) -> bytes:
+        body = {"inputText": text}
+        if self.dim and "v2" in self.model_id:
+            body.update({"dimensions": self.dim, "normalize": True})
+        return json.dumps(body).encode()
+
+    def embed(self, texts: Sequence[str], deadline=None) -> np.ndarray:
+        rows = []
+        for text in texts:
+            resp = self._client_until(deadline).invoke_model(modelId=self.model_id, body=self._request(text))
+            rows.append(json.loads(resp["body"].read())["embedding"])
+        if not rows:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        mat = np.asarray(rows, dtype=np.float32)
+        self.dim = mat.shape[1]
+        norms = np.linalg.norm(mat, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return mat / norms
+
+
+def normalize_query(text: str) -> str:
+    """Cache key form of a query: case-folded, whitespace-collapsed, outer punctuation dropped."""
+    return _WS_RE.sub(" ", text.casefold()).strip(" \t\n?!.,;:'\"")
+
+
+class CachedEmbedder(Embedder):
+    """
+    Wraps another embedder with a TTLCache keyed on (spec, normalized text),
+    so "How is my glucose?" and "how is my glucose" share one embedding call.
+    """
+
+    def __init__(self, inner: Embedder, cache: "TTLCache"):
+        self.inner = inner
+        self.cache = cache
+        self.spec = inner.spec
+
+    @property
+    def dim(self) -> int:  # BedrockEmbedder learns its dim from the first response
+        return self.inner.dim
+
+    def embed(self, texts: Sequence[str], deadline=None) -> np.ndarray:
+        keys = [f"{self.spec}|{normalize_query(t)}" for t in texts]
+        rows: List[Optional[np.ndarray]] = [self.cache.get(k) for k in keys]
+        todo = [i for i, row in enumerate(rows) if row is None]
+        if todo:
+            fresh = self.inner.embed([texts[i] for i in todo], deadline)
+            for i, vec in zip(todo, fresh):
+                rows[i] = vec
+                self.cache.put(keys[i], vec)
+        if not rows:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.stack(rows).astype(np.float32, copy=False)
+
+
+def from_spec(spec: str, client=None) -> Embedder:
+    kind, _, rest = spec.partition(":")
+    if kind == "hashing":
+        return HashingEmbedder(int(rest) if rest else DEFAULT_DIM)
+    if kind == "bedrock":
+        # model ids contain ":" themselves (e.g. "...-v2:0"); a trailing int > 16 is a dim
+        model_id, _, tail = rest.rpartition(":")
+        if model_id and tail.isdigit() and int(tail) > 16:
+            return BedrockEmbedder(model_id, int(tail), client=client)
+        return BedrockEmbedder(rest, client=client)
+    raise ValueError(f"unknown embedder spec: {spec!r}")
@@ -0,0 +1,236 @@
+"""
+Deterministic answers for questions that are pure look-ups over the vitals.
+
+"what was my latest systolic?", "average glucose over the visible weeks",
+"lowest resting heart rate in the last 4 weeks" ... are computed here with
+NumPy over the Series in the `ts_dict` from utils.validate_payload. A question is answered
+directly (skipping the model) only when the matcher is confident: exactly
+one statistic, at least one known metric, and nothing left over that would
+call for judgement ("should", "why", "what do you think", ...). Otherwise
+the computed numbers can still be handed to the model as exact hints.
+"""
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+import os
+import re
+
+import numpy as np
+
+from series import Series
+
+# metric phrases -> series; longest phrases are matched first
+_SERIES_PHRASES: Dict[str, Tuple[str, ...]] = {
+    "blood pressure": ("bp_sys", "bp_dia"),
+    "bp": ("bp_sys", "bp_dia"),
+    "systolic": ("bp_sys",),
+    "sbp": ("bp_sys",),
+    "diastolic": ("bp_dia",),
+    "dbp": ("bp_dia",),
+    "fasting blood glucose": ("glucose",),
+    "fasting glucose": ("glucose",),
+    "blood sugar": ("glucose",),
+    "glucose": ("glucose",),
+    "fbg": ("glucose",),
+    "sugar": ("glucose",),
+    "body weight": ("weight",),
+    "weight": ("weight",),
+    "resting heart rate": ("rhr",),
+    "heart rate": ("rhr",),
+    "pulse": ("rhr",),
+    "rhr": ("rhr",),
+    "bmi": ("bmi",),
+    "body mass index": ("bmi",),
+    "health age": ("health_age",),
+    "biological age": ("health_age",),
+}
+
+LABELS = {
+    "glucose": ("fasting glucose", "mg/dL"),
+    "weight": ("weight", "kg"),
+    "bp_sys": ("systolic blood pressure", "mmHg"),
+    "bp_dia": ("diastolic blood pressure", "mmHg"),
+    "rhr": ("resting heart rate", "bpm"),
+    "bmi": ("BMI", "kg/m²"),
+    "health_age": ("health age", "years"),
+}
+
+_STAT_WORDS: Dict[str, Tuple[str, ...]] = {
+    "latest": ("latest", "current", "currently", "last", "recent", "most recent", "now", "today"),
+    "mean": ("average", "avg", "mean", "typical"),
+    "min": ("lowest", "minimum", "min"),
+    "max": ("highest", "maximum", "max", "peak"),
+    "change": ("change", "changed", "trend", "trending", "difference", "delta", "improved", "dropped", "increased", "decreased"),
+    "forecast": ("forecast", "predicted", "prediction", "projected", "projection", "expected", "going to be"),
+}
+
+# words that ask for judgement or advice -> never answer without the model
+_JUDGEMENT = re.compile(
+    r"\b(how(?:'s| is| are| am)|doing|should|why|think|advice|advise|recommend|suggest|tips?|actions?|improve|help|worr\w*|"
+    r"normal|healthy|good|bad|ok|okay|risk\w*|concern\w*|explain|mean for|plan|goal|lower|reduce|diet|exercise)\b"
+)
+# filler that does not change the meaning of a stat question
+_FILLER = frozenset(
+    "a an the my me i is was were are what whats what's how much many of in on over for across to "
+    "value values reading readings level levels number numbers data observed measured visible shown "
+    "weeks week so far been has have period span all entire whole tell please give show can you your "
+    "during at this past last".split()
+)
+_WINDOW_RE = re.compile(r"\b(?:last|past|previous|recent)\s+(\d{1,2})\s+weeks?\b")
+_WEEK_RE = re.compile(r"\bweek\s+(\d{1,3})\b")
+_WORD_RE = re.compile(r"[a-z0-9']+")
+
+FASTPATH_MIN_CONFIDENCE = float(os.getenv("FASTPATH_MIN_CONFIDENCE", "0.8"))
+
+
+@dataclass
+class Result:
+    stat: Optional[str]
+    series: List[str]
+    confidence: float
+    answer: str = ""
+    facts: Dict[str, Dict] = field(default_factory=dict)
+
+    @property
+    def confident(self) -> bool:
+        return bool(self.answer) and self.confidence >= FASTPATH_MIN_CONFIDENCE
+
+
+def compute(stat: str, series: Series, window: Optional[int] = None) -> Optional[Dict]:
+    """
+    One statistic over a series' observed values. `window` keeps the last N
+    observed weeks; for stat="week" it is the week number instead.
+    forecast = last predicted value after the final observation.
+    """
+    if not series:
+        return None
+    weeks, obs, pred = series.weeks, series.observed, series.predicted
+    seen = series.has_observed
+    if stat == "week":
+        at = np.flatnonzero(weeks == window)
+        if at.size == 0:
+            return None
+        i = at[-1]
+        if seen[i]:
+            return {"value": float(obs[i]), "week": int(window)}
+        if np.isnan(pred[i]):
+            return None
+        return {"value": float(pred[i]), "week": int(window), "predicted": True}
+    if stat == "forecast":
+        last_obs = weeks[seen].max() if seen.any() else -1
+        future = (weeks > last_obs) & ~np.isnan(pred)
+        if not future.any():
+            return None
+        i = np.flatnonzero(future)[-1]
+        return {"value": float(pred[i]), "week": int(weeks[i]), "predicted": True}
+    w, v = weeks[seen], obs[seen]
+    if window:
+        w, v = w[-window:], v[-window:]
+    if v.size == 0:
+        return None
+    if stat == "latest":
+        return {"value": float(v[-1]), "week": int(w[-1])}
+    if stat == "mean":
+        return {"value": float(v.mean()), "from_week": int(w[0]), "to_week": int(w[-1]), "n": int(v.size)}
+    if stat in ("min", "max"):
+        i = int(v.argmin() if stat == "min" else v.argmax())
+        return {"value": float(v[i]), "week": int(w[i]), "from_week": int(w[0]), "to_week": int(w[-1])}
+    if stat == "change":
+        if v.size < 2:
+            return None
+        return {"value": float(v[-1] - v[0]), "start": float(v[0]), "end": float(v[-1]),
+                "from_week": int(w[0]), "to_week": int(w[-1])}
+    return None
+
+
+def _fmt(x: float) -> str:
+    return f"{x:.1f}".rstrip("0").rstrip(".") if abs(x - round(x)) > 1e-9 else str(int(round(x)))
+
+
+def _sentence(stat: str, series: str, fact: Dict) -> str:
+    label, unit = LABELS[series]
+    val = _fmt(fact["value"])
+    if stat == "week":
+        kind = "predicted" if fact.get("predicted") else "observed"
+        return f"Your {kind} {label} in week {fact['week']} is {val} {unit}."
+    if stat == "latest":
+        return f"Your latest observed {label} is {val} {unit} (week {fact['week']})."
+    if stat == "mean":
+        return (f"Your average observed {label} over weeks {fact['from_week']}–{fact['to_week']} "
+                f"is {val} {unit} ({fact['n']} readings).")
+    if stat in ("min", "max"):
+        word = "lowest" if stat == "min" else "highest"
+        return (f"Your {word} observed {label} over weeks {fact['from_week']}–{fact['to_week']} "
+                f"is {val} {unit} (week {fact['week']}).")
+    if stat == "change":
+        direction = "up" if fact["value"] > 0 else "down" if fact["value"] < 0 else "unchanged"
+        delta = f"{direction} {_fmt(abs(fact['value']))} {unit}" if direction != "unchanged" else "unchanged"
+        return (f"Your {label} went from {_fmt(fact['start'])} {unit} (week {fact['from_week']}) to "
+                f"{_fmt(fact['end'])} {unit} (week {fact['to_week']}), {delta}.")
+    return f"Your {label} is predicted to be {val} {unit} by week {fact['week']} (a forecast, not a measurement)."
+
+
+def _match(question: str) -> Tuple[Optional[str], List[str], float, Optional[int]]:
+    text = " " + re.sub(r"[^a-z0-9'\s]", " ", question.lower()) + " "
+    window_m = _WINDOW_RE.search(text)
+    window = int(window_m.group(1)) if window_m else None
+    if window_m:
+        text = text.replace(window_m.group(0), " ")
+    week_m = _WEEK_RE.search(text)
+    if week_m:
+        text = text.replace(week_m.group(0), " ")
+
+    series: List[str] = []
+    for phrase in sorted(_SERIES_PHRASES, key=len, reverse=True):
+        if f" {phrase} " in text:
+            for s in _SERIES_PHRASES[phrase]:
+                if s not in series:
+                    series.append(s)
+            text = text.replace(f" {phrase} ", " ")
+
+    stats = []
+    for stat, words in _STAT_WORDS.items():
+        for word in sorted(words, key=len, reverse=True):
+            if f" {word} " in text:
+                stats.append(stat)
+                text = text.replace(f" {word} ", " ")
+                break
+    # "last" alone is a latest-value cue, but "last N weeks" was consumed as a window
+    if len(stats) > 1 and "latest" in stats:
+        stats.remove("latest")
+    scale = 1.0
+    if week_m and not stats:
+        stats, window = ["week"], int(week_m.group(1))
+    elif not stats and series:
+        stats, scale = ["latest"], 0.9   # "what's my blood pressure?" -> latest reading
+
+    if not series or len(stats) != 1:
+        return None, series, 0.0, window
+    if _JUDGEMENT.search(question.lower()):
+        return stats[0], series, 0.3, window
+    leftover = [w for w in _WORD_RE.findall(text) if w not in _FILLER]
+    confidence = scale * max(0.0, 1.0 - 0.25 * len(leftover))
+    return stats[0], series, confidence, window
+
+
+def answer(question: str, ts_dict: Dict[str, Series]) -> Result:
+    """Match `question` and compute the requested statistic for every mentioned metric."""
+    stat, series, confidence, window = _match(question)
+    result = Result(stat, series, confidence)
+    if stat is None:
+        return result
+    sentences = []
+    for s in series:
+        fact = compute(stat, ts_dict.get(s) or Series.empty(), window)
+        if fact is None:
+            result.confidence = 0.0  # missing data: let the model say so in context
+            continue
+        result.facts[s] = fact
+        sentences.append(_sentence(stat, s, fact))
+    result.answer = " ".join(sentences)
+    return result
+
+
+def hints(result: Result) -> str:
+    """Exact numbers for the model when the question was matched but not answered directly."""
+    return "\n".join(_sentence(result.stat, s, fact) for s, fact in result.facts.items())
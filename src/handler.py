@@ -1,63 +1,184 @@
-import json, logging, uuid, time, os
-from typing import Dict, List
+import atexit, json, logging, uuid, time, os
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
 import boto3
+from botocore.exceptions import ConnectTimeoutError, ReadTimeoutError
+import bedrock_stub
+import conversations
 import utils                           # ← your helpers
+import downsample
+import fastpath
+import history
+import pipeline
+import providers
+import resilience
+import retrieval
+import router
+import tokenizer
+import vitals
+from cache import ResponseCache, VectorCache, fingerprint
+from embedder import CachedEmbedder, normalize_query
 from utils import validate_payload, build_context_from_payload, prepare_history_for_llm
-from prompts import SYSTEM_PROMPT
+from prompts import SYSTEM_PROMPT, system_prompt_for
+from series import Series
 
 # # --- Local testing bypass ---
 # if os.getenv("LOCAL_TEST") == "1":
-#     def handler(event, _):
+#     def handler(event, context=None):
 #         return {
 #             "statusCode": 200,
 #             "headers": {"Content-Type": "application/json"},
 #             "body": json.dumps({"answer": "[LOCAL MOCK] I parsed your timeseries and history just fine."})
 #         }
 
- # ------------------------------------------------------------------ #                                                                                   
- #  RAG (Retrieval-Augmented Generation) Extension - Conceptual Stub  #                                                                                   
- # ------------------------------------------------------------------ #                                                                                   
- # This is a placeholder for future RAG integration. The actual                                                                                           
- # retriever module, vector DB config, and embedding logic are not                                                                                        
- # implemented here, but the handler is structured to allow easy                                                                                          
- # insertion of retrieved passages into the LLM context.                                                                                                  
-                                                                                                                                                          
-def retrieve_reference_material(userQ: str, vitals_context: str) -> str:
+# ---------- structured logger -----------------------------------------------
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# ------------------------------------------------------------------ #
+#  RAG (Retrieval-Augmented Generation)                              #
+# ------------------------------------------------------------------ #
+# The knowledge-base index is a local directory (see vector_index.py)
+# that is memory-mapped once per container at import time, so a warm
+# invocation pays only for the query embedding + a NumPy top-k.
+#
+# Query embeddings are cached per container (LRU + TTL) keyed on the
+# normalised question, so repeat questions skip the embedding call.
+# Set QUERY_CACHE_FILE (e.g. /tmp/query_embeddings.npz) to persist the
+# cache across module re-initialisation in the same sandbox; the file is
+# rewritten at most every QUERY_CACHE_SAVE_S seconds and at interpreter exit.
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "512"))
+QUERY_CACHE_TTL_S = float(os.getenv("QUERY_CACHE_TTL_S", "3600"))
+QUERY_CACHE_FILE = os.getenv("QUERY_CACHE_FILE", "")
+QUERY_CACHE_SAVE_S = float(os.getenv("QUERY_CACHE_SAVE_S", "60"))
+
+_EMBED_CACHE = VectorCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL_S, QUERY_CACHE_FILE, QUERY_CACHE_SAVE_S)
+_EMBED_CACHE.load()
+atexit.register(_EMBED_CACHE.save)
+
+try:
+    _RETRIEVER = retrieval.load_retriever()
+    if _RETRIEVER is not None:
+        _RETRIEVER.embedder = CachedEmbedder(_RETRIEVER.embedder, _EMBED_CACHE)
+except Exception:  # a broken index must never take the Lambda down
+    logger.exception("failed to load RAG index from %s", retrieval.RAG_INDEX_DIR)
+    _RETRIEVER = None
+
+
+def retrieve_reference_material(userQ: str, vitals_context: str,  # pylint: disable=unused-argument
+                                deadline: Optional[pipeline.Deadline] = None) -> str:
     """
-    Retrieve top-N relevant knowledge base passages for the given query.
-
-    Prerequisite setup steps (to be completed before implementing this function):
-    1. Define knowledge domains and document sources (e.g., clinical guidelines, nutrition, user docs).
-    2. Build a chunking & pre-processing pipeline to segment and store documents as plain text chunks with metadata.
-    3. Select and benchmark an embedding model (e.g., Bedrock's amazon.titan-embed-text-v1).
-    4. Provision a vector store (OpenSearch, Pinecone, etc.) with matching vector dimension and metadata fields.
-    5. Implement an index build job to embed and upsert all chunks into the vector store.
-    6. Configure IAM/network so Lambda can call embedding and vector store APIs.
-    7. Add environment variables for endpoints, API keys, embedding model ID, and retrieval parameters.
-    8. Add observability (CloudWatch metrics) and fallback logic (return "" on failure).
-    9. Write validation assets: unit/integration/load tests.
-    10. Ensure security/compliance: PHI scan, encryption, audit trail.
-    11. Document the pipeline and provide a run-book.
-
-    Once the above are in place, this function should:
-    - Embed the concatenation of userQ (+ optionally vitals_context)
-    - Query the vector store for top-k similar passages
-    - Post-process: rank, merge, truncate to token budget, strip PII
-    - Return the concatenated passages as a string
-
-    For now, this is a stub.
+    Retrieve top-k relevant knowledge base passages for the given query.
+
+    Only the question is embedded; the numeric vitals context adds noise
+    rather than signal to the similarity search. Returns the passages as a
+    numbered, token-trimmed string, or "" when no index is deployed or
+    anything goes wrong (including the embedding call outlasting
+    `deadline`) so the LLM can still answer from vitals alone.
     """
-    # TODO: Implement retrieval logic after prerequisites are complete.
-    return ""
+    if _RETRIEVER is None:
+        return ""
+    try:
+        hits = _RETRIEVER.search(userQ, retrieval.RAG_TOP_K, deadline=deadline)
+        return retrieval.format_passages(hits, retrieval.RAG_MAX_TOKENS)
+    except Exception:
+        logger.exception("reference retrieval failed")
+        return ""
+    finally:
+        try:
+            _EMBED_CACHE.maybe_save()
+        except OSError:
+            logger.warning("could not persist query cache to %s", QUERY_CACHE_FILE)
 
-# Bedrock is still required
-bedrock = boto3.client("bedrock-runtime")
+# ------------------------------------------------------------------ #
+#  Response cache                                                    #
+# ------------------------------------------------------------------ #
+# Answers are cached per container, keyed on everything that shapes the
+# prompt (model, system prompt, compact vitals context, trimmed history)
+# plus the normalised question. RESPONSE_CACHE_SIM > 0 enables a semantic
+# tier: within the same model/prompt/vitals/history, a question whose
+# embedding has cosine >= RESPONSE_CACHE_SIM reuses the cached answer.
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "256"))
+RESPONSE_CACHE_TTL_S = float(os.getenv("RESPONSE_CACHE_TTL_S", "900"))
+RESPONSE_CACHE_SIM = float(os.getenv("RESPONSE_CACHE_SIM", "0"))
+
+_RESPONSE_CACHE = ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL_S, RESPONSE_CACHE_SIM)
+
+
+def _question_vector(userQ: str, deadline: Optional[pipeline.Deadline] = None):
+    """Embedding for the semantic tier (shares the query-embedding cache with retrieval)."""
+    if not _RESPONSE_CACHE.semantic or _RETRIEVER is None:
+        return None
+    try:
+        return _RETRIEVER.embedder.embed_one(userQ, deadline)
+    except Exception:
+        logger.exception("question embedding for response cache failed")
+        return None
+
+# Questions that are pure look-ups over the vitals ("latest systolic?",
+# "average glucose?") are answered by fastpath.py without calling the
+# model when its matcher is confident. FASTPATH=0 disables this.
+FASTPATH = os.getenv("FASTPATH", "1") == "1"
+
+# ------------------------------------------------------------------ #
+#  Conversation store                                                #
+# ------------------------------------------------------------------ #
+# Turns are kept server-side per "session_id" (conversations.py), so a
+# client sends only the id and the new question. Requests without an id
+# start a new session, seeded with any "history" they carry; the id is
+# returned in every response. Sessions are stored per authenticated caller
+# (see _caller), so a session id alone never exposes another user's turns.
+# "" disables the store.
+#   memory | sqlite:/tmp/conversations.db | dynamodb:<table>
+CONVERSATION_STORE = os.getenv("CONVERSATION_STORE", "memory")
+HISTORY_MAX_TOKENS = int(os.getenv("HISTORY_MAX_TOKENS", "1200"))
+_CONVERSATIONS = conversations.from_spec(CONVERSATION_STORE)
+
+# Turns older than the recent window are folded into a running summary
+# (history.py) instead of being dropped: SUMMARY_MAX_TOKENS of the history
+# budget go to the summary, the rest to verbatim recent turns. With
+# SUMMARY_MODEL_ID set, a (cheap) model writes the summary; otherwise it is
+# extractive. HISTORY_SUMMARY=0 only drops old turns.
+# Lambda freezes the sandbox once the handler returns, so folds run in the
+# request, after the answer, with the model only while SUMMARY_MIN_S of the
+# deadline are left. HISTORY_BACKGROUND=1 (set by local_server.py) moves them
+# to a worker thread for long-running processes.
+HISTORY_SUMMARY = os.getenv("HISTORY_SUMMARY", "1") == "1"
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "300"))
+SUMMARY_MODEL_ID = os.getenv("SUMMARY_MODEL_ID", "")
+SUMMARY_MIN_S = float(os.getenv("SUMMARY_MIN_S", "3"))
+HISTORY_BACKGROUND = os.getenv("HISTORY_BACKGROUND", "0") == "1"
+
+# Bedrock is still required. BEDROCK_STUB (bedrock_stub.py) swaps in a local
+# client that injects throttling, errors and slow replies, e.g.
+#   BEDROCK_STUB="throttle=0.3,slow=0.1,slow_ms=4000"
+BEDROCK_STUB = os.getenv("BEDROCK_STUB", "")
+bedrock = bedrock_stub.from_spec(BEDROCK_STUB) or boto3.client("bedrock-runtime")
+# Copies of `bedrock` with read timeouts of 1..REQUEST_TIMEOUT_S seconds,
+# built here once so the request path never creates a client.
+_TIMED = resilience.TimedClients(bedrock, pipeline.REQUEST_TIMEOUT_S)
+
+
+def _summarize_with_model(prompt: str, max_tokens: int, deadline: Optional[pipeline.Deadline] = None) -> str:
+    adapter = providers.for_model(SUMMARY_MODEL_ID)
+    client = _bedrock_until(deadline) if deadline is not None else bedrock
+    return adapter.invoke(client, SUMMARY_MODEL_ID, [{"role": "user", "content": prompt}], max_tokens).answer
+
+
+_COMPACTOR = history.HistoryCompactor(
+    history.LLMSummarizer(_summarize_with_model) if SUMMARY_MODEL_ID else history.ExtractiveSummarizer(),
+    recent_tokens=HISTORY_MAX_TOKENS - SUMMARY_MAX_TOKENS,
+    summary_tokens=SUMMARY_MAX_TOKENS,
+    background=HISTORY_BACKGROUND,
+    llm_min_s=SUMMARY_MIN_S,
+) if HISTORY_SUMMARY else None
+_RECENT_TOKENS = _COMPACTOR.recent_tokens if _COMPACTOR is not None else HISTORY_MAX_TOKENS
 
 # ------------------------------------------------------------------ #
 #  SYSTEM PROMPT                                                     #
 # ------------------------------------------------------------------ #
 # All personalised statements **must** be grounded solely in the
-# vitals data supplied in the assistant message named "vitals".
+# vitals data supplied in the user message named "vitals".
 # Never invent statistics for periods (e.g. 7-day, 30-day averages)
 # unless that span is represented in the provided data.
 # If data is missing, explicitly say so.
@@ -65,187 +186,582 @@ bedrock = boto3.client("bedrock-runtime")
 
 system_prompt = SYSTEM_PROMPT
 
-# ── TEMPORARILY DISABLE AWS TIMESTREAM ────────────────────────────────
-# Replace the Timestream client with a stub that always returns an
-# empty result set, preventing any network calls or data access.
-def _noop(*_, **__):
-    return {"Rows": []}
-
-ts_q = type("NoTimestreamClient", (), {"query": staticmethod(_noop)})()
+# Vitals context encoding (utils.CONTEXT_ENCODINGS): "points" (per-point JSON
+# objects) is the default; "table" (CSV rows on a shared week axis) is opt-in
+# and fits ~5x more weeks into the budget. Clients may override it per request
+# with "context_encoding"; the system prompt's schema section always matches.
+CONTEXT_ENCODING = os.getenv("CONTEXT_ENCODING", "points")
+# Decimals kept in the context; unset sends every value as received.
+CONTEXT_PRECISION = int(os.environ["CONTEXT_PRECISION"]) if os.getenv("CONTEXT_PRECISION") else None
+_SYSTEM_PROMPTS = {enc: system_prompt_for(enc) for enc in utils.CONTEXT_ENCODINGS}
+# Older history that does not fit the budget is thinned with a shape-preserving
+# downsampler ("lttb" | "minmax") instead of cut off; "none" keeps only the
+# newest weeks. Overridable per request with "context_downsample".
+CONTEXT_DOWNSAMPLE = downsample.parse_method(os.getenv("CONTEXT_DOWNSAMPLE", "lttb"))
+
+# Series missing from the payload are read from the vitals store
+# (vitals.py) for the authenticated caller (_caller), all of them in one
+# query. The body's "user_id" is never trusted: it must match the caller,
+# and unauthenticated requests get no stored vitals.
+# "" disables it (payload-only, as while Timestream was switched off).
+#   memory | sqlite:/tmp/vitals.db | timestream:<database>/<table>
+# Reads go through a per-user cache at module scope (VITALS_CACHE_SIZE users,
+# VITALS_CACHE_TTL_S), so later turns of a conversation skip the store; a new
+# "vitals_version" in the request or an "invalidate_vitals" event refreshes it.
+VITALS_STORE = os.getenv("VITALS_STORE", "")
+_VITALS_STORE = vitals.from_spec(VITALS_STORE)
+_VITALS = vitals.CachedRepository(_VITALS_STORE) if _VITALS_STORE is not None else None
 
 DB  = os.getenv("DB_NAME", "")
 TBL = os.getenv("TABLE", "")
 MODEL_ID = os.getenv("MODEL_ID")
 
-def fetch_latest(series: str, hours: int = 168):  # pylint: disable=unused-argument
-    """Timestream access disabled: return no data."""
-    return []
+# Optional ladder of models, cheapest first (router.py): simple look-ups go
+# to the first rung, advice and long questions to the last, each with its
+# own max_tokens. Unset: every request uses MODEL_ID.
+#   MODEL_LADDER="<small model id>@600,<large model id>@2000"
+MODEL_LADDER = router.parse_ladder(os.getenv("MODEL_LADDER", ""))
+
+# Request deadline (pipeline.py) and how it is spent. Stages are awaited only
+# until MODEL_RESERVE_S (at most half the budget) before the deadline, so the
+# model always gets that long; retrieval is skipped when it would get less
+# than RETRIEVAL_MIN_S.
+# max_tokens shrinks to what the model can write in the time left
+# (MODEL_FIRST_TOKEN_S, then MODEL_TOKENS_PER_S) and the Bedrock read timeout
+# ends at the deadline: a slow model yields a short or partial answer rather
+# than a gateway timeout. Only a cut below 90% of what the whole budget
+# allows counts as degraded (the budget alone caps every request alike).
+MODEL_RESERVE_S = float(os.getenv("MODEL_RESERVE_S", "3"))
+RETRIEVAL_MIN_S = float(os.getenv("RETRIEVAL_MIN_S", "0.5"))
+MODEL_FIRST_TOKEN_S = float(os.getenv("MODEL_FIRST_TOKEN_S", "1"))
+MODEL_TOKENS_PER_S = float(os.getenv("MODEL_TOKENS_PER_S", "80"))
+MAX_TOKENS = int(os.getenv("MAX_TOKENS", "2000"))
+MIN_TOKENS = int(os.getenv("MIN_TOKENS", "128"))
+_MODEL_TIMEOUTS = (ReadTimeoutError, ConnectTimeoutError, TimeoutError)
+_TOKENS_DEGRADED_BELOW = 0.9
+
+# Model calls go through resilience.py: throttling and 5xx are retried with
+# jittered backoff within the deadline (BEDROCK_MAX_ATTEMPTS), BEDROCK_HEDGE=1
+# sends a second request once a call outlasts the model's P95, and a model
+# that keeps failing is skipped for a while -- in favour of FALLBACK_MODEL_ID
+# if set, else the request gets a fast "busy" answer instead of a 500.
+FALLBACK_MODEL_ID = os.getenv("FALLBACK_MODEL_ID", "")
+_RESILIENT = resilience.Resilient(fallback_model=FALLBACK_MODEL_ID)
+
+
+def _ladder() -> List[router.Rung]:
+    return MODEL_LADDER or ([router.Rung(MODEL_ID, MAX_TOKENS)] if MODEL_ID else [])
+
+
+def _max_tokens_within(deadline: pipeline.Deadline, cap: int = MAX_TOKENS) -> int:
+    """max_tokens the model can produce before `deadline` (MIN_TOKENS..cap)."""
+    writable = int((deadline.remaining() - MODEL_FIRST_TOKEN_S) * MODEL_TOKENS_PER_S)
+    return max(min(MIN_TOKENS, cap), min(cap, writable))
+
+
+def _bedrock_until(deadline: pipeline.Deadline):
+    """
+    `bedrock` with its read timeout cut to end before `deadline` and no
+    retries (one of _TIMED's clients). Raises TimeoutError when less than a
+    second is left.
+    """
+    timed = _TIMED if _TIMED.base is bedrock else resilience.TimedClients(bedrock)   # stub swapped in by tests
+    return timed.until(deadline)
+
+
+def _load_vitals(user_id: Optional[str], ts_in: Dict[str, Series], version: str = "",
+                 deadline: Optional[pipeline.Deadline] = None) -> Tuple[Dict[str, Series], int]:
+    """Payload series, with the missing ones filled from the vitals store (one round trip)."""
+    missing = [name for name in vitals.SERIES if not ts_in.get(name)]
+    fetched: Dict[str, Series] = {}
+    t = time.perf_counter()
+    if missing and user_id and _VITALS is not None:
+        try:
+            fetched = _VITALS.fetch(user_id, missing, deadline, version)
+        except Exception:  # answer from the payload alone rather than fail
+            logger.exception("could not load vitals for %s", user_id)
+    ts_dict = {name: ts_in.get(name) or fetched.get(name) or Series.empty() for name in vitals.SERIES}
+    return ts_dict, int((time.perf_counter() - t) * 1000)
+
+@dataclass
+class Turn:
+    """Everything known about one request before the model is called."""
+    req_id: str
+    t0: float
+    userQ: str
+    ts_dict: Dict[str, Series]
+    history: List[Dict]
+    scope: str = ""
+    qvec: Optional[object] = None
+    cached: Optional[Dict] = None
+    cache_tier: Optional[str] = None
+    fast: Optional[fastpath.Result] = None
+    ref_mat: str = ""
+    retrieval_ms: int = 0
+    brq: Dict = field(default_factory=dict)
+    session_id: Optional[str] = None
+    session_key: Optional[str] = None                  # store key: session_id scoped to the caller
+    seed: List[Dict] = field(default_factory=list)   # client history for a new session
+    summary: str = ""                                  # running summary of older turns
+    vitals_ms: int = 0
+    stages: Optional[pipeline.Stages] = None
+    degraded: List[str] = field(default_factory=list)   # what was cut to meet the deadline
+    route: Optional[router.Route] = None
+    call: Optional[resilience.CallStats] = None   # set once the model is called
+
+    @property
+    def model_id(self) -> Optional[str]:
+        if self.call is not None:   # the fallback model, if it answered instead
+            return self.call.model_id
+        return self.route.model_id if self.route is not None else MODEL_ID
+
+    @property
+    def deadline(self) -> pipeline.Deadline:
+        return self.stages.deadline
+
+    @property
+    def answered_locally(self) -> bool:
+        return self.cached is not None or (self.fast is not None and self.fast.confident)
+
+    def log_fields(self) -> Dict:
+        return {
+            "vitals_ms": self.vitals_ms,
+            "vitals_cache": _VITALS.stats() if _VITALS is not None else None,
+            "retrieval_ms": self.retrieval_ms,
+            "has_reference": bool(self.ref_mat),
+            "embed_cache": _EMBED_CACHE.stats(),
+            "tokenizer": tokenizer.get(self.model_id).stats(),
+            "history_turns": len(self.history),
+            "history_summary": bool(self.summary),
+            "response_cache": _RESPONSE_CACHE.stats(),
+            **(self.stages.log_fields() if self.stages is not None else {}),
+            "degraded": self.degraded,
+            "route": self.route.log_fields() if self.route is not None else None,
+            "provider": providers.for_model(self.model_id).name if self.model_id else None,
+            "bedrock_call": self.call.log_fields() if self.call is not None else None,
+            "breakers": _RESILIENT.states(),
+            "has_glucose": bool(self.ts_dict.get("glucose")),
+            "has_weight":  bool(self.ts_dict.get("weight")),
+            "has_bp":      bool(self.ts_dict.get("bp_sys")) and bool(self.ts_dict.get("bp_dia")),
+        }
+
+
+def _vitals_context(user_id: Optional[str], ts_in: Dict[str, Series], version: str, userQ: str,
+                    encoding: str, thin: str, deadline: Optional[pipeline.Deadline] = None,
+                    ) -> Tuple[Dict[str, Series], str, int]:
+    """Stage: fill missing series from the vitals store and render the context."""
+    ts_dict, vitals_ms = _load_vitals(user_id, ts_in, version, deadline)
+    context = build_context_from_payload(userQ, ts_dict, encoding=encoding,
+                                         precision=CONTEXT_PRECISION, downsample_method=thin)
+    return ts_dict, context, vitals_ms
+
+
+def _load_history(session_key: Optional[str], history_in: List[Dict]) -> Tuple[List[Dict], str, List[Dict]]:
+    """Stage: (recent turns, summary of older ones, seed for a new session)."""
+    recent, summary = None, ""
+    if session_key and _CONVERSATIONS is not None:
+        try:
+            recent = _CONVERSATIONS.recent(session_key, _RECENT_TOKENS) or None
+            if recent is not None and _COMPACTOR is not None:
+                summary = _CONVERSATIONS.get_summary(session_key)
+        except Exception:
+            logger.exception("could not load conversation %s", session_key)
+    if recent is not None:
+        return recent, summary, []
+    # stateless request, new session, or one this store has lost
+    if _COMPACTOR is not None:
+        older, recent = _COMPACTOR.split(history_in)
+        summary = _COMPACTOR.summary_for(older)
+    else:
+        recent = prepare_history_for_llm(history_in, HISTORY_MAX_TOKENS)
+    return recent, summary, recent
+
+
+def _caller(event) -> Optional[str]:
+    """
+    Authenticated identity of the request, taken only from API Gateway's
+    authorizer context (HTTP API JWT or Cognito `sub`, or a Lambda
+    authorizer's principal), never from the request body. None when the
+    request was not authenticated.
+    """
+    auth = (event.get("requestContext") or {}).get("authorizer") or {}
+    claims = (auth.get("jwt") or {}).get("claims") or auth.get("claims") or {}
+    for value in (claims.get("sub"), (auth.get("lambda") or {}).get("principalId"), auth.get("principalId")):
+        if isinstance(value, str) and value:
+            return value
+    return None
 
-# ---------- structured logger -----------------------------------------------
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
 
+def _prepare(event, lambda_context=None) -> Tuple[Optional[Turn], Optional[Dict]]:
+    """
+    Validate the request and do all pre-model work: vitals context, history
+    trimming, response-cache lookup and (on a miss) retrieval + prompt
+    assembly. Returns (turn, None) or (None, error_response).
 
-def handler(event, _):
+    Vitals, history and retrieval are independent stages (pipeline.py) run
+    concurrently, each awaited no later than the request deadline.
+    """
     req_id   = str(uuid.uuid4())
     t0       = time.time()
 
     try:
         incoming = json.loads(event.get("body", "{}"))
         userQ, ts_in, history_in = validate_payload(incoming)
+        encoding = incoming.get("context_encoding") or CONTEXT_ENCODING
+        if encoding not in _SYSTEM_PROMPTS:
+            raise ValueError(f"Unknown 'context_encoding' {encoding!r}; expected one of "
+                             f"{', '.join(utils.CONTEXT_ENCODINGS)}.")
+        thin = downsample.parse_method(incoming.get("context_downsample") or CONTEXT_DOWNSAMPLE)
+        session_id = conversations.parse_session_id(incoming.get("session_id"))
+        owner = _caller(event)
+        claimed = vitals.parse_user_id(incoming.get("user_id"))
+        user_id = vitals.parse_user_id(owner) if owner else None
+        vitals_version = str(incoming.get("vitals_version") or "")
     except ValueError as err:
-        return _resp(400, {"error": str(err)})
-
-    ts_dict = {
-    "health_age": ts_in.get("health_age") or fetch_latest("health_age"),  
-    "glucose": ts_in.get("glucose") or fetch_latest("glucose"),
-    "weight" : ts_in.get("weight")  or fetch_latest("weight"),
-    "bp_sys" : ts_in.get("bp_sys")  or fetch_latest("bp_sys"),
-    "bp_dia" : ts_in.get("bp_dia")  or fetch_latest("bp_dia"),
-    "bmi"    : ts_in.get("bmi")     or fetch_latest("bmi"),   # optional
-    "rhr"    : ts_in.get("rhr")     or fetch_latest("rhr"),   # optional
-}
-
-    context = build_context_from_payload(userQ, ts_dict)
+        return None, _resp(400, {"error": str(err)})
+    if claimed and user_id and claimed != user_id:
+        return None, _resp(403, {"error": "'user_id' does not match the authenticated caller."})
+    if claimed and not user_id:
+        logger.warning("ignoring 'user_id' of an unauthenticated request; no stored vitals are read")
+
+    ladder = _ladder()
+    deadline = pipeline.Deadline.from_context(lambda_context)
+    reserve = min(MODEL_RESERVE_S, deadline.budget_s / 2)   # short budgets are split evenly
+    stages = pipeline.Stages(deadline)
+    degraded: List[str] = []
+    stages.start("vitals", _vitals_context, user_id, ts_in, vitals_version, userQ, encoding, thin, deadline)
+    stages.start("history", _load_history,
+                 conversations.session_key(owner, session_id) if session_id else None, history_in)
+    if ladder and deadline.remaining(reserve) >= RETRIEVAL_MIN_S:
+        # speculative: unused if the answer comes from the fast path or the
+        # response cache. The search embeds only the question, not the context.
+        # the query embedding must end where the wait for this stage does
+        stages.start("retrieval", retrieve_reference_material, userQ, "",
+                     pipeline.Deadline(deadline.remaining(reserve)))
+    elif ladder:
+        degraded.append("no_retrieval")
+
+    ts_dict, context, vitals_ms = stages.result(
+        "vitals", lambda: _vitals_context(None, ts_in, "", userQ, encoding, thin), reserve)
+    recent, summary, seed = stages.result(
+        "history", lambda: (prepare_history_for_llm(history_in, HISTORY_MAX_TOKENS), "", []), reserve)
+    session_id = session_id or (uuid.uuid4().hex if _CONVERSATIONS is not None else None)
+    turn = Turn(req_id, t0, userQ, ts_dict, recent, session_id=session_id,
+                session_key=conversations.session_key(owner, session_id) if session_id else None,
+                seed=seed, summary=summary, vitals_ms=vitals_ms, stages=stages, degraded=degraded)
+    prompt = _SYSTEM_PROMPTS[encoding]
+
+    if FASTPATH:
+        turn.fast = fastpath.answer(userQ, ts_dict)
+        if turn.answered_locally:
+            stages.cancel()
+            return turn, None
+
+    if not ladder:
+        return None, _resp(500, {"error": "MODEL_ID (or MODEL_LADDER) not configured on Lambda"})
+
+    turn.route = router.route(userQ, context, ladder, turn.fast.stat if turn.fast is not None else None)
+    turn.scope = fingerprint(turn.model_id, prompt, context, turn.summary, turn.history)
+    turn.qvec = _question_vector(userQ, pipeline.Deadline(deadline.remaining(reserve)))
+    turn.cached, turn.cache_tier = _RESPONSE_CACHE.get(turn.scope, normalize_query(userQ), turn.qvec)
+    if turn.cached is not None:
+        stages.cancel()
+        return turn, None
+
+    turn.ref_mat = stages.result("retrieval", lambda: "", reserve)
+    turn.retrieval_ms = stages.ms.get("retrieval", 0)
 
     # --- assemble messages ---
+    # Most stable first, so each request shares the longest possible prefix
+    # with earlier ones: system prompt (every request) -> the user's vitals
+    # (every turn of the conversation) -> summary + history (grows by one
+    # exchange per turn) -> this turn's reference material and question.
+    # "cache" marks the end of each stable part: a prompt cache point for
+    # models that have them (providers.py).
     messages: List[Dict] = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": f"{userQ}\n\nContext data:\n{context}"},
+        {"role": "system", "content": prompt, "cache": True},
+        {"role": "user", "name": "vitals", "content": context, "cache": True},
     ]
-    # if ref_mat:
-    #     messages.append({"role": "assistant", "name": "reference_material", "content": ref_mat})
-
-    # add trimmed/sanitized history BEFORE latest user question
-    messages.extend(prepare_history_for_llm(history_in))
-
-    messages.append({"role": "user", "content": userQ})
-
-    if not MODEL_ID:
-        return _resp(500, {"error": "MODEL_ID not configured on Lambda"})
-
-    brq = {"messages": messages, "max_tokens": 2000}
+    if turn.summary:
+        messages.append(history.HistoryCompactor.message(turn.summary))
+    messages.extend(turn.history)
+    if len(messages) > 2:
+        messages[-1] = dict(messages[-1], cache=True)
+
+    if turn.ref_mat:
+        messages.append({"role": "user", "name": "reference_material", "content": turn.ref_mat})
+    question = userQ
+    if turn.fast is not None and turn.fast.facts:
+        # matched but not answerable alone: hand the model the exact numbers
+        question += f"\n\nPrecomputed from the context data:\n{fastpath.hints(turn.fast)}"
+    messages.append({"role": "user", "content": question})
+
+    max_tokens = _max_tokens_within(deadline, turn.route.max_tokens)
+    budget_tokens = _max_tokens_within(pipeline.Deadline(deadline.budget_s), turn.route.max_tokens)
+    if max_tokens < budget_tokens * _TOKENS_DEGRADED_BELOW:   # the stages ate into the model's time
+        turn.degraded.append(f"max_tokens={max_tokens}")
+    turn.degraded.extend(f"no_{name}" for name in stages.missed)
+    turn.brq = {"messages": messages, "max_tokens": max_tokens}
+    return turn, None
+
+
+def _calibrate(turn: Turn, token_usage: Optional[Dict]) -> None:
+    """Feed Bedrock's input token count back into the tokenizer's per-model factor."""
+    if token_usage and token_usage.get("input_tokens"):
+        # prompt-cache reads and writes are part of the prompt but not of input_tokens
+        prompt_tokens = (token_usage["input_tokens"] + token_usage.get("cache_read_input_tokens", 0)
+                         + token_usage.get("cache_write_input_tokens", 0))
+        tokenizer.get(turn.model_id).observe([m["content"] for m in turn.brq["messages"]], prompt_tokens)
+
+
+def _remember(turn: Turn, answer: str) -> None:
+    """
+    Append this exchange (after any seeded history) to the session and fold
+    the turns it pushes out of the recent window into the running summary.
+    """
+    if _CONVERSATIONS is None or not turn.session_key or not answer:
+        return
+    sid = turn.session_key
+    exchange = [{"role": "user", "content": turn.userQ}, {"role": "assistant", "content": answer}]
+    try:
+        _CONVERSATIONS.append(sid, turn.seed + exchange)
+        if _COMPACTOR is None:
+            return
+        if turn.seed and turn.summary:
+            _CONVERSATIONS.put_summary(sid, turn.summary)
+        _COMPACTOR.fold_later(lambda: _CONVERSATIONS.get_summary(sid),
+                              _COMPACTOR.dropped_after(turn.history, exchange),
+                              lambda text: _CONVERSATIONS.put_summary(sid, text), turn.deadline)
+    except Exception:  # never fail the answer because history could not be saved
+        logger.exception("could not store conversation turn")
+
+
+def _local_body(turn: Turn) -> Dict:
+    """Response for a turn answered without the model (response cache or fast path)."""
+    latency_ms = int((time.time() - turn.t0) * 1000)
+    fast = turn.cached is None
+    logger.info(json.dumps({
+        "req_id": turn.req_id,
+        "model_id": turn.model_id,
+        "cached": not fast,
+        "cache_tier": turn.cache_tier,
+        "fastpath": fast,
+        "fastpath_stat": turn.fast.stat if fast else None,
+        "latency_ms": latency_ms,
+        **turn.log_fields(),
+    }))
+    if fast:
+        base = {"answer": turn.fast.answer, "model_id": "fastpath", "model_version": None}
+    else:
+        base = turn.cached
+    _remember(turn, base["answer"])
+    # no tokens were spent on this request
+    return dict(base, token_usage=None, latency_ms=latency_ms, request_id=turn.req_id,
+                cached=not fast, fastpath=fast, session_id=turn.session_id)
+
+
+def _call_model(turn: Turn, stream: bool = False, t_start: Optional[float] = None):
+    """The turn's model reply (Reply, or a stream) through the retry / hedge / breaker layer."""
+    def attempt(model_id: str):
+        client = _bedrock_until(turn.deadline)
+        max_tokens = _max_tokens_within(turn.deadline, turn.brq["max_tokens"])   # less after a retry
+        adapter = providers.for_model(model_id)
+        if stream:
+            return adapter.stream(client, model_id, turn.brq["messages"], max_tokens, t_start=t_start)
+        return adapter.invoke(client, model_id, turn.brq["messages"], max_tokens)
+
+    turn.call = resilience.CallStats(turn.model_id)
+    return _RESILIENT.call(attempt, turn.call, turn.deadline, hedge=not stream)
+
+
+def _unanswered(err: Exception) -> Optional[str]:
+    """Why the model gave no reply, if that is answered with _partial_body rather than raised."""
+    if isinstance(err, _MODEL_TIMEOUTS):
+        return "model_timeout"
+    if isinstance(err, resilience.CircuitOpenError) or resilience.retryable(err):
+        return "model_unavailable"
+    return None
+
+
+def _partial_body(turn: Turn, reason: str = "model_timeout") -> Dict:
+    """
+    Fast partial answer when the model could not reply: before the deadline
+    ("model_timeout") or at all, throttled or failing ("model_unavailable").
+    """
+    latency_ms = int((time.time() - turn.t0) * 1000)
+    turn.degraded.append(reason)
+    fast = turn.fast if turn.fast is not None else fastpath.answer(turn.userQ, turn.ts_dict)
+    if reason == "model_timeout":
+        answer = "Sorry, I could not finish a full answer in time."
+    else:
+        answer = "Sorry, the assistant is busy right now."
+    if fast.facts:
+        answer += " Here is what your data shows:\n" + fastpath.hints(fast)
+    else:
+        answer += " Please try again in a moment."
+    logger.warning(json.dumps({
+        "req_id": turn.req_id,
+        "model_id": turn.model_id,
+        "timed_out": reason == "model_timeout",
+        "unavailable": reason == "model_unavailable",
+        "latency_ms": latency_ms,
+        **turn.log_fields(),
+    }))
+    return {"answer": answer, "model_id": turn.model_id, "model_version": None, "token_usage": None,
+            "latency_ms": latency_ms, "request_id": turn.req_id, "cached": False, "fastpath": False,
+            "timed_out": reason == "model_timeout", "unavailable": reason == "model_unavailable",
+            "session_id": turn.session_id}
+
+
+def invalidate_vitals(user_ids: Optional[List[str]] = None) -> None:
+    """Forget the cached vitals of `user_ids` (every user if None) in this container."""
+    if _VITALS is None:
+        return
+    if user_ids is None:
+        _VITALS.invalidate()
+    for user_id in user_ids or ():
+        _VITALS.invalidate(user_id)
+
+
+def handler(event, context=None):
+    if "invalidate_vitals" in event:
+        # direct invocation from the ingestion side:
+        #   {"invalidate_vitals": ["<user_id>", ...]}  or  {"invalidate_vitals": "*"}
+        users = event["invalidate_vitals"]
+        if users != "*":
+            users = [users] if isinstance(users, str) else [str(u) for u in users]
+        invalidate_vitals(None if users == "*" else users)
+        return _resp(200, {"invalidated": users})
+
+    turn, error = _prepare(event, context)
+    if error:
+        return error
+    if turn.answered_locally:
+        return _resp(200, _local_body(turn))
 
     t1 = time.time()
-    resp = bedrock.invoke_model(modelId=MODEL_ID, body=json.dumps(brq).encode())
+    try:
+        reply = _call_model(turn)
+    except Exception as err:
+        reason = _unanswered(err)
+        if reason is None:
+            raise
+        return _resp(200, _partial_body(turn, reason))
     latency_ms = int((time.time() - t1) * 1000)
 
     # Prefer Bedrock's request id if present
-    bedrock_req_id = (
-        resp.get("ResponseMetadata", {}).get("RequestId")
-        or resp.get("ResponseMetadata", {}).get("RequestID")
-        or req_id
-    )
-
-    raw = resp["body"].read()
-
-    answer, model_version, token_usage = _extract_answer_and_metadata(raw)
+    bedrock_req_id = reply.request_id or turn.req_id
+    answer, model_version, token_usage = reply.answer, reply.model_version, reply.token_usage
+    _calibrate(turn, token_usage)
 
     logger.info(json.dumps({
         "req_id": bedrock_req_id,
-        "model_id": MODEL_ID,
+        "model_id": turn.model_id,
         "model_version": model_version,
         "token_usage": token_usage,
         "latency_ms": latency_ms,
-        "has_glucose": bool(ts_dict.get("glucose")),
-        "has_weight":  bool(ts_dict.get("weight")),
-        "has_bp":      bool(ts_dict.get("bp_sys")) and bool(ts_dict.get("bp_dia")),
+        "cached": False,
+        "fastpath": False,
+        **turn.log_fields(),
     }))
 
-    return _resp(200, {
+    body = {
         "answer": answer,
-        "model_id": MODEL_ID,
+        "model_id": turn.model_id,
         "model_version": model_version,
         "token_usage": token_usage,
         "latency_ms": latency_ms,
         "request_id": bedrock_req_id,
-    })
+    }
+    if not turn.degraded:   # cut for time (no retrieval, fewer tokens...): not for requests with the full budget
+        _RESPONSE_CACHE.put(turn.scope, normalize_query(turn.userQ), body, turn.qvec)
+    _remember(turn, answer)
+    return _resp(200, dict(body, cached=False, fastpath=False, session_id=turn.session_id))
 
 
-# ───────────────────────────────── helpers ───────────────────────────────────
-def _extract_answer_and_metadata(body_bytes: bytes):
+def stream_handler(event, context=None) -> Tuple[int, Iterator[str]]:
     """
-    Best-effort extraction across Bedrock providers.
-    Returns: (answer: str, model_version: Optional[str], token_usage: Optional[dict])
+    Streaming variant of `handler` for hosts that can flush partial
+    responses (local_server.py, or a Lambda Web Adapter / response-streaming
+    function URL). Returns (status, lines): newline-delimited JSON, one
+    {"delta": "..."} per model chunk followed by a final {"done": true, ...}
+    object with the same metadata as the buffered response plus ttft_ms.
+    At the request deadline the stream is cut and "truncated" is true.
     """
-    # defaults
-    answer = None
-    model_version = None
-    token_usage = None
-
-    # Try JSON first; fall back to plain text
-    try:
-        body = json.loads(body_bytes)
-    except json.JSONDecodeError:
-        return body_bytes.decode("utf-8", errors="ignore"), None, None
-
-    # ----- answer (multiple common shapes) -----
-    answer = (
-        body.get("content")  # Anthropic-like
-        or (body.get("message") or {}).get("content")  # Meta/DeepSeek-like
-        or (
-            body.get("choices", [{}])[0].get("message", {}).get("content")
-            if body.get("choices") else None
-        )  # OpenAI-like
-        or body.get("results", [{}])[0].get("outputText")  # AI21-like
-        or body.get("outputText")  # some Titan responses
-    )
-
-    # ----- model version (check several places) -----
-    model_version = (
-        body.get("modelVersion")
-        or body.get("version")
-        or (body.get("meta") or {}).get("model_version")
-        or (body.get("message") or {}).get("model_version")
-        or (body.get("model") if isinstance(body.get("model"), str) else None)
-    )
-
-    # ----- usage normalization -----
-    # Common locations: top-level usage, meta.usage, message.usage, choices[0].usage
-    raw_usage = (
-        body.get("usage")
-        or (body.get("meta") or {}).get("usage")
-        or (body.get("message") or {}).get("usage")
-        or (body.get("choices", [{}])[0].get("usage") if body.get("choices") else None)
-    )
-    if isinstance(raw_usage, dict):
-        token_usage = {
-            "input_tokens": (
-                raw_usage.get("input_tokens")
-                or raw_usage.get("prompt_tokens")
-                or raw_usage.get("inputTokens")
-                or raw_usage.get("promptTokens")
-            ),
-            "output_tokens": (
-                raw_usage.get("output_tokens")
-                or raw_usage.get("completion_tokens")
-                or raw_usage.get("outputTokens")
-                or raw_usage.get("completionTokens")
-            ),
-            "total_tokens": (
-                raw_usage.get("total_tokens")
-                or raw_usage.get("totalTokens")
-            ),
+    turn, error = _prepare(event, context)
+    if error:
+        return error["statusCode"], iter([error["body"] + "\n"])
+    if turn.answered_locally:
+        body = _local_body(turn)
+        return 200, iter([
+            json.dumps({"delta": body.pop("answer")}, ensure_ascii=False) + "\n",
+            json.dumps(dict(body, done=True, ttft_ms=body["latency_ms"]), ensure_ascii=False) + "\n",
+        ])
+
+    def lines() -> Iterator[str]:
+        t1 = time.time()
+        try:
+            stream = _call_model(turn, stream=True, t_start=t1)
+        except Exception as err:
+            reason = _unanswered(err)
+            if reason is None:
+                raise
+            body = _partial_body(turn, reason)
+            yield json.dumps({"delta": body.pop("answer")}, ensure_ascii=False) + "\n"
+            yield json.dumps(dict(body, done=True, ttft_ms=None, truncated=True), ensure_ascii=False) + "\n"
+            return
+        truncated = False
+        try:
+            for text in stream:
+                yield json.dumps({"delta": text}, ensure_ascii=False) + "\n"
+                if turn.deadline.expired:
+                    truncated = True
+                    break
+        except _MODEL_TIMEOUTS:
+            truncated = True
+        if truncated:
+            turn.degraded.append("truncated")
+            stream.latency_ms = int((time.time() - t1) * 1000)
+            try:
+                (stream.response.get("body") or stream.response.get("stream")).close()
+            except Exception:
+                pass
+
+        request_id = stream.request_id or turn.req_id
+        _calibrate(turn, stream.token_usage)
+        logger.info(json.dumps({
+            "req_id": request_id,
+            "model_id": turn.model_id,
+            "model_version": stream.model_version,
+            "token_usage": stream.token_usage,
+            "latency_ms": stream.latency_ms,
+            "ttft_ms": stream.ttft_ms,
+            "streamed": True,
+            "truncated": truncated,
+            "cached": False,
+            "fastpath": False,
+            **turn.log_fields(),
+        }))
+        body = {
+            "answer": stream.text,
+            "model_id": turn.model_id,
+            "model_version": stream.model_version,
+            "token_usage": stream.token_usage,
+            "latency_ms": stream.latency_ms,
+            "request_id": request_id,
         }
-        # Compute total if provider didn’t supply it but parts exist
-        if token_usage["total_tokens"] is None:
-            it = token_usage["input_tokens"] or 0
-            ot = token_usage["output_tokens"] or 0
-            total = it + ot
-            token_usage["total_tokens"] = total if (it or ot) else None
-
-        # If all None, treat as absent
-        if not any(v is not None for v in token_usage.values()):
-            token_usage = None
-
-    # Final fallback: return JSON if we couldn't find a content field
-    if answer is None:
-        answer = json.dumps(body)
-
-    return answer, model_version, token_usage
+        if not truncated:   # a cut-off answer is neither reused nor kept in the conversation
+            if not turn.degraded:
+                _RESPONSE_CACHE.put(turn.scope, normalize_query(turn.userQ), body, turn.qvec)
+            _remember(turn, stream.text)
+        meta = {k: v for k, v in body.items() if k != "answer"}
+        yield json.dumps(dict(meta, done=True, ttft_ms=stream.ttft_ms, cached=False, fastpath=False,
+                              truncated=truncated, session_id=turn.session_id), ensure_ascii=False) + "\n"
 
+    return 200, lines()
 
 
+# ───────────────────────────────── helpers ───────────────────────────────────
 def _resp(status: int, body: Dict):
     return {
         "statusCode": status,
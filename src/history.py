@@ -0,0 +1,204 @@
+# history.py
+"""
+Tiered conversation history: the newest turns verbatim, everything older
+folded into one running summary.
+
+    recent   newest turns that fit `recent_tokens`, sent as they are
+    summary  <= `summary_tokens`, replaces all turns before the recent window
+
+A summary is only ever extended ("folded") with the turns that just fell out
+of the recent window, so each turn is summarised once:
+
+  * sessions (conversations.py) keep the summary next to the turns and fold
+    the dropped turns after each answer;
+  * stateless requests (full `history` in the body) look their summary up in
+    a cache keyed by a chained hash of the older turns, so the summary of
+    turns 1..k is reused and only turns k+1.. are folded.
+
+ExtractiveSummarizer is cheap and synchronous. LLMSummarizer calls a small
+model. On Lambda (the default) folds run synchronously after the answer,
+within the request deadline, because a frozen sandbox would never finish
+them: the model is used while at least `llm_min_s` are left, the extractive
+fold otherwise. Long-running processes (local_server.py) pass background=True
+to fold on a worker thread instead.
+"""
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Sequence, Tuple, Union
+import hashlib
+import logging
+import re
+
+from cache import TTLCache
+from utils import HistoryMsg, est_tokens, prepare_history_for_llm, trim_text_to_tokens
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_NAME = "conversation_summary"
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s")
+
+
+def _clip(text: str, limit: int) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + "…"
+
+
+class Summarizer:
+    slow = False   # True: fold() calls a model and should run off the request path
+
+    def fold(self, summary: str, turns: Sequence[HistoryMsg], max_tokens: int, deadline=None) -> str:
+        raise NotImplementedError
+
+
+class ExtractiveSummarizer(Summarizer):
+    """One line per turn (question, first sentence of the answer); oldest lines go first."""
+
+    def fold(self, summary: str, turns: Sequence[HistoryMsg], max_tokens: int, deadline=None) -> str:
+        lines = [l for l in summary.splitlines() if l.strip()]
+        for m in turns:
+            if m["role"] == "user":
+                lines.append(f"- user: {_clip(m['content'], 160)}")
+            else:
+                first = _SENTENCE_RE.split(m["content"].strip(), maxsplit=1)[0]
+                lines.append(f"- coach: {_clip(first, 200)}")
+        while lines and est_tokens("\n".join(lines)) > max_tokens:
+            lines.pop(0)
+        return "\n".join(lines)
+
+
+_FOLD_PROMPT = (
+    "You maintain the running summary of a conversation between a user and a health coach "
+    "about the user's vitals.\n"
+    "Update the summary with the new turns. Keep numbers, goals, advice already given, "
+    "the user's concerns and open questions; drop pleasantries. At most {words} words, "
+    "plain sentences, no preamble.\n\n"
+    "Summary so far:\n{summary}\n\nNew turns:\n{turns}\n\nUpdated summary:"
+)
+
+
+class LLMSummarizer(Summarizer):
+    """
+    Folds with a (cheap) model via `complete(prompt, max_tokens, deadline) -> text`
+    (deadline may be None). Falls back to the extractive fold if the call fails.
+    """
+    slow = True
+
+    def __init__(self, complete: Callable[[str, int, object], str], fallback: Optional[Summarizer] = None):
+        self.complete = complete
+        self.fallback = fallback or ExtractiveSummarizer()
+
+    def fold(self, summary: str, turns: Sequence[HistoryMsg], max_tokens: int, deadline=None) -> str:
+        prompt = _FOLD_PROMPT.format(
+            words=max(20, int(max_tokens * 0.7)),
+            summary=summary or "(empty)",
+            turns="\n".join(f"{m['role']}: {m['content']}" for m in turns),
+        )
+        try:
+            text = self.complete(prompt, max_tokens, deadline).strip()
+        except Exception:
+            logger.exception("history summary call failed; using extractive summary")
+            text = ""
+        if not text:
+            return self.fallback.fold(summary, turns, max_tokens)
+        return trim_text_to_tokens(text, max_tokens)
+
+
+def _chain(turns: Sequence[HistoryMsg]) -> List[str]:
+    """keys[k] identifies turns[:k] (keys[0] = no turns)."""
+    h = hashlib.sha256()
+    keys = [h.hexdigest()]
+    for m in turns:
+        h.update(m["role"].encode() + b"\x00" + m["content"].encode("utf-8") + b"\x01")
+        keys.append(h.copy().hexdigest())
+    return keys
+
+
+class HistoryCompactor:
+    def __init__(self, summarizer: Summarizer, recent_tokens: int = 900, summary_tokens: int = 300,
+                 cache_size: int = 256, cache_ttl: float = 3600.0, background: bool = False,
+                 llm_min_s: float = 3.0):
+        self.summarizer = summarizer
+        self.recent_tokens = recent_tokens
+        self.summary_tokens = summary_tokens
+        self.llm_min_s = llm_min_s
+        self.cache = TTLCache(cache_size, cache_ttl)
+        self.fallback = summarizer.fallback if isinstance(summarizer, LLMSummarizer) else summarizer
+        self._pool = ThreadPoolExecutor(max_workers=1) if background and summarizer.slow else None
+
+    # ---------- splitting ----------
+    def split(self, history: Sequence[HistoryMsg]) -> Tuple[List[HistoryMsg], List[HistoryMsg]]:
+        """(older, recent): recent = newest turns within `recent_tokens`."""
+        recent = prepare_history_for_llm(list(history), self.recent_tokens)
+        return list(history[:len(history) - len(recent)]), recent
+
+    def dropped_after(self, window: Sequence[HistoryMsg], new: Sequence[HistoryMsg]) -> List[HistoryMsg]:
+        """Turns that fall out of the recent window once `new` turns are appended to it."""
+        older, _ = self.split(list(window) + list(new))
+        return older
+
+    # ---------- folding ----------
+    def _fold_now(self, summary: str, turns: Sequence[HistoryMsg], deadline=None) -> str:
+        """Fold in the calling thread; a slow summarizer only while `llm_min_s` are left."""
+        summarizer = self.summarizer
+        if summarizer.slow and deadline is not None and deadline.remaining() < self.llm_min_s:
+            summarizer = self.fallback
+        return summarizer.fold(summary, turns, self.summary_tokens, deadline)
+
+    def fold_later(self, summary: Union[str, Callable[[], str]], turns: Sequence[HistoryMsg],
+                   done: Callable[[str], None], deadline=None) -> None:
+        """
+        Fold `turns` into `summary` and hand the result to `done`: on the worker
+        in background mode, else right here, bounded by `deadline`. Pass
+        `summary` as a callable to read the latest stored summary when the fold
+        actually runs (folds queued for the same session then build on each
+        other instead of racing).
+        """
+        if not turns:
+            return
+        turns = list(turns)
+
+        def run() -> None:
+            try:
+                base = summary() if callable(summary) else summary
+                done(self._fold_now(base, turns, None if self._pool is not None else deadline))
+            except Exception:
+                logger.exception("history summary update failed")
+
+        if self._pool is None:
+            run()
+        else:
+            self._pool.submit(run)
+
+    def summary_for(self, older: Sequence[HistoryMsg]) -> str:
+        """
+        Summary of `older` for a stateless request: the longest cached prefix,
+        extended extractively now, and by a slow summarizer only in background
+        mode (a synchronous model call here would delay the answer).
+        """
+        if not older:
+            return ""
+        keys = _chain(older)
+        k = len(older)
+        while k > 0 and self.cache.get(keys[k]) is None:
+            k -= 1
+        base = (self.cache.get(keys[k]) or "") if k else ""
+        if k == len(older):
+            return base
+        rest = older[k:]
+        if self._pool is None:
+            summarizer = self.fallback if self.summarizer.slow else self.summarizer
+            text = summarizer.fold(base, rest, self.summary_tokens)
+            self.cache.put(keys[-1], text)
+            return text
+        self.fold_later(base, rest, lambda text: self.cache.put(keys[-1], text))
+        return self.fallback.fold(base, rest, self.summary_tokens)
+
+    @staticmethod
+    def message(summary: str) -> HistoryMsg:
+        return {"role": "assistant", "name": SUMMARY_NAME,  # type: ignore[typeddict-item]
+                "content": f"Summary of our earlier conversation:\n{summary}"}
+
+    def flush(self, timeout: Optional[float] = None) -> None:
+        """Wait for pending background folds (tests, local runs, shutdown)."""
+        if self._pool is not None:
+            self._pool.submit(lambda: None).result(timeout=timeout)
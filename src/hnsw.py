@@ -0,0 +1,300 @@
+"""
+HNSW (hierarchical navigable small world) graph over the rows of a
+VectorIndex, for corpora where brute-force scoring no longer fits the
+Lambda's memory/latency envelope.
+
+Files written next to the vector index:
+
+    hnsw_meta.json     {"count", "M", "ef_construction", "entry", "max_level", "index_gen"}
+    hnsw_levels.npy    (count,) int8    top layer of each node
+    hnsw_level0.npy    (count, 2M) int32 layer-0 adjacency, -1 padded
+    hnsw_upper_ptr.npy (count,) int64   first row in hnsw_upper for the node, -1 if none
+    hnsw_upper.npy     (U, M) int32     adjacency for layers >= 1, one row per (node, layer)
+
+All arrays are memory-mapped at query time; a search touches only the pages
+of the nodes it visits. Similarity is the dot product of L2-normalised rows.
+"""
+from __future__ import annotations
+from heapq import heapify, heappop, heappush
+from typing import Callable, List, Optional, Tuple
+import json
+import math
+import os
+
+import numpy as np
+
+import vector_index
+
+META_FILE = "hnsw_meta.json"
+LEVELS_FILE = "hnsw_levels.npy"
+LEVEL0_FILE = "hnsw_level0.npy"
+UPPER_PTR_FILE = "hnsw_upper_ptr.npy"
+UPPER_FILE = "hnsw_upper.npy"
+
+DEFAULT_M = 16
+DEFAULT_EF_CONSTRUCTION = 100
+DEFAULT_EF_SEARCH = 64
+
+Neighbors = Callable[[int], np.ndarray]
+Sims = Callable[[np.ndarray], np.ndarray]
+
+
+def _search_layer(entries: List[Tuple[float, int]], ef: int, neighbors: Neighbors,
+                  sims: Sims, seen: np.ndarray, epoch: int) -> List[Tuple[float, int]]:
+    """
+    Best-first beam search of one layer; returns up to ef (sim, node), best
+    first. A node counts as visited when seen[node] == epoch, so callers reset
+    the visited set by bumping `epoch` instead of clearing the array.
+    """
+    cand = [(-s, n) for s, n in entries]
+    best = list(entries)
+    heapify(cand)
+    heapify(best)
+    for _, n in entries:
+        seen[n] = epoch
+    while cand:
+        neg, node = heappop(cand)
+        if len(best) >= ef and -neg < best[0][0]:
+            break
+        nbrs = neighbors(node)
+        nbrs = nbrs[seen[nbrs] != epoch]
+        if nbrs.shape[0] == 0:
+            continue
+        seen[nbrs] = epoch
+        for s, n in zip(sims(nbrs).tolist(), nbrs.tolist()):
+            if len(best) < ef or s > best[0][0]:
+                heappush(cand, (-s, n))
+                heappush(best, (s, n))
+                if len(best) > ef:
+                    heappop(best)
+    return sorted(best, reverse=True)
+
+
+def _load_graph(path: str) -> Tuple[dict, dict]:
+    with open(os.path.join(path, META_FILE), encoding="utf-8") as fh:
+        meta = json.load(fh)
+    arrays = {
+        name: np.load(os.path.join(path, fname), mmap_mode="r")
+        for name, fname in (("levels", LEVELS_FILE), ("level0", LEVEL0_FILE),
+                            ("upper_ptr", UPPER_PTR_FILE), ("upper", UPPER_FILE))
+    }
+    return meta, arrays
+
+
+class HNSWBuilder:
+    """Mutable, in-memory graph used while inserting rows."""
+
+    def __init__(self, vectors: np.ndarray, M: int = DEFAULT_M,
+                 ef_construction: int = DEFAULT_EF_CONSTRUCTION, seed: int = 0):
+        # build is offline: pull the rows into RAM once instead of paying the
+        # memmap fancy-indexing overhead on every distance computation
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.M = M
+        self.M0 = 2 * M
+        self.ef_construction = ef_construction
+        self.ml = 1.0 / math.log(M)
+        self.rng = np.random.default_rng(seed)
+        self.links: List[List[List[int]]] = []  # node -> layer -> neighbours
+        self.entry = -1
+        self.max_level = -1
+        self._seen = np.zeros(len(vectors), dtype=np.int32)
+        self._epoch = 0
+
+    def _vec(self, ids) -> np.ndarray:
+        return self.vectors[ids]
+
+    def _select(self, cands: List[Tuple[float, int]], m: int) -> List[int]:
+        """Diversity heuristic: keep a candidate only if it is closer to the base
+        node than to every neighbour already kept; top up with the rest."""
+        if len(cands) <= m:
+            return [n for _, n in cands]
+        ids = [n for _, n in cands]
+        vecs = self._vec(ids)
+        pair = vecs @ vecs.T
+        closest = np.full(len(ids), -np.inf, dtype=np.float32)  # max sim to any kept neighbour
+        keep: List[int] = []
+        skipped: List[int] = []
+        for j, (s, _) in enumerate(cands):
+            if len(keep) >= m:
+                break
+            if s > closest[j]:
+                keep.append(j)
+                np.maximum(closest, pair[j], out=closest)
+            else:
+                skipped.append(j)
+        keep.extend(skipped[: m - len(keep)])
+        return [ids[j] for j in keep]
+
+    def add(self, node: int) -> None:
+        """Insert row `node`; rows must be added in increasing order."""
+        assert node == len(self.links), "rows must be inserted in order"
+        level = int(-math.log(1.0 - self.rng.random()) * self.ml)
+        self.links.append([[] for _ in range(level + 1)])
+        if self.entry < 0:
+            self.entry, self.max_level = node, level
+            return
+
+        q = self._vec(node)
+        sims = lambda ids: self._vec(ids) @ q  # noqa: E731
+        ep = [(float(self._vec(self.entry) @ q), self.entry)]
+        for layer in range(self.max_level, level, -1):
+            self._epoch += 1
+            ep = _search_layer(ep, 1, self._neighbors(layer), sims, self._seen, self._epoch)[:1]
+
+        for layer in range(min(level, self.max_level), -1, -1):
+            self._epoch += 1
+            found = _search_layer(ep, self.ef_construction, self._neighbors(layer), sims,
+                                  self._seen, self._epoch)
+            mmax = self.M0 if layer == 0 else self.M
+            self.links[node][layer] = self._select(found, self.M)
+            for n in self.links[node][layer]:
+                lst = self.links[n][layer]
+                lst.append(node)
+                if len(lst) > mmax:
+                    s = (self._vec(lst) @ self._vec(n)).tolist()
+                    self.links[n][layer] = self._select(sorted(zip(s, lst), reverse=True), mmax)
+            ep = found
+
+        if level > self.max_level:
+            self.entry, self.max_level = node, level
+
+    def _neighbors(self, layer: int) -> Neighbors:
+        return lambda n: np.asarray(self.links[n][layer], dtype=np.int64)
+
+    def save(self, path: str, index_gen: Optional[str] = None) -> None:
+        n = len(self.links)
+        levels = np.asarray([len(l) - 1 for l in self.links], dtype=np.int8)
+        level0 = np.full((n, self.M0), -1, dtype=np.int32)
+        upper_ptr = np.full(n, -1, dtype=np.int64)
+        upper_rows: List[List[int]] = []
+        for node, layers in enumerate(self.links):
+            level0[node, :len(layers[0])] = layers[0]
+            if len(layers) > 1:
+                upper_ptr[node] = len(upper_rows)
+                for lst in layers[1:]:
+                    upper_rows.append(lst + [-1] * (self.M - len(lst)))
+        upper = np.asarray(upper_rows, dtype=np.int32).reshape(-1, self.M)
+
+        for name, arr in ((LEVELS_FILE, levels), (LEVEL0_FILE, level0),
+                          (UPPER_PTR_FILE, upper_ptr), (UPPER_FILE, upper)):
+            tmp = os.path.join(path, name) + ".tmp"
+            with open(tmp, "wb") as fh:
+                np.save(fh, arr)
+            os.replace(tmp, os.path.join(path, name))
+        meta = {"count": n, "M": self.M, "ef_construction": self.ef_construction,
+                "entry": self.entry, "max_level": self.max_level, "index_gen": index_gen}
+        tmp = os.path.join(path, META_FILE) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(meta, fh)
+        os.replace(tmp, os.path.join(path, META_FILE))
+
+    @classmethod
+    def resume(cls, path: str, vectors: np.ndarray, ef_construction: int,
+               seed: int = 0) -> "HNSWBuilder":
+        """Rehydrate the graph saved at `path` so new rows can be appended to it."""
+        meta, g = _load_graph(path)
+        b = cls(vectors, int(meta["M"]), ef_construction, seed=seed + int(meta["count"]))
+        for node in range(int(meta["count"])):
+            row = g["level0"][node]
+            layers = [row[row >= 0].tolist()]
+            ptr = int(g["upper_ptr"][node])
+            for layer in range(1, int(g["levels"][node]) + 1):
+                row = g["upper"][ptr + layer - 1]
+                layers.append(row[row >= 0].tolist())
+            b.links.append(layers)
+        b.entry, b.max_level = int(meta["entry"]), int(meta["max_level"])
+        return b
+
+
+class HNSWIndex:
+    """Read-only, memory-mapped graph searched against a VectorIndex's rows."""
+
+    def __init__(self, index: vector_index.VectorIndex, path: Optional[str] = None,
+                 ef_search: int = DEFAULT_EF_SEARCH):
+        meta, g = _load_graph(path or index.path)
+        self.index = index
+        self.count = int(meta["count"])
+        self.M = int(meta["M"])
+        self.ef_construction = int(meta["ef_construction"])
+        self.entry = int(meta["entry"])
+        self.max_level = int(meta["max_level"])
+        self.ef_search = ef_search
+        self.levels, self.level0 = g["levels"], g["level0"]
+        self.upper_ptr, self.upper = g["upper_ptr"], g["upper"]
+        vector_index.check_built_from(index, meta.get("index_gen"), self.count, "HNSW graph")
+        dead = index.tombstones
+        self.live = self.count - (0 if dead is None else int(np.count_nonzero(dead)))
+
+    def _neighbors(self, layer: int) -> Neighbors:
+        if layer == 0:
+            def _n(node):
+                row = self.level0[node]
+                return row[row >= 0].astype(np.int64)
+        else:
+            def _n(node):
+                row = self.upper[int(self.upper_ptr[node]) + layer - 1]
+                return row[row >= 0].astype(np.int64)
+        return _n
+
+    def search(self, query: np.ndarray, k: int, ef: Optional[int] = None) -> List[Tuple[int, float]]:
+        """
+        Approximate top-k (row, score), best first; tombstoned rows are skipped.
+        Tombstoned nodes still take beam slots, so ef is widened by their share
+        and doubled until k live rows (or every live row) are found.
+        """
+        if self.live == 0 or k <= 0:
+            return []
+        q = vector_index.normalize_rows(np.asarray(query, dtype=np.float32).reshape(-1))
+        vectors = self.index.vectors
+        sims = lambda ids: np.asarray(vectors[ids], dtype=np.float32) @ q  # noqa: E731
+        seen = np.zeros(self.count, dtype=np.int32)  # calloc'd: pages only touched when visited
+
+        ep = [(float(sims(np.asarray([self.entry]))[0]), self.entry)]
+        for layer in range(self.max_level, 0, -1):
+            ep = _search_layer(ep, 1, self._neighbors(layer), sims, seen, layer + 1)[:1]
+
+        dead = self.index.tombstones
+        ef = min(self.count, -(-max(ef or self.ef_search, k) * self.count // self.live))
+        want, epoch = min(k, self.live), 1
+        while True:
+            found = _search_layer(ep, ef, self._neighbors(0), sims, seen, epoch)
+            out = [(n, s) for s, n in found if dead is None or not dead[n]]
+            if len(out) >= want or ef >= self.count:
+                return out[:k]
+            # epochs 2..max_level+1 marked the upper layers
+            ef, epoch = min(self.count, ef * 2), max(epoch, self.max_level + 1) + 1
+
+
+def build(path: str, M: int = DEFAULT_M, ef_construction: int = DEFAULT_EF_CONSTRUCTION,
+          resume: bool = False) -> dict:
+    """
+    Build (or, with resume=True, extend) the graph for the index at `path`.
+    Resuming only inserts rows added since the last build, so it must not be
+    used after the index was compacted (row numbers change).
+    """
+    index = vector_index.VectorIndex(path)
+    builder = None
+    if resume and os.path.exists(os.path.join(path, META_FILE)):
+        meta, _ = _load_graph(path)
+        if meta.get("M") == M and meta.get("count", 0) <= len(index):
+            builder = HNSWBuilder.resume(path, index.vectors, ef_construction)
+    if builder is None:
+        builder = HNSWBuilder(index.vectors, M, ef_construction)
+    start = len(builder.links)
+    for row in range(start, len(index)):
+        builder.add(row)
+    builder.save(path, index.gen)
+    return {"nodes": len(index), "inserted": len(index) - start, "max_level": builder.max_level}
+
+
+def remove(path: str) -> None:
+    """Delete a graph that no longer matches its index."""
+    for name in (META_FILE, LEVELS_FILE, LEVEL0_FILE, UPPER_PTR_FILE, UPPER_FILE):
+        if os.path.exists(os.path.join(path, name)):
+            os.remove(os.path.join(path, name))
+
+
+def load(index: vector_index.VectorIndex, ef_search: int = DEFAULT_EF_SEARCH) -> Optional[HNSWIndex]:
+    if not os.path.exists(os.path.join(index.path, META_FILE)):
+        return None
+    return HNSWIndex(index, ef_search=ef_search)
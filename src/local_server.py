@@ -0,0 +1,72 @@
+# local_server.py
+"""
+Minimal local HTTP front end for the Lambda handler.
+
+    POST /query          buffered JSON response (same as API Gateway)
+    POST /query/stream   chunked transfer encoding, newline-delimited JSON:
+                         {"delta": "..."} per model chunk, then {"done": true, ...}
+
+    python local_server.py --port 8080
+    curl -N -X POST localhost:8080/query/stream -d @payload.json
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import json
+import os
+
+# a long-running process can fold history summaries off the request path
+os.environ.setdefault("HISTORY_BACKGROUND", "1")
+from handler import handler, stream_handler  # noqa: E402
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # required for chunked transfer encoding
+
+    def _read_event(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length).decode("utf-8") if length else "{}"
+        return {"rawPath": self.path, "body": body}
+
+    def _chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        event = self._read_event()
+        if self.path == "/query":
+            resp = handler(event, None)
+            data = resp["body"].encode("utf-8")
+            self.send_response(resp["statusCode"])
+            for key, value in resp["headers"].items():
+                self.send_header(key, value)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        elif self.path == "/query/stream":
+            status, lines = stream_handler(event)
+            self.send_response(status)
+            self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                for line in lines:
+                    self._chunk(line.encode("utf-8"))
+            except Exception as err:  # the status line is already sent; report in-band
+                self._chunk((json.dumps({"error": str(err), "done": True}) + "\n").encode("utf-8"))
+            self.wfile.write(b"0\r\n\r\n")
+        else:
+            self.send_error(404)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8080)
+    args = ap.parse_args()
+    server = ThreadingHTTPServer((args.host, args.port), _Handler)
+    print(f"listening on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
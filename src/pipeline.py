@@ -0,0 +1,138 @@
+"""
+Per-request stage pipeline.
+
+The pre-model work of a request -- vitals fetch + context, conversation
+history, reference retrieval -- has no dependencies between stages, so each
+runs on a thread of one module-level pool and the request waits only for
+the slowest. Every wait is bounded by the request's Deadline, taken from the
+Lambda context's remaining time; a stage that misses it is replaced by its
+fallback (payload-only vitals, client history, no reference material).
+Stages also get the Deadline itself to stop early (Deadline.check()).
+
+A stage that misses its deadline keeps its thread until it returns, so a
+stage is never queued behind such stragglers: when every pool worker is
+busy it runs on a thread of its own instead. A stage still queued when the
+deadline passes is not run at all.
+"""
+from __future__ import annotations
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Any, Callable, Dict, List
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "4"))
+# Used when no Lambda context is available (local runs, tests); matches the
+# function timeout in ApiStack.
+REQUEST_TIMEOUT_S = float(os.getenv("REQUEST_TIMEOUT_S", "10"))
+# Kept back from the Lambda's remaining time for serialising the response.
+DEADLINE_RESERVE_MS = int(os.getenv("DEADLINE_RESERVE_MS", "300"))
+
+_POOL = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="stage")
+_busy: Dict[ThreadPoolExecutor, int] = {}   # per pool: stages submitted and not yet finished
+_busy_lock = threading.Lock()
+
+
+class Deadline:
+    def __init__(self, budget_s: float, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.budget_s = max(0.0, budget_s)
+        self.at = clock() + self.budget_s
+
+    @classmethod
+    def from_context(cls, context, default_s: float = REQUEST_TIMEOUT_S,
+                     reserve_ms: int = DEADLINE_RESERVE_MS) -> "Deadline":
+        """Deadline `reserve_ms` before the Lambda is stopped (`default_s` without a context)."""
+        remaining = getattr(context, "get_remaining_time_in_millis", None)
+        budget_ms = remaining() if callable(remaining) else default_s * 1000
+        return cls((budget_ms - reserve_ms) / 1000)
+
+    def remaining(self, reserve_s: float = 0.0) -> float:
+        """Seconds left, less `reserve_s` kept for later work."""
+        return max(0.0, self.at - reserve_s - self.clock())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def check(self) -> None:
+        """Raise TimeoutError once the deadline has passed (for loops over pages, chunks...)."""
+        if self.expired:
+            raise TimeoutError("request deadline exceeded")
+
+
+class Stages:
+    """Named stages of one request, started on the shared pool and awaited by name."""
+
+    def __init__(self, deadline: Deadline, pool: ThreadPoolExecutor = _POOL):
+        self.deadline = deadline
+        self.pool = pool
+        self.futures: Dict[str, Future] = {}
+        self.ms: Dict[str, int] = {}
+        self.missed: List[str] = []
+
+    def start(self, name: str, fn: Callable, *args, **kwargs) -> None:
+        def run():
+            self.deadline.check()          # queued past the deadline: nobody will wait for it
+            t = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.ms[name] = int((time.perf_counter() - t) * 1000)
+        self.futures[name] = self._submit(name, run)
+
+    def _submit(self, name: str, run: Callable) -> Future:
+        """On the pool if a worker is free, else on a new daemon thread (never queued)."""
+        pool = self.pool
+        with _busy_lock:
+            free = _busy.get(pool, 0) < pool._max_workers
+            if free:
+                _busy[pool] = _busy.get(pool, 0) + 1
+        if free:
+            def release(_):                # also runs for stages cancelled while queued
+                with _busy_lock:
+                    _busy[pool] -= 1
+            future = pool.submit(run)
+            future.add_done_callback(release)
+            return future
+        logger.warning("stage pool busy with earlier stages; running %s on its own thread", name)
+        future = Future()
+
+        def own():
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(run())
+                except BaseException as err:
+                    future.set_exception(err)
+        threading.Thread(target=own, name=f"stage-{name}", daemon=True).start()
+        return future
+
+    def result(self, name: str, fallback: Callable[[], Any] = lambda: None, reserve_s: float = 0.0) -> Any:
+        """
+        The stage's result, waiting at most until `reserve_s` before the
+        deadline; `fallback()` if it was never started, did not finish in
+        time or raised (logged, and listed in `missed` like a timeout).
+        """
+        future = self.futures.get(name)
+        if future is None:
+            return fallback()
+        try:
+            return future.result(timeout=self.deadline.remaining(reserve_s))
+        except FutureTimeout:
+            logger.warning("stage %s missed the request deadline", name)
+        except Exception:
+            logger.exception("stage %s failed; using its fallback", name)
+        self.missed.append(name)
+        return fallback()
+
+    def cancel(self) -> None:
+        """Drop stages whose results are no longer needed (those already running finish unobserved)."""
+        for future in self.futures.values():
+            future.cancel()
+
+    def log_fields(self) -> Dict:
+        return {"stage_ms": dict(self.ms), "stages_missed": list(self.missed)}
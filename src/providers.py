@@ -0,0 +1,420 @@
+"""
+Per-provider request builders and response parsers for Bedrock models.
+
+The handler assembles one provider-neutral message list:
+
+    [{"role": "system" | "user" | "assistant", "content": str, "name"?: str}, ...]
+
+and an Adapter, picked once per model id (`for_model`), turns it into the
+body that model family expects and reads the reply along the one path that
+family uses. Token counts come from Bedrock's x-amzn-bedrock-*-token-count
+response headers when present, else from the provider's own usage fields.
+
+Messages flagged `"cache": True` end a stable prefix (system prompt, a
+user's vitals, the history so far). For models with Bedrock prompt caching
+(PROMPT_CACHE) the anthropic and converse adapters put a cache point after
+each, so later calls sharing the prefix skip re-processing it; the cache
+read / write token counts are added to token_usage.
+
+    anthropic  Messages API: top-level system, alternating user/assistant turns
+    meta       Llama 3 chat template in `prompt`, `max_gen_len`
+    mistral    [INST] prompt, `max_tokens`
+    titan      Titan Text `inputText` transcript, `textGenerationConfig`
+    converse   bedrock-runtime Converse API (any chat model; BEDROCK_API=converse)
+    generic    the historical {"messages", "max_tokens"} body, best-effort parse
+"""
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import json
+import os
+import re
+
+from streaming import BedrockStream, ConverseStream
+
+BEDROCK_API = os.getenv("BEDROCK_API", "invoke")   # "converse": use the Converse API for every model
+# Prompt cache points: "auto" for the model families Bedrock caches prompts
+# for (_CACHING_MODELS), "on" for every anthropic / converse model, "off".
+PROMPT_CACHE = os.getenv("PROMPT_CACHE", "auto")
+
+Message = Dict[str, Any]
+Block = Tuple[str, bool]   # (text, cache point after it)
+
+# named assistant messages that need a label once names are dropped
+_LABELS = {"vitals": "Context data:\n", "reference_material": "Reference material:\n"}
+# cross-region inference profile prefixes, e.g. "us.anthropic.claude-3-5-haiku-..."
+_REGION_PREFIXES = ("us", "eu", "apac", "us-gov", "global")
+_CACHING_MODELS = re.compile(r"claude-3-5-haiku|claude-3-7-sonnet|claude-(sonnet|opus|haiku)-4|"
+                             r"nova-(micro|lite|pro|premier)")
+
+
+@dataclass
+class Reply:
+    answer: str
+    model_version: Optional[str]
+    token_usage: Optional[Dict[str, Optional[int]]]
+    request_id: Optional[str]
+    stop_reason: Optional[str] = None
+
+
+def _usage(input_tokens, output_tokens, cache_read=None, cache_write=None) -> Optional[Dict[str, Optional[int]]]:
+    """
+    token_usage; input_tokens excludes prompt-cache hits and writes, which
+    are reported (when there are any) as cache_read/write_input_tokens and
+    counted in total_tokens.
+    """
+    if input_tokens is None and output_tokens is None:
+        return None
+    usage = {"input_tokens": input_tokens, "output_tokens": output_tokens}
+    if cache_read or cache_write:
+        usage.update(cache_read_input_tokens=cache_read or 0, cache_write_input_tokens=cache_write or 0)
+    usage["total_tokens"] = (input_tokens or 0) + (output_tokens or 0) + (cache_read or 0) + (cache_write or 0)
+    return usage
+
+
+def _header_usage(resp: Dict, fallback: Optional[Dict] = None) -> Optional[Dict[str, Optional[int]]]:
+    """
+    Exact counts Bedrock reports in the InvokeModel response headers; any
+    missing count is taken from `fallback` (the usage parsed from the body).
+    """
+    headers = (resp.get("ResponseMetadata") or {}).get("HTTPHeaders") or {}
+    fallback = fallback or {}
+    counts = []
+    for kind, key in (("input", "input_tokens"), ("output", "output_tokens"),
+                      ("cache-read-input", "cache_read_input_tokens"),
+                      ("cache-write-input", "cache_write_input_tokens")):
+        value = headers.get(f"x-amzn-bedrock-{kind}-token-count")
+        counts.append(int(value) if value is not None else fallback.get(key))
+    return _usage(*counts)
+
+
+def caches_prompt(model_id: str) -> bool:
+    """Whether requests to `model_id` carry prompt cache points (PROMPT_CACHE)."""
+    if PROMPT_CACHE == "auto":
+        return bool(_CACHING_MODELS.search(model_id or ""))
+    return PROMPT_CACHE == "on"
+
+
+def _request_id(resp: Dict) -> Optional[str]:
+    meta = resp.get("ResponseMetadata") or {}
+    return meta.get("RequestId") or meta.get("RequestID")
+
+
+def _text(m: Message) -> str:
+    return _LABELS.get(m.get("name", ""), "") + m["content"]
+
+
+def split_blocks(messages: Iterable[Message]) -> Tuple[List[Block], List[Tuple[str, List[Block]]]]:
+    """
+    (system blocks, [(role, blocks), ...]) with consecutive same-role
+    messages merged into one turn and a leading assistant turn dropped, as
+    chat APIs require strictly alternating turns that start with the user.
+    """
+    system: List[Block] = []
+    turns: List[Tuple[str, List[Block]]] = []
+    for m in messages:
+        if m["role"] == "system":
+            system.append((m["content"], bool(m.get("cache"))))
+        elif turns and turns[-1][0] == m["role"]:
+            turns[-1][1].append((_text(m), bool(m.get("cache"))))
+        elif turns or m["role"] == "user":
+            turns.append((m["role"], [(_text(m), bool(m.get("cache")))]))
+    return system, turns
+
+
+def _join(blocks: List[Block]) -> str:
+    return "\n\n".join(text for text, _ in blocks)
+
+
+def split_system(messages: Iterable[Message]) -> Tuple[str, List[Tuple[str, str]]]:
+    """split_blocks with each turn's blocks joined into one text (no cache points)."""
+    system, turns = split_blocks(messages)
+    return _join(system), [(role, _join(blocks)) for role, blocks in turns]
+
+
+class Adapter:
+    name = "base"
+
+    def body(self, messages: List[Message], max_tokens: int, cache: bool = False) -> Dict:
+        """Request body; `cache` asks for prompt cache points where the format has them."""
+        raise NotImplementedError
+
+    def parse(self, body: Dict) -> Tuple[str, Optional[str], Optional[Dict], Optional[str]]:
+        """(answer, model_version, token_usage from the body, stop_reason)."""
+        raise NotImplementedError
+
+    def invoke(self, client, model_id: str, messages: List[Message], max_tokens: int) -> Reply:
+        body = self.body(messages, max_tokens, cache=caches_prompt(model_id))
+        resp = client.invoke_model(modelId=model_id, body=json.dumps(body).encode())
+        raw = resp["body"].read()
+        try:
+            body = json.loads(raw)
+        except ValueError:
+            return Reply(raw.decode("utf-8", errors="ignore"), None, _header_usage(resp), _request_id(resp))
+        answer, version, usage, stop = self.parse(body)
+        return Reply(answer, version, _header_usage(resp, usage), _request_id(resp), stop)
+
+    def stream(self, client, model_id: str, messages: List[Message], max_tokens: int,
+               t_start: Optional[float] = None) -> BedrockStream:
+        body = self.body(messages, max_tokens, cache=caches_prompt(model_id))
+        resp = client.invoke_model_with_response_stream(modelId=model_id, body=json.dumps(body).encode())
+        return BedrockStream(resp, t_start=t_start)
+
+
+class AnthropicAdapter(Adapter):
+    name = "anthropic"
+
+    def body(self, messages, max_tokens, cache=False):
+        if not cache:
+            system, turns = split_system(messages)
+            body = {"anthropic_version": "bedrock-2023-05-31", "max_tokens": max_tokens,
+                    "messages": [{"role": role, "content": text} for role, text in turns]}
+            if system:
+                body["system"] = system
+            return body
+        system_blocks, block_turns = split_blocks(messages)
+        body = {"anthropic_version": "bedrock-2023-05-31", "max_tokens": max_tokens,
+                "messages": [{"role": role, "content": self._content(blocks)} for role, blocks in block_turns]}
+        if system_blocks:
+            body["system"] = self._content(system_blocks)
+        return body
+
+    @staticmethod
+    def _content(blocks: List[Block]) -> List[Dict]:
+        content = []
+        for text, cache in blocks:
+            content.append({"type": "text", "text": text})
+            if cache:
+                content[-1]["cache_control"] = {"type": "ephemeral"}
+        return content
+
+    def parse(self, body):
+        content = body.get("content")
+        if isinstance(content, list):
+            content = "".join(block.get("text", "") for block in content if block.get("type") == "text")
+        usage = body.get("usage") or {}
+        return (content or "", body.get("model"),
+                _usage(usage.get("input_tokens"), usage.get("output_tokens"),
+                       usage.get("cache_read_input_tokens"), usage.get("cache_creation_input_tokens")),
+                body.get("stop_reason"))
+
+
+class MetaAdapter(Adapter):
+    name = "meta"
+
+    def body(self, messages, max_tokens, cache=False):
+        system, turns = split_system(messages)
+        parts = ["<|begin_of_text|>"]
+        if system:
+            parts.append(f"<|start_header_id|>system<|end_header_id|>\n\n{system}<|eot_id|>")
+        for role, text in turns:
+            parts.append(f"<|start_header_id|>{role}<|end_header_id|>\n\n{text}<|eot_id|>")
+        parts.append("<|start_header_id|>assistant<|end_header_id|>\n\n")
+        return {"prompt": "".join(parts), "max_gen_len": max_tokens}
+
+    def parse(self, body):
+        return (body.get("generation", ""), None,
+                _usage(body.get("prompt_token_count"), body.get("generation_token_count")),
+                body.get("stop_reason"))
+
+
+class MistralAdapter(Adapter):
+    name = "mistral"
+
+    def body(self, messages, max_tokens, cache=False):
+        system, turns = split_system(messages)
+        prompt = "<s>"
+        for i, (role, text) in enumerate(turns):
+            if role == "user":
+                if i == 0 and system:
+                    text = f"{system}\n\n{text}"
+                prompt += f"[INST] {text} [/INST]"
+            else:
+                prompt += f" {text}</s>"
+        return {"prompt": prompt, "max_tokens": max_tokens}
+
+    def parse(self, body):
+        out = (body.get("outputs") or [{}])[0]
+        return out.get("text", ""), None, None, out.get("stop_reason")
+
+
+class TitanAdapter(Adapter):
+    name = "titan"
+
+    def body(self, messages, max_tokens, cache=False):
+        system, turns = split_system(messages)
+        lines = [system] if system else []
+        lines += [f"{'User' if role == 'user' else 'Bot'}: {text}" for role, text in turns]
+        lines.append("Bot:")
+        return {"inputText": "\n\n".join(lines),
+                "textGenerationConfig": {"maxTokenCount": max_tokens, "stopSequences": ["User:"]}}
+
+    def parse(self, body):
+        result = (body.get("results") or [{}])[0]
+        return (result.get("outputText", ""), None,
+                _usage(body.get("inputTextTokenCount"), result.get("tokenCount")),
+                result.get("completionReason"))
+
+
+class ConverseAdapter(Adapter):
+    name = "converse"
+
+    def request(self, model_id: str, messages: List[Message], max_tokens: int) -> Dict:
+        if not caches_prompt(model_id):
+            system, turns = split_system(messages)
+            kwargs = {"modelId": model_id,
+                      "messages": [{"role": role, "content": [{"text": text}]} for role, text in turns],
+                      "inferenceConfig": {"maxTokens": max_tokens}}
+            if system:
+                kwargs["system"] = [{"text": system}]
+            return kwargs
+        system_blocks, block_turns = split_blocks(messages)
+        kwargs = {"modelId": model_id,
+                  "messages": [{"role": role, "content": self._content(blocks)} for role, blocks in block_turns],
+                  "inferenceConfig": {"maxTokens": max_tokens}}
+        if system_blocks:
+            kwargs["system"] = self._content(system_blocks)
+        return kwargs
+
+    @staticmethod
+    def _content(blocks: List[Block]) -> List[Dict]:
+        content = []
+        for text, cache in blocks:
+            content.append({"text": text})
+            if cache:
+                content.append({"cachePoint": {"type": "default"}})
+        return content
+
+    def invoke(self, client, model_id, messages, max_tokens):
+        resp = client.converse(**self.request(model_id, messages, max_tokens))
+        content = ((resp.get("output") or {}).get("message") or {}).get("content") or []
+        usage = resp.get("usage") or {}
+        return Reply("".join(block.get("text", "") for block in content), None,
+                     _usage(usage.get("inputTokens"), usage.get("outputTokens"),
+                            usage.get("cacheReadInputTokens"), usage.get("cacheWriteInputTokens")),
+                     _request_id(resp), resp.get("stopReason"))
+
+    def stream(self, client, model_id, messages, max_tokens, t_start=None):
+        return ConverseStream(client.converse_stream(**self.request(model_id, messages, max_tokens)),
+                              t_start=t_start)
+
+
+class GenericAdapter(Adapter):
+    """The provider-neutral body every model used to get; parsed best-effort."""
+    name = "generic"
+
+    def body(self, messages, max_tokens, cache=False):
+        return {"messages": [{k: v for k, v in m.items() if k != "cache"} for m in messages],
+                "max_tokens": max_tokens}
+
+    def parse(self, body):
+        answer, version, usage = extract_any(body)
+        return answer, version, usage, None
+
+
+_ADAPTERS = {
+    "anthropic": AnthropicAdapter(),
+    "meta": MetaAdapter(),
+    "mistral": MistralAdapter(),
+    "amazon": TitanAdapter(),
+}
+_CONVERSE = ConverseAdapter()
+_GENERIC = GenericAdapter()
+_BY_MODEL: Dict[str, Adapter] = {}
+
+
+def provider_of(model_id: str) -> str:
+    """"anthropic" for "anthropic.claude-..." and "us.anthropic.claude-..."."""
+    parts = (model_id or "").split("/")[-1].split(".")
+    if len(parts) > 2 and parts[0] in _REGION_PREFIXES:
+        parts = parts[1:]
+    return parts[0]
+
+
+def for_model(model_id: str) -> Adapter:
+    """The adapter for `model_id`, chosen once per model id."""
+    adapter = _BY_MODEL.get(model_id)
+    if adapter is None:
+        provider = provider_of(model_id)
+        if BEDROCK_API == "converse":
+            adapter = _CONVERSE
+        elif provider == "amazon" and "titan-text" not in model_id:
+            adapter = _CONVERSE   # Nova and other Amazon chat models
+        else:
+            adapter = _ADAPTERS.get(provider, _GENERIC)
+        _BY_MODEL[model_id] = adapter
+    return adapter
+
+
+def extract_any(body: Dict) -> Tuple[str, Optional[str], Optional[Dict]]:
+    """
+    Best-effort extraction across Bedrock providers, for models without an
+    adapter. Returns: (answer, model_version, token_usage)
+    """
+    # ----- answer (multiple common shapes) -----
+    answer = (
+        body.get("content")  # Anthropic-like
+        or (body.get("message") or {}).get("content")  # Meta/DeepSeek-like
+        or (
+            body.get("choices", [{}])[0].get("message", {}).get("content")
+            if body.get("choices") else None
+        )  # OpenAI-like
+        or body.get("results", [{}])[0].get("outputText")  # AI21-like
+        or body.get("outputText")  # some Titan responses
+    )
+    if isinstance(answer, list):   # content blocks
+        answer = "".join(block.get("text", "") for block in answer if isinstance(block, dict))
+
+    # ----- model version (check several places) -----
+    model_version = (
+        body.get("modelVersion")
+        or body.get("version")
+        or (body.get("meta") or {}).get("model_version")
+        or (body.get("message") or {}).get("model_version")
+        or (body.get("model") if isinstance(body.get("model"), str) else None)
+    )
+
+    # ----- usage normalization -----
+    # Common locations: top-level usage, meta.usage, message.usage, choices[0].usage
+    raw_usage = (
+        body.get("usage")
+        or (body.get("meta") or {}).get("usage")
+        or (body.get("message") or {}).get("usage")
+        or (body.get("choices", [{}])[0].get("usage") if body.get("choices") else None)
+    )
+    token_usage = None
+    if isinstance(raw_usage, dict):
+        token_usage = {
+            "input_tokens": (
+                raw_usage.get("input_tokens")
+                or raw_usage.get("prompt_tokens")
+                or raw_usage.get("inputTokens")
+                or raw_usage.get("promptTokens")
+            ),
+            "output_tokens": (
+                raw_usage.get("output_tokens")
+                or raw_usage.get("completion_tokens")
+                or raw_usage.get("outputTokens")
+                or raw_usage.get("completionTokens")
+            ),
+            "total_tokens": (
+                raw_usage.get("total_tokens")
+                or raw_usage.get("totalTokens")
+            ),
+        }
+        # Compute total if provider didn’t supply it but parts exist
+        if token_usage["total_tokens"] is None:
+            it = token_usage["input_tokens"] or 0
+            ot = token_usage["output_tokens"] or 0
+            total = it + ot
+            token_usage["total_tokens"] = total if (it or ot) else None
+
+        # If all None, treat as absent
+        if not any(v is not None for v in token_usage.values()):
+            token_usage = None
+
+    # Final fallback: return JSON if we couldn't find a content field
+    if answer is None:
+        answer = json.dumps(body)
+
+    return answer, model_version, token_usage
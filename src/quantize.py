@@ -0,0 +1,221 @@
+"""
+Compressed copies of the embedding matrix for the scan phase of retrieval.
+
+    int8   per-dimension symmetric scalar quantisation        4x smaller
+    pq     product quantisation, m sub-spaces x 256 centroids  4*dim/m x smaller
+
+A query first scans the compressed codes (the only array that becomes fully
+resident), then re-scores the best `rerank` candidates against the
+full-precision rows, which stay memory-mapped and are paged in for those
+candidates only. Callers see exact cosine scores either way.
+
+Files written next to the vector index:
+
+    quant_meta.json      {"mode", "count", "index_gen", ...}
+    quant_int8.npy       (count, dim) int8        + quant_int8_scale.npy (dim,) float32
+    quant_pq_codes.npy   (count, m) uint8         + quant_pq_codebooks.npy (m, 256, dim/m) float32
+"""
+from __future__ import annotations
+from typing import Dict, List, Optional, Tuple
+import json
+import os
+
+import numpy as np
+
+import vector_index
+
+META_FILE = "quant_meta.json"
+INT8_FILE = "quant_int8.npy"
+INT8_SCALE_FILE = "quant_int8_scale.npy"
+PQ_CODES_FILE = "quant_pq_codes.npy"
+PQ_CODEBOOKS_FILE = "quant_pq_codebooks.npy"
+
+DEFAULT_PQ_M = 32
+DEFAULT_RERANK = 128
+_KSUB = 256
+_TRAIN_ROWS = 65536
+_BLOCK_ROWS = 65536
+
+
+def _save(path: str, arr: np.ndarray) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as fh:
+        np.save(fh, arr)
+    os.replace(tmp, path)
+
+
+def _rows(vectors: np.ndarray, start: int, stop: int) -> np.ndarray:
+    return np.asarray(vectors[start:stop], dtype=np.float32)
+
+
+# ---------- int8 ------------------------------------------------------------
+def int8_scale(vectors: np.ndarray) -> np.ndarray:
+    peak = np.zeros(vectors.shape[1], dtype=np.float32)
+    for start in range(0, vectors.shape[0], _BLOCK_ROWS):
+        np.maximum(peak, np.abs(_rows(vectors, start, start + _BLOCK_ROWS)).max(axis=0), out=peak)
+    peak[peak == 0] = 1.0
+    return peak / 127.0
+
+
+def int8_encode(vectors: np.ndarray, scale: np.ndarray) -> np.ndarray:
+    return np.clip(np.rint(np.asarray(vectors, dtype=np.float32) / scale), -127, 127).astype(np.int8)
+
+
+# ---------- product quantisation -------------------------------------------
+def _kmeans(x: np.ndarray, k: int, iters: int, rng: np.random.Generator) -> np.ndarray:
+    cent = x[rng.choice(x.shape[0], size=k, replace=x.shape[0] < k)].copy()
+    for _ in range(iters):
+        assign = _nearest(x, cent)
+        sums = np.zeros_like(cent)
+        np.add.at(sums, assign, x)
+        counts = np.bincount(assign, minlength=k)
+        empty = counts == 0
+        cent[~empty] = sums[~empty] / counts[~empty, None]
+        if empty.any():  # re-seed dead centroids from random points
+            cent[empty] = x[rng.choice(x.shape[0], size=int(empty.sum()))]
+    return cent
+
+
+def _nearest(x: np.ndarray, cent: np.ndarray) -> np.ndarray:
+    # argmin ||x - c||^2 == argmax (x.c - ||c||^2 / 2)
+    return np.argmax(x @ cent.T - 0.5 * (cent * cent).sum(axis=1), axis=1)
+
+
+def pq_train(vectors: np.ndarray, m: int, iters: int = 20, seed: int = 0) -> np.ndarray:
+    dim = vectors.shape[1]
+    if dim % m:
+        raise ValueError(f"pq m={m} must divide dim={dim}")
+    rng = np.random.default_rng(seed)
+    n = vectors.shape[0]
+    sample = np.asarray(vectors[np.sort(rng.choice(n, size=min(n, _TRAIN_ROWS), replace=False))], dtype=np.float32)
+    dsub = dim // m
+    return np.stack([
+        _kmeans(sample[:, j * dsub:(j + 1) * dsub], _KSUB, iters, rng) for j in range(m)
+    ]).astype(np.float32)
+
+
+def pq_encode(vectors: np.ndarray, codebooks: np.ndarray) -> np.ndarray:
+    m, _, dsub = codebooks.shape
+    x = np.asarray(vectors, dtype=np.float32)
+    codes = np.empty((x.shape[0], m), dtype=np.uint8)
+    for j in range(m):
+        codes[:, j] = _nearest(x[:, j * dsub:(j + 1) * dsub], codebooks[j])
+    return codes
+
+
+# ---------- build -----------------------------------------------------------
+def build(path: str, mode: str, pq_m: int = DEFAULT_PQ_M, resume: bool = False) -> Dict:
+    """
+    Encode the index at `path`. With resume=True and existing codes for the
+    same mode, only rows appended since then are encoded (the scale /
+    codebooks are kept); must not be used after a compaction.
+    """
+    index = vector_index.VectorIndex(path)
+    vecs, n = index.vectors, len(index)
+    old = load_meta(path) if resume else None
+    if old and (old.get("mode") != mode or old.get("count", 0) > n or (mode == "pq" and old.get("m") != pq_m)):
+        old = None
+    start = old["count"] if old else 0
+    if not old:
+        remove(path)  # drop codes of another mode / stale parameters
+
+    if mode == "int8":
+        scale = np.load(os.path.join(path, INT8_SCALE_FILE)) if old else int8_scale(vecs)
+        prev = np.load(os.path.join(path, INT8_FILE), mmap_mode="r")[:start] if old else np.zeros((0, index.dim), np.int8)
+        parts = [prev] + [int8_encode(_rows(vecs, s, s + _BLOCK_ROWS), scale) for s in range(start, n, _BLOCK_ROWS)]
+        codes = np.concatenate(parts) if parts else prev
+        _save(os.path.join(path, INT8_SCALE_FILE), scale)
+        _save(os.path.join(path, INT8_FILE), codes)
+        meta = {"mode": "int8", "count": n, "index_gen": index.gen}
+    elif mode == "pq":
+        books = np.load(os.path.join(path, PQ_CODEBOOKS_FILE)) if old else pq_train(vecs, pq_m)
+        prev = np.load(os.path.join(path, PQ_CODES_FILE), mmap_mode="r")[:start] if old else np.zeros((0, pq_m), np.uint8)
+        parts = [prev] + [pq_encode(_rows(vecs, s, s + _BLOCK_ROWS), books) for s in range(start, n, _BLOCK_ROWS)]
+        codes = np.concatenate(parts)
+        _save(os.path.join(path, PQ_CODEBOOKS_FILE), books)
+        _save(os.path.join(path, PQ_CODES_FILE), codes)
+        meta = {"mode": "pq", "count": n, "m": pq_m, "index_gen": index.gen}
+    else:
+        raise ValueError(f"unknown quantisation mode: {mode!r}")
+
+    tmp = os.path.join(path, META_FILE) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(meta, fh)
+    os.replace(tmp, os.path.join(path, META_FILE))
+    return dict(meta, encoded=n - start, code_bytes=int(codes.nbytes))
+
+
+def remove(path: str) -> None:
+    for name in (META_FILE, INT8_FILE, INT8_SCALE_FILE, PQ_CODES_FILE, PQ_CODEBOOKS_FILE):
+        if os.path.exists(os.path.join(path, name)):
+            os.remove(os.path.join(path, name))
+
+
+def load_meta(path: str) -> Optional[Dict]:
+    try:
+        with open(os.path.join(path, META_FILE), encoding="utf-8") as fh:
+            return json.load(fh)
+    except OSError:
+        return None
+
+
+# ---------- search ----------------------------------------------------------
+class QuantizedSearcher:
+    """Scan compressed codes, then rerank the best candidates at full precision."""
+
+    def __init__(self, index: vector_index.VectorIndex, rerank: int = DEFAULT_RERANK):
+        meta = load_meta(index.path)
+        if meta is None:
+            raise ValueError(f"no quantised codes in {index.path}")
+        vector_index.check_built_from(index, meta.get("index_gen"), meta["count"], "quantised codes")
+        self.index = index
+        self.mode = meta["mode"]
+        self.rerank = rerank
+        if self.mode == "int8":
+            self.scale = np.load(os.path.join(index.path, INT8_SCALE_FILE))
+            self.codes = np.load(os.path.join(index.path, INT8_FILE), mmap_mode="r")
+        else:
+            self.codebooks = np.load(os.path.join(index.path, PQ_CODEBOOKS_FILE))
+            self.codes = np.load(os.path.join(index.path, PQ_CODES_FILE), mmap_mode="r")
+
+    def approx_scores(self, q: np.ndarray) -> np.ndarray:
+        n = self.codes.shape[0]
+        out = np.empty(n, dtype=np.float32)
+        if self.mode == "int8":
+            vector_index.blocked_dot(self.codes, q * self.scale, out)
+            return out
+        m, _, dsub = self.codebooks.shape
+        # asymmetric distance: per-subspace lookup table of query . centroid
+        table = np.einsum("jkd,jd->jk", self.codebooks, q.reshape(m, dsub))
+        for start in range(0, n, _BLOCK_ROWS):
+            stop = min(start + _BLOCK_ROWS, n)
+            block = np.asarray(self.codes[start:stop])
+            acc = table[0][block[:, 0]]
+            for j in range(1, m):
+                acc += table[j][block[:, j]]
+            out[start:stop] = acc
+        return out
+
+    def search(self, query: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        if k <= 0 or self.codes.shape[0] == 0:
+            return []
+        q = vector_index.normalize_rows(np.asarray(query, dtype=np.float32).reshape(-1))
+        approx = self.approx_scores(q)
+        if self.index.tombstones is not None:
+            approx[self.index.tombstones] = -np.inf
+        if self.rerank <= 0:  # approximate scores only (used to measure quantisation loss)
+            return vector_index.top_k(approx, k)
+        cand = np.asarray([r for r, _ in vector_index.top_k(approx, max(k, self.rerank))], dtype=np.int64)
+        if cand.shape[0] == 0:
+            return []
+        order = np.argsort(cand)  # ascending rows keep the memmap reads sequential
+        exact = np.empty(cand.shape[0], dtype=np.float32)
+        exact[order] = np.asarray(self.index.vectors[cand[order]], dtype=np.float32) @ q
+        best = vector_index.top_k(exact, k)
+        return [(int(cand[i]), s) for i, s in best]
+
+
+def load(index: vector_index.VectorIndex, rerank: int = DEFAULT_RERANK) -> Optional[QuantizedSearcher]:
+    if load_meta(index.path) is None:
+        return None
+    return QuantizedSearcher(index, rerank)
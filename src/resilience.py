@@ -0,0 +1,278 @@
+"""
+Retries, hedged requests and circuit breaking for Bedrock calls.
+
+    retries   throttling / 5xx / connection errors are retried with full-jitter
+              exponential backoff, never sleeping past the request deadline
+    hedging   if an attempt has not answered after the model's recent P95
+              latency, a second identical request is sent and the first
+              reply wins (buffered calls only; off unless BEDROCK_HEDGE=1)
+    breaker   per model: after BREAKER_FAILURES retryable failures within
+              BREAKER_WINDOW_S the model is skipped for BREAKER_COOLDOWN_S,
+              then one probe call decides; while open, calls go to the
+              fallback model if one is configured, else fail fast
+
+`Resilient.call(attempt, stats, deadline)` runs `attempt(model_id)` -- one
+plain call, e.g. an adapter's invoke -- under all three. Breakers and
+latencies live at module scope in the handler, so they span the requests
+of a warm container.
+
+`TimedClients` gives each call a client whose read timeout ends before the
+request deadline. The clients are built once, up front, for a fixed ladder
+of timeouts, so no client is created on the request path or from two
+threads at once.
+"""
+from __future__ import annotations
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+import logging
+import os
+import random
+import threading
+import time
+
+from botocore.config import Config
+from botocore.exceptions import (ClientError, ConnectionClosedError, ConnectTimeoutError,
+                                 EndpointConnectionError, ReadTimeoutError)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+BEDROCK_MAX_ATTEMPTS = int(os.getenv("BEDROCK_MAX_ATTEMPTS", "3"))
+BACKOFF_BASE_S = float(os.getenv("BACKOFF_BASE_S", "0.2"))
+BACKOFF_CAP_S = float(os.getenv("BACKOFF_CAP_S", "2"))
+MIN_ATTEMPT_S = float(os.getenv("MIN_ATTEMPT_S", "1"))        # don't start an attempt with less left
+BEDROCK_HEDGE = os.getenv("BEDROCK_HEDGE", "0") == "1"
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_MIN_DELAY_S = float(os.getenv("HEDGE_MIN_DELAY_S", "0.5"))
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_WINDOW_S = float(os.getenv("BREAKER_WINDOW_S", "30"))
+BREAKER_COOLDOWN_S = float(os.getenv("BREAKER_COOLDOWN_S", "20"))
+TIMEOUT_STEPS_S = (1, 2, 3, 4, 6, 8, 10, 15, 20, 30, 45, 60)
+
+_THROTTLED = {"ThrottlingException", "TooManyRequestsException"}
+_RETRYABLE = _THROTTLED | {"ServiceUnavailableException", "InternalServerException",
+                           "ModelNotReadyException", "ModelTimeoutException"}
+_TRANSIENT = (ConnectionClosedError, EndpointConnectionError, ConnectTimeoutError, ReadTimeoutError)
+
+
+class CircuitOpenError(Exception):
+    """Every candidate model's breaker is open: fail fast instead of queueing on a throttled model."""
+
+
+def error_code(err: BaseException) -> Optional[str]:
+    if isinstance(err, ClientError):
+        return err.response.get("Error", {}).get("Code")
+    return None
+
+
+def retryable(err: BaseException) -> bool:
+    return error_code(err) in _RETRYABLE or isinstance(err, _TRANSIENT)
+
+
+class CircuitBreaker:
+    def __init__(self, failures: int = BREAKER_FAILURES, window_s: float = BREAKER_WINDOW_S,
+                 cooldown_s: float = BREAKER_COOLDOWN_S, clock: Callable[[], float] = time.monotonic):
+        self.failures = failures
+        self.window_s = window_s
+        self.cooldown_s = cooldown_s
+        self.clock = clock
+        self.state = "closed"
+        self.opened_at = 0.0
+        self._recent: Deque[float] = deque()
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and self.clock() - self.opened_at >= self.cooldown_s:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._probing:
+                self._probing = True          # exactly one probe call
+                return True
+            return False
+
+    def release(self) -> None:
+        """Neutral outcome of an allowed call (e.g. a validation error): frees the probe, state unchanged."""
+        with self._lock:
+            self._probing = False
+
+    def record(self, ok: bool) -> None:
+        """Outcome of an allowed call: a success, or a retryable failure counting against the model."""
+        with self._lock:
+            now = self.clock()
+            self._probing = False
+            if ok:
+                self.state = "closed"
+                self._recent.clear()
+                return
+            if self.state == "half_open":
+                self.state, self.opened_at = "open", now
+                return
+            self._recent.append(now)
+            while self._recent and now - self._recent[0] > self.window_s:
+                self._recent.popleft()
+            if len(self._recent) >= self.failures:
+                self.state, self.opened_at = "open", now
+                logger.warning("circuit opened after %d failures in %.0fs", len(self._recent), self.window_s)
+
+
+class TimedClients:
+    """
+    Copies of `base` (a boto3 client) with read timeouts `steps` seconds and
+    no retries of their own, built in __init__ from one dedicated Session.
+    `until(deadline)` picks the longest timeout that still ends before the
+    deadline. A client without `meta` (a stub) is returned as is.
+    """
+
+    def __init__(self, base, max_s: float = TIMEOUT_STEPS_S[-1], steps: Tuple[int, ...] = TIMEOUT_STEPS_S):
+        self.base = base
+        self.clients: Dict[int, object] = {}
+        meta = getattr(base, "meta", None)
+        if meta is not None:
+            import boto3
+            session = boto3.session.Session()
+            for seconds in sorted(s for s in steps if s <= max(max_s, steps[0])):
+                config = meta.config.merge(Config(read_timeout=seconds, connect_timeout=min(seconds, 2),
+                                                  retries={"total_max_attempts": 1}))
+                self.clients[seconds] = session.client(meta.service_model.service_name,
+                                                       region_name=meta.region_name, config=config)
+
+    def until(self, deadline):
+        """Client for one call that must end before `deadline`; TimeoutError when none fits."""
+        left = deadline.remaining()
+        fitting = [s for s in self.clients if s <= left]
+        if left < 1 or (self.clients and not fitting):
+            raise TimeoutError("no time left for the call")
+        return self.clients[max(fitting)] if fitting else self.base
+
+
+class LatencyWindow:
+    """Recent successful call latencies of one model, for the hedge delay."""
+
+    def __init__(self, size: int = 200):
+        self._samples: Deque[float] = deque(maxlen=size)
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def p95(self) -> Optional[float]:
+        if len(self._samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+
+@dataclass
+class CallStats:
+    model_id: str
+    attempts: int = 0
+    hedged: int = 0
+    fell_back: bool = False
+    errors: List[str] = field(default_factory=list)
+
+    def log_fields(self) -> Dict:
+        return {"model_id": self.model_id, "attempts": self.attempts, "hedged": self.hedged,
+                "fell_back": self.fell_back, "errors": self.errors}
+
+
+class Resilient:
+    def __init__(self, max_attempts: int = BEDROCK_MAX_ATTEMPTS, hedge: bool = BEDROCK_HEDGE,
+                 fallback_model: str = "", sleep: Callable[[float], None] = time.sleep):
+        self.max_attempts = max(1, max_attempts)
+        self.hedge = hedge
+        self.fallback_model = fallback_model
+        self.sleep = sleep
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.latency: Dict[str, LatencyWindow] = {}
+        self._pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hedge") if hedge else None
+        self._lock = threading.Lock()
+
+    def _state(self, model_id: str) -> Tuple[CircuitBreaker, LatencyWindow]:
+        with self._lock:
+            if model_id not in self.breakers:
+                self.breakers[model_id] = CircuitBreaker()
+                self.latency[model_id] = LatencyWindow()
+            return self.breakers[model_id], self.latency[model_id]
+
+    def _pick(self, model_id: str, stats: CallStats) -> str:
+        """`model_id`, else the fallback, whichever breaker lets a call through."""
+        if self._state(model_id)[0].allow():
+            return model_id
+        fallback = self.fallback_model
+        if fallback and fallback != model_id and self._state(fallback)[0].allow():
+            stats.fell_back = True
+            return fallback
+        raise CircuitOpenError(f"circuit open for {model_id}" + (f" and {fallback}" if fallback else ""))
+
+    def _once(self, attempt: Callable[[str], T], model_id: str, deadline, hedge: bool,
+              stats: CallStats) -> T:
+        """One (possibly hedged) attempt; records latency and breaker outcome."""
+        breaker, window = self._state(model_id)
+        t = time.monotonic()
+        delay = window.p95() if hedge and self._pool is not None else None
+        try:
+            if delay is None or deadline.remaining() < max(delay, HEDGE_MIN_DELAY_S) + MIN_ATTEMPT_S:
+                result = attempt(model_id)
+            else:
+                result = self._hedged(attempt, model_id, max(delay, HEDGE_MIN_DELAY_S), deadline, stats)
+        except Exception as err:
+            if retryable(err):
+                breaker.record(False)
+            else:   # says nothing about the model's health (bad request, no time left)
+                breaker.release()
+            raise
+        window.add(time.monotonic() - t)
+        breaker.record(True)
+        return result
+
+    def _hedged(self, attempt: Callable[[str], T], model_id: str, delay: float, deadline,
+                stats: CallStats) -> T:
+        first = self._pool.submit(attempt, model_id)
+        done, _ = wait([first], timeout=delay)
+        if done:
+            return first.result()
+        stats.hedged += 1
+        pending = {first, self._pool.submit(attempt, model_id)}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, timeout=deadline.remaining(), return_when=FIRST_COMPLETED)
+            if not done:
+                raise TimeoutError("hedged calls did not finish before the deadline")
+            for future in done:
+                if future.exception() is None:
+                    return future.result()      # the slower call finishes unobserved
+                error = future.exception()
+        raise error
+
+    def call(self, attempt: Callable[[str], T], stats: CallStats, deadline, hedge: bool = True) -> T:
+        """
+        attempt(model_id) for `stats.model_id` with retries, hedging (`hedge`
+        and BEDROCK_HEDGE) and the breaker, recording into `stats` (whose
+        model_id becomes the fallback's if it was used). Raises the last
+        error, or CircuitOpenError when no model may be called.
+        """
+        requested = stats.model_id
+        for n in range(self.max_attempts):
+            stats.model_id = self._pick(requested, stats)
+            stats.attempts += 1
+            try:
+                return self._once(attempt, stats.model_id, deadline, hedge, stats)
+            except Exception as err:
+                stats.errors.append(error_code(err) or type(err).__name__)
+                if not retryable(err) or n == self.max_attempts - 1:
+                    raise
+                backoff = random.uniform(0, min(BACKOFF_CAP_S, BACKOFF_BASE_S * 2 ** n))
+                if deadline.remaining() - backoff < MIN_ATTEMPT_S:
+                    raise
+                logger.info("retrying %s after %s in %.2fs", stats.model_id, stats.errors[-1], backoff)
+                self.sleep(backoff)
+        raise AssertionError("unreachable")
+
+    def states(self) -> Dict[str, str]:
+        """Breaker state per model seen so far."""
+        return {model_id: breaker.state for model_id, breaker in self.breakers.items()}
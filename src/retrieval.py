@@ -0,0 +1,144 @@
+"""
+Runtime retrieval for the Lambda: embed query -> search the local
+memory-mapped index -> assemble passages within a token budget.
+
+When the index directory also holds BM25 files, the dense and lexical
+searches run concurrently and their rankings are fused with reciprocal
+rank fusion (RRF).
+
+RAG_ANN selects the dense searcher: "flat" (exact, brute force), "hnsw"
+(graph ANN, requires hnsw_* files) or "auto" (hnsw when a graph exists).
+Without a graph, a flat scan uses the index's int8/PQ codes when present
+(RAG_QUANT=auto) and reranks the top RAG_RERANK candidates exactly.
+Each of these sidecars is tied to the index generation it was built from;
+one that no longer matches (built before an append or compaction) is
+skipped with a warning: no lexical ranker, or the exact flat scan.
+"""
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+import logging
+import os
+
+import bm25
+import embedder as emb
+import hnsw
+import quantize
+import vector_index
+from utils import est_tokens
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INDEX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rag_index")
+
+RAG_INDEX_DIR = os.getenv("RAG_INDEX_DIR", DEFAULT_INDEX_DIR)
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "4"))
+RAG_MIN_SCORE = float(os.getenv("RAG_MIN_SCORE", "0.2"))     # cosine, dense hits
+RAG_MIN_BM25 = float(os.getenv("RAG_MIN_BM25", "1.0"))      # raw BM25, lexical hits
+RAG_MAX_TOKENS = int(os.getenv("RAG_MAX_TOKENS", "600"))
+RAG_HYBRID = os.getenv("RAG_HYBRID", "1") == "1"
+RAG_CANDIDATES = int(os.getenv("RAG_CANDIDATES", "20"))   # per ranker, before fusion
+RAG_RRF_K = int(os.getenv("RAG_RRF_K", "60"))
+RAG_ANN = os.getenv("RAG_ANN", "auto")
+RAG_EF_SEARCH = int(os.getenv("RAG_EF_SEARCH", str(hnsw.DEFAULT_EF_SEARCH)))
+RAG_QUANT = os.getenv("RAG_QUANT", "auto")            # auto | none
+RAG_RERANK = int(os.getenv("RAG_RERANK", str(quantize.DEFAULT_RERANK)))
+
+# the lexical ranker runs here while the calling thread embeds the query
+_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="retrieval")
+
+
+@dataclass(frozen=True)
+class Hit:
+    row: int
+    score: float
+    record: Dict
+
+
+class Retriever:
+    def __init__(self, index: vector_index.VectorIndex, embedder: emb.Embedder,
+                 lexical: Optional[bm25.BM25Index] = None, ann: Optional[hnsw.HNSWIndex] = None,
+                 quant: Optional[quantize.QuantizedSearcher] = None):
+        self.index = index
+        self.embedder = embedder
+        self.lexical = lexical
+        self.ann = ann
+        self.quant = quant
+
+    def _dense(self, query: str, k: int, min_score: float, deadline=None) -> List[Tuple[int, float]]:
+        qvec = self.embedder.embed_one(query, deadline)
+        searcher = self.ann or self.quant or self.index
+        return [(row, score) for row, score in searcher.search(qvec, k) if score >= min_score]
+
+    def search(self, query: str, k: int = RAG_TOP_K, min_score: float = RAG_MIN_SCORE,
+               min_bm25: float = RAG_MIN_BM25, deadline=None) -> List[Hit]:
+        """
+        Dense top-k (cosine >= min_score), or RRF of dense and BM25 top
+        candidates when a lexical index is loaded. Each ranker is cut at its
+        own threshold (cosine >= min_score, BM25 >= min_bm25) before fusion,
+        so every fused hit passed at least one of them. Hit.score is the
+        cosine or the fused RRF score respectively. The query embedding call
+        ends before `deadline` (pipeline.Deadline) if one is given.
+        """
+        if self.lexical is None:
+            ranked = self._dense(query, k, min_score, deadline)
+        else:
+            n = max(k, RAG_CANDIDATES)
+            lex = _POOL.submit(self.lexical.search, query, n)
+            dense = self._dense(query, n, min_score, deadline)
+            lexical = [(row, score) for row, score in lex.result() if score >= min_bm25]
+            ranked = bm25.reciprocal_rank_fusion([dense, lexical], RAG_RRF_K)[:k]
+        return [Hit(row, score, self.index.record(row)) for row, score in ranked]
+
+
+def load_retriever(path: str = RAG_INDEX_DIR) -> Optional[Retriever]:
+    """Open the index at `path` with the embedder it was built with; None if absent."""
+    index = vector_index.load_index(path)
+    if index is None:
+        return None
+    spec = index.meta.get("embedder")
+    if not spec:
+        raise ValueError(f"index at {path} does not record its embedder")
+    lexical = None
+    if RAG_HYBRID:
+        try:
+            lexical = bm25.load(path, index)
+        except ValueError as err:   # rows renumbered or appended since: its row ids would be wrong
+            logger.warning("ignoring BM25 files in %s, dense search only: %s", path, err)
+    ann = None
+    if RAG_ANN in ("auto", "hnsw"):
+        try:
+            ann = hnsw.load(index, ef_search=RAG_EF_SEARCH)
+        except ValueError as err:
+            if RAG_ANN == "hnsw":
+                raise
+            logger.warning("ignoring HNSW graph in %s: %s", path, err)
+        if ann is None and RAG_ANN == "hnsw":
+            raise ValueError(f"RAG_ANN=hnsw but no HNSW graph in {path}")
+    quant = None
+    if RAG_QUANT == "auto":
+        try:
+            quant = quantize.load(index, RAG_RERANK)
+        except ValueError as err:   # stale codes, e.g. rows appended since quantising
+            logger.warning("ignoring quantised codes in %s, using the exact scan: %s", path, err)
+    return Retriever(index, emb.from_spec(spec), lexical, ann, quant)
+
+
+def format_passages(hits: List[Hit], max_tokens: int = RAG_MAX_TOKENS) -> str:
+    """
+    Render hits as numbered passages, dropping whole passages (lowest score
+    first) once the token budget is spent.
+    """
+    parts: List[str] = []
+    used = 0
+    for i, hit in enumerate(hits, 1):
+        rec = hit.record
+        source = " — ".join(s for s in (rec.get("title"), rec.get("url")) if s)
+        block = f"[{i}] {source}\n{rec.get('text', '').strip()}" if source else f"[{i}] {rec.get('text', '').strip()}"
+        cost = est_tokens(block)
+        if used + cost > max_tokens:
+            break
+        parts.append(block)
+        used += cost
+    return "\n\n".join(parts)
@@ -0,0 +1,95 @@
+"""
+Model routing: pick a rung of a configured ladder of Bedrock models for
+each question, cheapest first, from local features only (no network).
+
+    MODEL_LADDER="anthropic.claude-3-haiku-20240307-v1:0@600,anthropic.claude-3-5-sonnet-20240620-v1:0@2000"
+
+Each rung is `<model id>@<max_tokens>`, ordered from cheapest to most
+capable. Questions are classified into three levels and mapped onto the
+ladder (simple -> first rung, complex -> last, medium -> the middle, or the
+upper rung of two):
+
+    simple   short look-ups: a statistic fastpath.py recognised, or a short
+             question with a small context and no request for advice
+    medium   everything else
+    complex  advice / planning / explanations, several questions at once,
+             or a long question
+
+Without MODEL_LADDER every request uses MODEL_ID, as before.
+"""
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+import math
+import os
+import re
+
+from utils import est_tokens
+
+ROUTER_SHORT_TOKENS = int(os.getenv("ROUTER_SHORT_TOKENS", "24"))     # question this short may be simple
+ROUTER_LONG_TOKENS = int(os.getenv("ROUTER_LONG_TOKENS", "80"))       # question this long is complex
+ROUTER_CONTEXT_TOKENS = int(os.getenv("ROUTER_CONTEXT_TOKENS", "600"))  # more context: not simple
+
+LEVELS = ("simple", "medium", "complex")
+
+_ADVICE = re.compile(
+    r"\b(why|explain\w*|plan\w*|recommend\w*|suggest\w*|advi[cs]e|should|compare|strateg\w*|"
+    r"actions?|micro-actions?|improve|reduce|lower|diet|exercise|think|help me|risks?|"
+    r"concern\w*|worr\w*|goals?|interpret\w*|what does .+ mean)\b"
+)
+
+
+@dataclass(frozen=True)
+class Rung:
+    model_id: str
+    max_tokens: int
+
+
+@dataclass
+class Route:
+    model_id: str
+    max_tokens: int
+    level: str
+    reason: str
+
+    def log_fields(self) -> dict:
+        return {"model_id": self.model_id, "max_tokens": self.max_tokens,
+                "level": self.level, "reason": self.reason}
+
+
+def parse_ladder(spec: str) -> List[Rung]:
+    """"model@max_tokens,model@max_tokens,..." (cheapest first) -> rungs; "" -> []."""
+    rungs = []
+    for item in filter(None, (part.strip() for part in (spec or "").split(","))):
+        model_id, sep, max_tokens = item.rpartition("@")
+        if not sep or not model_id or not max_tokens.isdigit():
+            raise ValueError(f"MODEL_LADDER entries must look like <model id>@<max_tokens>, got {item!r}")
+        rungs.append(Rung(model_id, int(max_tokens)))
+    return rungs
+
+
+def classify(question: str, context_tokens: int, stat: Optional[str] = None) -> Tuple[str, str]:
+    """(level, reason) for a question; `stat` is the statistic fastpath matched, if any."""
+    q = question.lower()
+    q_tokens = est_tokens(question)
+    if _ADVICE.search(q):
+        return "complex", "advice"
+    if q.count("?") > 1:
+        return "complex", "several questions"
+    if q_tokens > ROUTER_LONG_TOKENS:
+        return "complex", "long question"
+    if q_tokens <= ROUTER_SHORT_TOKENS:
+        if stat is not None:
+            return "simple", f"lookup:{stat}"
+        if context_tokens <= ROUTER_CONTEXT_TOKENS:
+            return "simple", "short question"
+    return "medium", "default"
+
+
+def route(question: str, context: str, ladder: Sequence[Rung], stat: Optional[str] = None) -> Route:
+    """The rung of `ladder` (cheapest first, non-empty) for this question."""
+    if len(ladder) == 1:
+        return Route(ladder[0].model_id, ladder[0].max_tokens, "single", "one model")
+    level, reason = classify(question, est_tokens(context), stat)
+    rung = ladder[math.ceil(LEVELS.index(level) * (len(ladder) - 1) / 2)]
+    return Route(rung.model_id, rung.max_tokens, level, reason)
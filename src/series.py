@@ -0,0 +1,126 @@
+"""
+Columnar representation of one parsed vitals series.
+
+A Series holds three aligned NumPy arrays instead of one dict per point:
+
+    weeks      int64    week index, sorted ascending (stable for duplicates)
+    observed   float64  value_data, NaN where missing
+    predicted  float64  value_predicted, NaN where missing
+
+Points with neither value are dropped when the series is built. The JSON
+rendering reproduces the per-point schema the system prompt documents:
+{"week": int, "value_data": float|null, "value_predicted": float|null}.
+"""
+from __future__ import annotations
+from typing import Iterator, List, Optional, Sequence
+import math
+
+import numpy as np
+
+
+def _to_float_array(values: Sequence) -> np.ndarray:
+    """float64 array with NaN for None / unparsable / non-finite entries."""
+    try:
+        arr = np.asarray(values, dtype=np.float64)   # None -> NaN, numeric strings parse
+    except (TypeError, ValueError):
+        arr = np.fromiter((_safe(v) for v in values), dtype=np.float64, count=len(values))
+    if arr.ndim != 1:  # nested lists etc.: fall back to element-wise parsing
+        arr = np.fromiter((_safe(v) for v in values), dtype=np.float64, count=len(values))
+    arr[~np.isfinite(arr)] = np.nan
+    return arr
+
+
+def _safe(v) -> float:
+    try:
+        return float(v) if v is not None else math.nan
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def format_number(x: float, precision: Optional[int] = None) -> str:
+    """Shortest text for x: repr() by default, else rounded with trailing zeros dropped."""
+    if precision is None:
+        return repr(x)
+    text = f"{x:.{precision}f}"
+    if "." in text:
+        text = text.rstrip("0").rstrip(".")
+    return "0" if text == "-0" else text
+
+
+def _json_num(x: float, precision: Optional[int] = None) -> str:
+    return "null" if x != x else format_number(x, precision)
+
+
+class Series:
+    __slots__ = ("weeks", "observed", "predicted")
+
+    def __init__(self, weeks: np.ndarray, observed: np.ndarray, predicted: np.ndarray):
+        self.weeks = weeks
+        self.observed = observed
+        self.predicted = predicted
+
+    @classmethod
+    def build(cls, weeks: Sequence, observed: Sequence, predicted: Sequence) -> "Series":
+        """Vectorised construction from raw, possibly dirty, parallel columns."""
+        try:
+            w = np.asarray(weeks, dtype=np.float64)
+        except (TypeError, ValueError):
+            w = np.fromiter((_safe(v) for v in weeks), dtype=np.float64, count=len(weeks))
+        obs = _to_float_array(observed)
+        pred = _to_float_array(predicted)
+        keep = np.isfinite(w) & ~(np.isnan(obs) & np.isnan(pred))
+        w, obs, pred = w[keep].astype(np.int64), obs[keep], pred[keep]
+        if w.size > 1 and np.any(w[1:] < w[:-1]):
+            order = np.argsort(w, kind="stable")
+            w, obs, pred = w[order], obs[order], pred[order]
+        return cls(w, obs, pred)
+
+    @classmethod
+    def empty(cls) -> "Series":
+        return cls(np.zeros(0, np.int64), np.zeros(0), np.zeros(0))
+
+    @classmethod
+    def from_points(cls, points: List[dict]) -> "Series":
+        return cls.build([p.get("week") for p in points],
+                         [p.get("value_data") for p in points],
+                         [p.get("value_predicted") for p in points])
+
+    def __len__(self) -> int:
+        return int(self.weeks.shape[0])
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    def __repr__(self) -> str:
+        return f"Series(n={len(self)}, weeks={self.weeks[:1].tolist()}..{self.weeks[-1:].tolist()})"
+
+    @property
+    def has_observed(self) -> np.ndarray:
+        return ~np.isnan(self.observed)
+
+    @property
+    def has_predicted(self) -> np.ndarray:
+        return ~np.isnan(self.predicted)
+
+    def slice(self, start: int, stop: Optional[int] = None) -> "Series":
+        return Series(self.weeks[start:stop], self.observed[start:stop], self.predicted[start:stop])
+
+    def take(self, idx: np.ndarray) -> "Series":
+        return Series(self.weeks[idx], self.observed[idx], self.predicted[idx])
+
+    def to_points(self) -> List[dict]:
+        return [
+            {"week": w, "value_data": None if a != a else a, "value_predicted": None if p != p else p}
+            for w, a, p in zip(self.weeks.tolist(), self.observed.tolist(), self.predicted.tolist())
+        ]
+
+    def iter_json(self, start: int = 0, stop: Optional[int] = None,
+                  precision: Optional[int] = None) -> Iterator[str]:
+        """Compact JSON of each point, rendered lazily so callers can stop at a budget."""
+        for w, a, p in zip(self.weeks[start:stop].tolist(), self.observed[start:stop].tolist(),
+                           self.predicted[start:stop].tolist()):
+            yield (f'{{"week":{w},"value_data":{_json_num(a, precision)},'
+                   f'"value_predicted":{_json_num(p, precision)}}}')
+
+    def to_json(self) -> str:
+        return "[" + ",".join(self.iter_json()) + "]"
@@ -0,0 +1,138 @@
+"""
+Incremental decoding of bedrock-runtime invoke_model_with_response_stream
+(BedrockStream) and converse_stream (ConverseStream).
+
+The response body is an event stream of {"chunk": {"bytes": <json>}}
+events whose JSON shape depends on the model provider. BedrockStream
+yields the text deltas as they arrive and, once exhausted, exposes the
+same (model_version, token_usage) metadata that handler's buffered path
+extracts, plus time-to-first-token.
+"""
+from __future__ import annotations
+from typing import Dict, Iterator, Optional
+import json
+import time
+
+
+def _delta_text(body: Dict) -> str:
+    """Text carried by one stream event, across the common provider shapes."""
+    delta = body.get("delta")
+    if isinstance(delta, dict) and isinstance(delta.get("text"), str):   # Anthropic content_block_delta
+        return delta["text"]
+    choices = body.get("choices")
+    if isinstance(choices, list) and choices:                              # OpenAI-like
+        c0 = choices[0] or {}
+        text = (c0.get("delta") or {}).get("content") or c0.get("text")
+        return text if isinstance(text, str) else ""
+    outputs = body.get("outputs")
+    if isinstance(outputs, list) and outputs:                              # Mistral
+        text = (outputs[0] or {}).get("text")
+        return text if isinstance(text, str) else ""
+    for key in ("generation", "outputText", "completion"):                 # Meta / Titan / legacy Anthropic
+        if isinstance(body.get(key), str):
+            return body[key]
+    return ""
+
+
+class BedrockStream:
+    """Iterate over text deltas; usage/latency are filled in as events arrive."""
+
+    def __init__(self, response: Dict, t_start: Optional[float] = None):
+        self.response = response
+        self.t_start = time.time() if t_start is None else t_start
+        self.ttft_ms: Optional[int] = None
+        self.latency_ms: Optional[int] = None
+        self.model_version: Optional[str] = None
+        self.request_id: Optional[str] = (
+            response.get("ResponseMetadata", {}).get("RequestId")
+            or response.get("ResponseMetadata", {}).get("RequestID")
+        )
+        self._usage: Dict[str, Optional[int]] = {"input_tokens": None, "output_tokens": None,
+                                                 "cache_read_input_tokens": None, "cache_write_input_tokens": None}
+        self.parts = []
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    @property
+    def token_usage(self) -> Optional[Dict[str, Optional[int]]]:
+        it, ot = self._usage["input_tokens"], self._usage["output_tokens"]
+        cr, cw = self._usage["cache_read_input_tokens"], self._usage["cache_write_input_tokens"]
+        if it is None and ot is None:
+            return None
+        usage = {"input_tokens": it, "output_tokens": ot}
+        if cr or cw:   # prompt cache hits / writes, not included in input_tokens
+            usage.update(cache_read_input_tokens=cr or 0, cache_write_input_tokens=cw or 0)
+        usage["total_tokens"] = (it or 0) + (ot or 0) + (cr or 0) + (cw or 0)
+        return usage
+
+    def _absorb_metadata(self, body: Dict) -> None:
+        usage = (
+            body.get("usage")
+            or (body.get("message") or {}).get("usage")                    # Anthropic message_start
+            or {}
+        )
+        metrics = body.get("amazon-bedrock-invocationMetrics") or {}
+        pairs = (
+            ("input_tokens", (usage.get("input_tokens"), usage.get("prompt_tokens"),
+                              body.get("prompt_token_count"), body.get("inputTextTokenCount"),
+                              metrics.get("inputTokenCount"))),
+            ("output_tokens", (usage.get("output_tokens"), usage.get("completion_tokens"),
+                               body.get("generation_token_count"), body.get("totalOutputTextTokenCount"),
+                               metrics.get("outputTokenCount"))),
+            ("cache_read_input_tokens", (usage.get("cache_read_input_tokens"),
+                                         metrics.get("cacheReadInputTokenCount"))),
+            ("cache_write_input_tokens", (usage.get("cache_creation_input_tokens"),
+                                          metrics.get("cacheWriteInputTokenCount"))),
+        )
+        for name, candidates in pairs:
+            for value in candidates:
+                if isinstance(value, int):
+                    # streamed counts are cumulative; the invocation metrics are final
+                    self._usage[name] = max(value, self._usage[name] or 0)
+                    break
+        self.model_version = (
+            self.model_version
+            or body.get("model")
+            or (body.get("message") or {}).get("model")
+        )
+
+    def __iter__(self) -> Iterator[str]:
+        for event in self.response["body"]:
+            chunk = event.get("chunk")
+            if not chunk:
+                continue
+            try:
+                body = json.loads(chunk["bytes"])
+            except (ValueError, KeyError):
+                continue
+            self._absorb_metadata(body)
+            text = _delta_text(body)
+            if text:
+                if self.ttft_ms is None:
+                    self.ttft_ms = int((time.time() - self.t_start) * 1000)
+                self.parts.append(text)
+                yield text
+        self.latency_ms = int((time.time() - self.t_start) * 1000)
+
+
+class ConverseStream(BedrockStream):
+    """Same interface over a converse_stream response (typed events, no JSON chunks)."""
+
+    def __iter__(self) -> Iterator[str]:
+        for event in self.response["stream"]:
+            if "contentBlockDelta" in event:
+                text = (event["contentBlockDelta"].get("delta") or {}).get("text")
+                if text:
+                    if self.ttft_ms is None:
+                        self.ttft_ms = int((time.time() - self.t_start) * 1000)
+                    self.parts.append(text)
+                    yield text
+            elif "metadata" in event:
+                usage = event["metadata"].get("usage") or {}
+                self._usage["input_tokens"] = usage.get("inputTokens")
+                self._usage["output_tokens"] = usage.get("outputTokens")
+                self._usage["cache_read_input_tokens"] = usage.get("cacheReadInputTokens")
+                self._usage["cache_write_input_tokens"] = usage.get("cacheWriteInputTokens")
+        self.latency_ms = int((time.time() - self.t_start) * 1000)
@@ -0,0 +1,337 @@
+# tokenizer.py
+"""
+Token counting for prompt budgets.
+
+    Tokenizer            interface: encode(text) -> ids, count(text) -> int
+    CharRatioTokenizer   len(text) / chars-per-token (per model family)
+    BPETokenizer         byte-level BPE over a tiktoken-format rank file
+                         ("<base64 token> <rank>" per line); no network needed.
+                         Rank files can be trained offline from any corpus:
+                             python tokenizer.py train docs/*.md --vocab 8192 --out bpe.tiktoken
+    CachedTokenizer      LRU of counts keyed by the string's digest, so repeated
+                         history turns and system prompts are never re-tokenized
+    Calibrated           scales counts by a per-model factor learned from the
+                         input_tokens Bedrock reports (observe()), which covers
+                         both the char-ratio fallback and a BPE vocabulary that
+                         is not the model's own
+
+get(model_id) returns the process-wide tokenizer of a model (MODEL_ID by
+default): BPE when TOKENIZER_FILE is set, else the model family's
+chars-per-token estimate. Each model has its own calibration factor.
+"""
+from __future__ import annotations
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import argparse
+import base64
+import hashlib
+import math
+import os
+import re
+import threading
+
+from cache import TTLCache
+
+TOKENIZER_FILE = os.getenv("TOKENIZER_FILE", "")
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "4096"))
+
+# starting points per Bedrock model family; Calibrated.observe refines them
+_CHARS_PER_TOKEN: Tuple[Tuple[str, float], ...] = (
+    ("anthropic.", 3.5),
+    ("meta.", 3.8),
+    ("mistral.", 3.6),
+    ("amazon.titan", 4.2),
+    ("amazon.nova", 4.0),
+    ("cohere.", 4.0),
+)
+DEFAULT_CHARS_PER_TOKEN = 4.0
+
+# GPT-style pre-tokenization (letters, 1-3 digit groups, punctuation runs, spaces)
+# without \p{..} classes, which `re` does not support
+_PRETOKEN = re.compile(
+    r"""'(?i:[sdmt]|ll|ve|re)|[^\r\n\w]?[^\W\d_]+|\d{1,3}| ?(?:[^\s\w]|_)+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+"""
+)
+
+
+def chars_per_token_for(model_id: Optional[str]) -> float:
+    model = (model_id or "").split("/")[-1]      # inference-profile ARNs / "us." prefixes
+    model = re.sub(r"^(?:us|eu|apac|global)\.", "", model)
+    for prefix, ratio in _CHARS_PER_TOKEN:
+        if model.startswith(prefix):
+            return ratio
+    return DEFAULT_CHARS_PER_TOKEN
+
+
+class Tokenizer:
+    name = "base"
+    chars_per_token = DEFAULT_CHARS_PER_TOKEN   # rough ratio, used to size char budgets
+
+    def encode(self, text: str) -> List[int]:
+        raise NotImplementedError
+
+    def count(self, text: str) -> int:
+        return len(self.encode(text))
+
+    def observe(self, texts: Sequence[str], actual_tokens: Optional[int]) -> None:
+        """Feedback from a model call; only Calibrated uses it."""
+
+    def stats(self) -> Dict:
+        return {"name": self.name}
+
+
+class CharRatioTokenizer(Tokenizer):
+    def __init__(self, chars_per_token: float = DEFAULT_CHARS_PER_TOKEN):
+        self.chars_per_token = float(chars_per_token)
+        self.name = f"chars/{self.chars_per_token:g}"
+
+    def encode(self, text: str) -> List[int]:
+        raise NotImplementedError("CharRatioTokenizer only estimates counts")
+
+    def count(self, text: str) -> int:
+        return int(len(text) / self.chars_per_token) + 1
+
+
+class BPETokenizer(Tokenizer):
+    def __init__(self, ranks: Dict[bytes, int], name: str = "bpe"):
+        self.ranks = ranks
+        self.name = name
+        self._pieces: Dict[str, Tuple[int, ...]] = {}   # pre-token -> ids; bounded below
+        self._max_pieces = 1 << 16
+        sample = "Your average fasting glucose over weeks 3-10 is 112.5 mg/dL.\nweek,glucose,glucose_pred\n"
+        self.chars_per_token = len(sample) / max(len(self.encode(sample)), 1)
+
+    # ---------- encoding ----------
+    def _merge(self, piece: bytes) -> Tuple[int, ...]:
+        ranks = self.ranks
+        whole = ranks.get(piece)
+        if whole is not None:
+            return (whole,)
+        parts = [piece[i:i + 1] for i in range(len(piece))]
+        while len(parts) > 1:
+            best, best_rank = -1, None
+            for i in range(len(parts) - 1):
+                r = ranks.get(parts[i] + parts[i + 1])
+                if r is not None and (best_rank is None or r < best_rank):
+                    best, best_rank = i, r
+            if best < 0:
+                break
+            parts[best:best + 2] = [parts[best] + parts[best + 1]]
+        return tuple(ranks[p] for p in parts)
+
+    def _piece(self, piece: str) -> Tuple[int, ...]:
+        ids = self._pieces.get(piece)
+        if ids is None:
+            ids = self._merge(piece.encode("utf-8"))
+            if len(self._pieces) >= self._max_pieces:
+                self._pieces.clear()
+            self._pieces[piece] = ids
+        return ids
+
+    def encode(self, text: str) -> List[int]:
+        out: List[int] = []
+        for piece in _PRETOKEN.findall(text):
+            out.extend(self._piece(piece))
+        return out
+
+    def count(self, text: str) -> int:
+        return sum(len(self._piece(p)) for p in _PRETOKEN.findall(text))
+
+    def decode(self, ids: Iterable[int]) -> str:
+        inv = {r: b for b, r in self.ranks.items()}
+        return b"".join(inv[i] for i in ids).decode("utf-8", errors="replace")
+
+    # ---------- rank files ----------
+    @classmethod
+    def load(cls, path: str) -> "BPETokenizer":
+        ranks: Dict[bytes, int] = {}
+        with open(path, "rb") as fh:
+            for line in fh:
+                if line.strip():
+                    token, rank = line.split()
+                    ranks[base64.b64decode(token)] = int(rank)
+        missing = [b for b in range(256) if bytes([b]) not in ranks]
+        if missing:  # every byte must be encodable
+            raise ValueError(f"{path}: rank file lacks {len(missing)} single-byte tokens")
+        return cls(ranks, name=f"bpe:{os.path.basename(path)}")
+
+    def save(self, path: str) -> None:
+        with open(path, "wb") as fh:
+            for token, rank in sorted(self.ranks.items(), key=lambda kv: kv[1]):
+                fh.write(base64.b64encode(token) + b" " + str(rank).encode() + b"\n")
+
+    @classmethod
+    def train(cls, texts: Iterable[str], vocab_size: int = 8192, min_freq: int = 2) -> "BPETokenizer":
+        """
+        Byte-level BPE: start from the 256 bytes and repeatedly merge the most
+        frequent adjacent pair. Pair counts are updated only for the words that
+        contain the merged pair.
+        """
+        words: Counter = Counter()
+        for text in texts:
+            words.update(_PRETOKEN.findall(text))
+        seqs = [[bytes([b]) for b in w.encode("utf-8")] for w in words]
+        freq = list(words.values())
+        pairs: Counter = Counter()
+        where: Dict[Tuple[bytes, bytes], set] = {}
+        for i, seq in enumerate(seqs):
+            for pair in zip(seq, seq[1:]):
+                pairs[pair] += freq[i]
+                where.setdefault(pair, set()).add(i)
+
+        ranks = {bytes([b]): b for b in range(256)}
+        while len(ranks) < vocab_size and pairs:
+            (a, b), n = pairs.most_common(1)[0]
+            if n < min_freq:
+                break
+            new = a + b
+            ranks.setdefault(new, len(ranks))
+            for i in where.pop((a, b), ()):
+                seq = seqs[i]
+                for pair in zip(seq, seq[1:]):
+                    pairs[pair] -= freq[i]
+                out, j = [], 0
+                while j < len(seq):
+                    if j + 1 < len(seq) and seq[j] == a and seq[j + 1] == b:
+                        out.append(new)
+                        j += 2
+                    else:
+                        out.append(seq[j])
+                        j += 1
+                seqs[i] = out
+                for pair in zip(out, out[1:]):
+                    pairs[pair] += freq[i]
+                    where.setdefault(pair, set()).add(i)
+            pairs = +pairs if len(pairs) > 4 * len(where) + 1024 else pairs   # drop zero counts now and then
+            pairs.pop((a, b), None)
+        return cls(ranks)
+
+
+class CachedTokenizer(Tokenizer):
+    """
+    Wraps another tokenizer with an LRU of counts keyed on a 128-bit digest
+    of the text, so history turns re-sent on every request cost one lookup.
+    """
+
+    def __init__(self, inner: Tokenizer, cache: TTLCache):
+        self.inner = inner
+        self.cache = cache
+        self.name = inner.name
+        self.chars_per_token = inner.chars_per_token
+
+    def encode(self, text: str) -> List[int]:
+        return self.inner.encode(text)
+
+    def count(self, text: str) -> int:
+        key = hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+        n = self.cache.get(key)
+        if n is None:
+            n = self.inner.count(text)
+            self.cache.put(key, n)
+        return n
+
+    def stats(self) -> Dict:
+        return dict(self.inner.stats(), cache=self.cache.stats())
+
+
+class Calibrated(Tokenizer):
+    """
+    Per-model correction on top of another tokenizer. `factor` is an
+    exponential moving average of (reported input tokens / our count) over
+    recent model calls, clamped to [0.5, 2].
+    """
+
+    def __init__(self, inner: Tokenizer, factor: float = 1.0, alpha: float = 0.2):
+        self.inner = inner
+        self.factor = float(factor)
+        self.alpha = float(alpha)
+        self.samples = 0
+        self.name = inner.name
+        self._lock = threading.Lock()
+
+    @property
+    def chars_per_token(self) -> float:  # type: ignore[override]
+        return self.inner.chars_per_token / self.factor
+
+    def encode(self, text: str) -> List[int]:
+        return self.inner.encode(text)
+
+    def count(self, text: str) -> int:
+        n = self.inner.count(text)
+        return n if self.factor == 1.0 else int(math.ceil(n * self.factor))
+
+    def observe(self, texts: Sequence[str], actual_tokens: Optional[int]) -> None:
+        if not actual_tokens:
+            return
+        ours = sum(self.inner.count(t) for t in texts)
+        if ours <= 0:
+            return
+        ratio = min(max(actual_tokens / ours, 0.5), 2.0)
+        with self._lock:
+            self.factor = ratio if self.samples == 0 else (1 - self.alpha) * self.factor + self.alpha * ratio
+            self.samples += 1
+
+    def stats(self) -> Dict:
+        return dict(self.inner.stats(), factor=round(self.factor, 3), samples=self.samples)
+
+
+def for_model(model_id: Optional[str], path: str = "", cache_size: int = TOKEN_CACHE_SIZE) -> Tokenizer:
+    base: Tokenizer = BPETokenizer.load(path) if path else CharRatioTokenizer(chars_per_token_for(model_id))
+    return Calibrated(CachedTokenizer(base, TTLCache(cache_size, ttl=math.inf)))
+
+
+_BY_MODEL: Dict[str, Tokenizer] = {}
+_BY_MODEL_LOCK = threading.Lock()
+
+
+def get(model_id: Optional[str] = None) -> Tokenizer:
+    """
+    The process-wide tokenizer of `model_id` (default MODEL_ID), built on
+    first use and kept across warm invocations. Models are calibrated
+    separately, so usage reported by one rung of a model ladder never skews
+    another's counts.
+    """
+    key = model_id or os.getenv("MODEL_ID") or ""
+    tok = _BY_MODEL.get(key)
+    if tok is None:
+        with _BY_MODEL_LOCK:
+            tok = _BY_MODEL.get(key)
+            if tok is None:
+                tok = _BY_MODEL[key] = for_model(key, TOKENIZER_FILE)
+    return tok
+
+
+def set_default(tok: Optional[Tokenizer]) -> None:
+    """Replace the default model's tokenizer; None forgets every model's."""
+    with _BY_MODEL_LOCK:
+        if tok is None:
+            _BY_MODEL.clear()
+        else:
+            _BY_MODEL[os.getenv("MODEL_ID") or ""] = tok
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Train or try an offline BPE rank file.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    tr = sub.add_parser("train", help="train a rank file from text files")
+    tr.add_argument("files", nargs="+")
+    tr.add_argument("--vocab", type=int, default=8192)
+    tr.add_argument("--out", required=True)
+    ct = sub.add_parser("count", help="count tokens of a file")
+    ct.add_argument("file")
+    ct.add_argument("--ranks", default=TOKENIZER_FILE)
+    ct.add_argument("--model", default=os.getenv("MODEL_ID", ""))
+    args = ap.parse_args()
+
+    if args.cmd == "train":
+        texts = [open(f, encoding="utf-8", errors="replace").read() for f in args.files]
+        tok = BPETokenizer.train(texts, args.vocab)
+        tok.save(args.out)
+        print(f"wrote {len(tok.ranks)} ranks to {args.out}")
+    else:
+        text = open(args.file, encoding="utf-8", errors="replace").read()
+        tok = for_model(args.model, args.ranks)
+        print(f"{tok.count(text)} tokens ({len(text)} chars, {tok.name})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,22 @@
 from __future__ import annotations
-from typing import Dict, List, Sequence, Tuple, Optional, TypedDict, Mapping
+from collections import abc
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple, Optional, TypedDict, Mapping
 import math
 import json
 import statistics as stats  # if you use the rest of your helpers
 
+import numpy as np
+
+from series import Series, format_number
+import downsample
+import tokenizer
+
 class HistoryMsg(TypedDict):
     role: str
     content: str
 
 # --- allowed series and aliases (CSV-style labels included) ---
-_ALLOWED_SERIES = {"health_age","glucose", "bp_sys", "bp_dia", "bmi", "rhr"}
+_ALLOWED_SERIES = {"health_age","glucose", "weight", "bp_sys", "bp_dia", "bmi", "rhr"}   # == vitals.SERIES
 
 _ALIASES = {
     "Health age data": "health_age",
@@ -31,76 +38,71 @@ _ALIASES = {
     "rhr":  "rhr",
 }
 
-def _safe_float(x) -> Optional[float]:
-    try:
-        v = float(x)
-        if math.isnan(v) or math.isinf(v):
-            return None
-        return v
-    except Exception:
-        return None
-
-def _point(actual: Optional[float], pred: Optional[float], week_index: int) -> Optional[dict]:
-    a = _safe_float(actual) if actual is not None else None
-    p = _safe_float(pred)    if pred    is not None else None
-    if a is None and p is None:
-        return None
-    return {"week": int(week_index), "value_data": a, "value_predicted": p}
-
-def _extract_from_weekly(payload: Dict) -> Dict[str, List[dict]]:
-    """
-    Build per-series lists of {week, value_data, value_predicted}
-    from the weekly_timepoints + forecast structure.
-    """
-    out: Dict[str, List[dict]] = {k: [] for k in _ALLOWED_SERIES}
-
-    weekly = payload.get("weekly_timepoints", [])
-    if isinstance(weekly, list):
-        for wk in weekly:
-            if not isinstance(wk, Mapping): 
-                continue
-            w = wk.get("week_index")
-            m = wk.get("metrics", {})
-            if w is None or not isinstance(m, Mapping): 
-                continue
+class _Columns:
+    """Parallel week / actual / predicted columns gathered in a single pass."""
+    __slots__ = ("weeks", "actual", "pred")
 
-            for raw_key, val in m.items():
-                canon = _ALIASES.get(raw_key, raw_key)
-                if canon not in _ALLOWED_SERIES or not isinstance(val, Mapping):
-                    continue
-                pt = _point(val.get("actual"), val.get("pred"), w)
-                if pt:
-                    out[canon].append(pt)
-
-    # Append forecast weeks (pred only)
-    fcast = payload.get("forecast", [])
-    if isinstance(fcast, list):
-        for wk in fcast:
-            if not isinstance(wk, Mapping): 
-                continue
-            w = wk.get("week_index")
-            m = wk.get("metrics", {})
-            if w is None or not isinstance(m, Mapping): 
+    def __init__(self):
+        self.weeks: list = []
+        self.actual: list = []
+        self.pred: list = []
+
+    def add(self, week, actual, pred) -> None:
+        self.weeks.append(week)
+        self.actual.append(actual)
+        self.pred.append(pred)
+
+    def build(self) -> Series:
+        return Series.build(self.weeks, self.actual, self.pred)
+
+
+# typing.Mapping isinstance checks are slow; test the concrete dict type first
+_MAPPING = (dict, abc.Mapping)
+
+def _collect_weekly(cols: Dict[str, _Columns], entries, with_actual: bool) -> None:
+    if not isinstance(entries, list):
+        return
+    aliases, allowed = _ALIASES, _ALLOWED_SERIES
+    for wk in entries:
+        if not isinstance(wk, _MAPPING):
+            continue
+        w = wk.get("week_index")
+        m = wk.get("metrics", {})
+        if w is None or not isinstance(m, _MAPPING):
+            continue
+        for raw_key, val in m.items():
+            canon = aliases.get(raw_key, raw_key)
+            if canon not in allowed or not isinstance(val, _MAPPING):
                 continue
-            for raw_key, val in m.items():
-                canon = _ALIASES.get(raw_key, raw_key)
-                if canon not in _ALLOWED_SERIES or not isinstance(val, Mapping):
-                    continue
-                pt = _point(None, val.get("pred"), w)
-                if pt:
-                    out[canon].append(pt)
+            col = cols.get(canon)
+            if col is None:
+                col = cols[canon] = _Columns()
+            col.weeks.append(w)
+            col.actual.append(val.get("actual") if with_actual else None)
+            col.pred.append(val.get("pred"))
 
+
+def _extract_from_weekly(payload: Dict) -> Dict[str, Series]:
+    """
+    Build one columnar Series per metric from the weekly_timepoints +
+    forecast structure (forecast weeks contribute predictions only).
+    """
+    cols: Dict[str, _Columns] = {}
+    _collect_weekly(cols, payload.get("weekly_timepoints", []), with_actual=True)
+    _collect_weekly(cols, payload.get("forecast", []), with_actual=False)
+
+    out = {k: c.build() for k, c in cols.items()}
     # drop empty series
     return {k: v for k, v in out.items() if v}
 
-def _extract_legacy_timeseries(payload: Dict) -> Dict[str, List[dict]]:
+def _extract_legacy_timeseries(payload: Dict) -> Dict[str, Series]:
     """
     Backwards-compat path if someone still posts {"timeseries": {...}}. 
     It tries to coerce lists of numbers or [{value:..}] to {week,..} shape.
     Weeks are assigned sequentially if none provided.
     """
     raw_ts = payload.get("timeseries", {})
-    out: Dict[str, List[dict]] = {}
+    out: Dict[str, Series] = {}
     if not isinstance(raw_ts, Mapping):
         return out
 
@@ -110,27 +112,28 @@ def _extract_legacy_timeseries(payload: Dict) -> Dict[str, List[dict]]:
         canon = _ALIASES.get(key, key)
         if canon not in _ALLOWED_SERIES:
             continue
+        series = _series_from_seq(seq)
+        if series:
+            out[canon] = series
+    return out
 
-        pts: List[dict] = []
-        for i, item in enumerate(seq):
-            # allow numeric, {"value": x}, or {"week": i, "value_data": x, "value_predicted": y}
-            if isinstance(item, Mapping):
-                if "week" in item or "value_data" in item or "value_predicted" in item:
-                    wk = int(item.get("week", i))
-                    a  = item.get("value_data")
-                    p  = item.get("value_predicted")
-                    rec = _point(a, p, wk)
-                else:
-                    rec = _point(item.get("value"), None, i)
+def _series_from_seq(seq) -> Series:
+    """Series from a legacy list (numbers, {"value": x} or point dicts); weeks default to the index."""
+    col = _Columns()
+    if not isinstance(seq, (list, tuple)):
+        return col.build()
+    for i, item in enumerate(seq):
+        # allow numeric, {"value": x}, or {"week": i, "value_data": x, "value_predicted": y}
+        if isinstance(item, Mapping):
+            if "week" in item or "value_data" in item or "value_predicted" in item:
+                col.add(item.get("week", i), item.get("value_data"), item.get("value_predicted"))
             else:
-                rec = _point(item, None, i)
-            if rec:
-                pts.append(rec)
-        if pts:
-            out[canon] = pts
-    return out
+                col.add(i, item.get("value"), None)
+        else:
+            col.add(i, item, None)
+    return col.build()
 
-def validate_payload(payload: Dict) -> Tuple[str, Dict[str, List[dict]], List[HistoryMsg]]:
+def validate_payload(payload: Dict) -> Tuple[str, Dict[str, Series], List[HistoryMsg]]:
     if not isinstance(payload, dict):
         raise ValueError("Payload must be a JSON object.")
 
@@ -161,33 +164,290 @@ def validate_payload(payload: Dict) -> Tuple[str, Dict[str, List[dict]], List[Hi
 
 # ----------------- context builder -----------------
 
-AVG_CHARS_PER_TOKEN = 4.0
+AVG_CHARS_PER_TOKEN = tokenizer.DEFAULT_CHARS_PER_TOKEN   # kept for callers sizing char budgets
 def est_tokens(text: str) -> int:
-    return int(len(text) / AVG_CHARS_PER_TOKEN) + 1
+    """Token count of `text` with the configured tokenizer (see tokenizer.get)."""
+    return tokenizer.get().count(text)
+
+def fit_to_tokens(render: Callable[[int], str], max_tokens: int) -> str:
+    """
+    Largest output of `render(max_chars)` that fits `max_tokens`. Starts from
+    the tokenizer's chars-per-token ratio and rescales by the measured count;
+    a couple of renders at most for well-calibrated tokenizers.
+    """
+    tok = tokenizer.get()
+    chars = max(int(max_tokens * tok.chars_per_token) - 1, 0)
+    lo, hi = -1, None          # largest char budget known to fit / smallest known not to
+    best = None
+    for _ in range(6):
+        text = render(chars)
+        n = tok.count(text)
+        if n <= max_tokens:
+            best, lo = text, chars
+            # output shorter than allowed (data ran out) or budget nearly full: done
+            if len(text) < 0.9 * chars or n >= 0.95 * max_tokens:
+                break
+        else:
+            hi = chars
+        guess = int(chars * max_tokens / max(n, 1))
+        if hi is not None:
+            guess = min(guess, hi - 1)
+        if guess <= lo:
+            break
+        chars = guess
+    return best if best is not None else render(0)
 
 def trim_text_to_tokens(text: str, max_tokens: int) -> str:
-    max_chars = int(max_tokens * AVG_CHARS_PER_TOKEN)
-    if len(text) <= max_chars:
+    if est_tokens(text) <= max_tokens:
         return text
-    cut = text[:max_chars]
-    last_nl = cut.rfind("\n")
-    if last_nl > max_chars * 0.7:
-        cut = cut[:last_nl]
-    return cut + "\n[...truncated for token budget...]"
+
+    def cut_to(max_chars: int) -> str:
+        cut = text[:max_chars]
+        last_nl = cut.rfind("\n")
+        if last_nl > max_chars * 0.7:
+            cut = cut[:last_nl]
+        return cut + "\n[...truncated for token budget...]"
+
+    return fit_to_tokens(cut_to, max_tokens)
+
+def _newest_points(series: Series, max_chars: int, precision: Optional[int] = None,
+                   block: int = 64) -> List[str]:
+    """
+    Rendered points newest-first, stopping once they alone exceed `max_chars`
+    (nothing older could be kept anyway), so the cost is bounded by the budget.
+    """
+    out: List[str] = []
+    size = 0
+    end = len(series)
+    while end > 0 and size <= max_chars:
+        start = max(0, end - block)
+        for piece in reversed(list(series.iter_json(start, end, precision))):
+            out.append(piece)
+            size += len(piece) + 1
+            if size > max_chars:
+                break
+        end = start
+    return out
+
+def _keep_counts(costs: List[np.ndarray], free: int) -> List[int]:
+    """
+    Points to keep per series (newest first) so the total fits `free` chars.
+    costs[s][k] = chars of series s's newest k points. A binary search finds
+    the largest common cap k with sum(costs[s][min(k, n_s)]) <= free; the
+    remainder is then handed out one point per series while it fits.
+    """
+    sizes = [c.shape[0] - 1 for c in costs]
+
+    def total(k: int) -> int:
+        return sum(int(c[min(k, n)]) for c, n in zip(costs, sizes))
+
+    lo, hi = 0, max(sizes, default=0)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if total(mid) <= free:
+            lo = mid
+        else:
+            hi = mid - 1
+    keep = [min(lo, n) for n in sizes]
+    spare = free - total(lo)
+    for s, (c, n) in enumerate(zip(costs, sizes)):
+        if keep[s] < n:
+            extra = int(c[keep[s] + 1] - c[keep[s]])
+            if extra <= spare:
+                keep[s] += 1
+                spare -= extra
+    return keep
+
+def _plain_context(ts_dict: Mapping[str, Sequence], max_context_tokens: int) -> str:
+    """
+    Compact JSON of plain value lists (callers that bypass validate_payload),
+    as given. Over budget, the oldest values of every list are dropped until
+    it fits, so the JSON is never cut mid-value.
+    """
+    lists = {name: list(seq) for name, seq in ts_dict.items()}
+    render = lambda keep: json.dumps({n: v[max(0, len(v) - keep):] for n, v in lists.items()},
+                                     separators=(",", ":"))
+    lo, hi = 0, max((len(v) for v in lists.values()), default=0)
+    while lo < hi:   # largest `keep` (values per list) that fits
+        mid = (lo + hi + 1) // 2
+        if est_tokens(render(mid)) <= max_context_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    return render(lo)
+
+def _points_context(ts_dict: Mapping[str, Series], max_chars: int, precision: Optional[int],
+                    method: str = "none") -> str:
+    heads = [json.dumps(name) + ":[" for name in ts_dict]
+    fixed = 2 + sum(len(h) + 1 for h in heads) + max(len(heads) - 1, 0)   # {} + heads + ] + commas
+    newest = [_newest_points(series, max_chars, precision) for series in ts_dict.values()]
+    costs = []
+    for pieces in newest:
+        # chars of the newest k points incl. separating commas: sum(len) + k - 1
+        c = np.zeros(len(pieces) + 1, dtype=np.int64)
+        np.cumsum([len(p) + 1 for p in pieces], out=c[1:])
+        c[1:] -= 1
+        costs.append(c)
+    keep = _keep_counts(costs, max_chars - fixed)
+    chosen = [list(reversed(pieces[:k])) for pieces, k in zip(newest, keep)]
+    if method != "none":
+        chosen = _downsampled_points(list(ts_dict.values()), keep, chosen, max_chars - fixed,
+                                     precision, method)
+    body = ",".join(head + ",".join(pieces) + "]" for head, pieces in zip(heads, chosen))
+    return "{" + body + "}"
+
+def _downsampled_points(series: List[Series], keep: List[int], chosen: List[List[str]], free: int,
+                        precision: Optional[int], method: str) -> List[List[str]]:
+    """
+    Replace the newest-k points of every truncated series by a shape-preserving
+    selection of the same size (see downsample.select). Rendered sizes differ
+    slightly from the newest-k ones, so the largest selection shrinks until
+    everything fits again.
+    """
+    keep = list(keep)
+    thinned = [s for s, (series_s, k) in enumerate(zip(series, keep)) if 0 < k < len(series_s)]
+    if not thinned:
+        return chosen
+    chosen = list(chosen)
+    cost = lambda pieces: sum(len(p) for p in pieces) + max(len(pieces) - 1, 0)
+    while True:
+        for s in thinned:
+            idx = downsample.select(series[s], keep[s], method)
+            chosen[s] = list(series[s].take(idx).iter_json(precision=precision))
+        size = sum(cost(p) for p in chosen)
+        if size <= free:
+            return chosen
+        s = max(thinned, key=lambda t: keep[t])
+        keep[s] -= max(1, -(-(size - free) * keep[s] // max(cost(chosen[s]), 1)))
+        keep[s] = max(keep[s], 0)
+        if keep[s] == 0:
+            thinned.remove(s)
+            chosen[s] = []
+
+def _week_table(ts_dict: Mapping[str, Series]) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """
+    Align all series on one week axis: (column names, weeks, values) where
+    values[:, j] is column j (`<metric>` observed, `<metric>_pred` forecast),
+    NaN where missing. Columns with no values at all are left out.
+    """
+    present = [(name, s) for name, s in ts_dict.items() if s]
+    if not present:
+        return [], np.zeros(0, np.int64), np.zeros((0, 0))
+    weeks = np.unique(np.concatenate([s.weeks for _, s in present]))
+    cols: List[str] = []
+    blocks: List[np.ndarray] = []
+    for name, s in present:
+        pos = np.searchsorted(weeks, s.weeks)
+        for suffix, values in (("", s.observed), ("_pred", s.predicted)):
+            have = ~np.isnan(values)
+            if not have.any():
+                continue
+            col = np.full(weeks.shape[0], np.nan)
+            col[pos[have]] = values[have]   # duplicate weeks: the later value wins
+            cols.append(name + suffix)
+            blocks.append(col)
+    return cols, weeks, np.column_stack(blocks)
+
+def _tabular_context(ts_dict: Mapping[str, Series], max_chars: int, precision: Optional[int],
+                     encoding: str, method: str = "none") -> str:
+    """
+    "table":   CSV, header row + one row per week, empty cell = no value.
+    "columns": JSON object of parallel arrays sharing a "week" array.
+    Whole weeks are dropped oldest-first until the rows fit `max_chars`, or,
+    with a downsampling `method`, thinned out by downsample.select_rows.
+    """
+    cols, weeks, values = _week_table(ts_dict)
+    header = ["week"] + cols
+    null = "" if encoding == "table" else "null"
+    if encoding == "table":
+        used = len(",".join(header))
+    else:
+        # {"week":[...],...}: the braces, `"name":[` and `]` per array, "," between
+        # arrays; cost() charges each cell a ",", which an array's first cell lacks
+        brackets = 2 + 3 * len(header)
+        separators = len(header) - 1
+        used = brackets + separators + sum(len(json.dumps(h)) for h in header) - len(header)
+
+    def render(i: int) -> List[str]:
+        return [str(int(weeks[i]))] + [
+            null if v != v else format_number(v, precision) for v in values[i].tolist()
+        ]
+
+    def cost(cells: List[str]) -> int:
+        # table: "\n" + cells joined by ","; columns: one "," per cell
+        return sum(len(c) for c in cells) + len(cells)
+
+    rows: List[List[str]] = []
+    for i in range(weeks.shape[0] - 1, -1, -1):
+        cells = render(i)
+        if used + cost(cells) > max_chars:
+            break
+        rows.append(cells)
+        used += cost(cells)
+    rows.reverse()
+    if method != "none" and 0 < len(rows) < weeks.shape[0]:
+        observed = [j for j, c in enumerate(cols) if not c.endswith("_pred")]
+        free = max_chars - used + sum(cost(r) for r in rows)
+        n_keep = len(rows)
+        while n_keep > 0:
+            picked = [render(i) for i in downsample.select_rows(weeks, values, observed, n_keep, method)]
+            size = sum(cost(r) for r in picked)
+            if size <= free:
+                rows = picked
+                break
+            # picked rows are fuller than the newest ones: drop the overshoot's worth
+            n_keep -= max(1, -(-(size - free) * len(picked) // size))
+
+    if encoding == "table":
+        return "\n".join([",".join(header)] + [",".join(r) for r in rows])
+    return "{" + ",".join(
+        f'{json.dumps(h)}:[{",".join(r[j] for r in rows)}]' for j, h in enumerate(header)
+    ) + "}"
+
+CONTEXT_ENCODINGS = ("points", "columns", "table")
 
 def build_context_from_payload(
     _prompt: str,
-    ts_dict: Dict[str, List[dict]],
+    ts_dict: Mapping[str, Series],
     max_context_tokens: int = 900,
+    encoding: str = "points",
+    precision: Optional[int] = None,
+    downsample_method: str = "none",
 ) -> str:
     """
-    Provide compact JSON of per-series points:
-    { "<series>": [ {"week": int, "value_data": float|null, "value_predicted": float|null}, ... ] }
+    Render the vitals for the prompt in one of CONTEXT_ENCODINGS:
+
+    points   compact JSON of per-series points:
+             { "<series>": [ {"week": int, "value_data": float|null, "value_predicted": float|null}, ... ] }
+    columns  {"week": [...], "<series>": [...], "<series>_pred": [...], ...} on a shared week axis
+    table    CSV with a `week,<series>,<series>_pred,...` header, one row per week
+
+    `precision` rounds values (None keeps full repr). When everything does
+    not fit in `max_context_tokens`, whole points (or weeks) are dropped
+    oldest-first before serialisation, sharing the budget fairly between
+    series, so the result is always well-formed and fills the budget
+    (tokens counted with tokenizer.get(), see fit_to_tokens).
+
+    `downsample_method` ("lttb" | "minmax", see downsample.py) instead thins
+    out the older history of a series that does not fit, keeping its shape,
+    the latest observation and every forecast point within the same budget.
+
+    Missing (None) series are dropped. Plain lists are still accepted: on
+    their own they are rendered as given (_plain_context); next to Series
+    they are parsed like the legacy "timeseries" payload.
     """
-    ctx = json.dumps(ts_dict, separators=(",", ":"))
-    if est_tokens(ctx) > max_context_tokens:
-        ctx = trim_text_to_tokens(ctx, max_context_tokens)
-    return ctx
+    if encoding not in CONTEXT_ENCODINGS:
+        raise ValueError(f"Unknown context encoding {encoding!r}; expected one of {', '.join(CONTEXT_ENCODINGS)}.")
+    ts_dict = {name: s for name, s in ts_dict.items() if s is not None}
+    if ts_dict and not any(isinstance(s, Series) for s in ts_dict.values()):
+        return _plain_context({n: s for n, s in ts_dict.items() if isinstance(s, (list, tuple))},
+                              max_context_tokens)
+    ts_dict = {name: s if isinstance(s, Series) else _series_from_seq(s) for name, s in ts_dict.items()}
+    if encoding == "points":
+        render = lambda max_chars: _points_context(ts_dict, max_chars, precision, downsample_method)
+    else:
+        render = lambda max_chars: _tabular_context(ts_dict, max_chars, precision, encoding, downsample_method)
+    return fit_to_tokens(render, max_context_tokens)
 
 def prepare_history_for_llm(history: List[HistoryMsg], max_tokens: int = 1200) -> List[HistoryMsg]:
     out: List[HistoryMsg] = []
@@ -0,0 +1,365 @@
+"""
+On-disk vector index that is memory-mapped into the Lambda process.
+
+Layout of an index directory:
+
+    meta.json              {"version", "count", "dim", "dtype", "embedder", "gen", "files", ...}
+    embeddings.<gen>.npy   (count, dim) float16|float32, rows L2-normalised
+    offsets.<gen>.npy      (count + 1,) int64 byte offsets into chunks.<gen>.bin
+    chunks.<gen>.bin       concatenated UTF-8 JSON records (text + metadata)
+    tombstones.<gen>.npy   optional (count,) bool; True rows are deleted and never returned
+
+Every build writes a new generation of data files next to the old one and
+then swaps meta.json, whose "files" names the generation to read; an index
+without "files" uses the unversioned names (embeddings.npy, ...).
+Sidecars built from the rows (bm25.py, hnsw.py, quantize.py) record the
+"gen" they were built from and are refused by another generation
+(check_built_from), so their row ids never point into a different index.
+
+Only the small offsets array is read eagerly; the embedding matrix and the
+chunk records are paged in by the OS on demand, so import cost stays flat
+regardless of corpus size. float16 halves the file but every search pays an
+upcast (see quantize.py for int8/PQ codes with an exact rerank instead).
+"""
+from __future__ import annotations
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import glob
+import json
+import mmap
+import os
+import uuid
+
+import numpy as np
+
+INDEX_VERSION = 1
+META_FILE = "meta.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+OFFSETS_FILE = "offsets.npy"
+CHUNKS_FILE = "chunks.bin"
+TOMBSTONES_FILE = "tombstones.npy"
+_DATA_FILES = {"embeddings": EMBEDDINGS_FILE, "offsets": OFFSETS_FILE, "chunks": CHUNKS_FILE,
+               "tombstones": TOMBSTONES_FILE}
+
+# rows per block when copying/scoring whole matrices
+_BLOCK_ROWS = 65536
+# target size of the float32 upcast buffer for non-float32 matrices; small
+# enough to stay in cache, which is what makes int8/fp16 scans competitive
+_UPCAST_BYTES = 1 << 20
+
+
+def normalize_rows(mat: np.ndarray) -> np.ndarray:
+    mat = np.asarray(mat, dtype=np.float32)
+    norms = np.linalg.norm(mat, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return mat / norms
+
+
+def blocked_dot(mat: np.ndarray, q: np.ndarray, out: np.ndarray) -> np.ndarray:
+    """out[:] = mat @ q for a (possibly memory-mapped, possibly fp16/int8) matrix."""
+    n = mat.shape[0]
+    if mat.dtype == np.float32:
+        for start in range(0, n, _BLOCK_ROWS):
+            stop = min(start + _BLOCK_ROWS, n)
+            np.dot(mat[start:stop], q, out=out[start:stop])
+        return out
+    rows = max(64, _UPCAST_BYTES // (4 * max(1, mat.shape[1])))
+    buf = np.empty((rows, mat.shape[1]), dtype=np.float32)
+    for start in range(0, n, rows):
+        stop = min(start + rows, n)
+        tile = buf[:stop - start]
+        np.copyto(tile, mat[start:stop], casting="unsafe")
+        np.dot(tile, q, out=out[start:stop])
+    return out
+
+
+def _replace_atomic(path: str, write) -> None:
+    tmp = path + ".tmp"
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def _versioned(name: str, gen: str) -> str:
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{gen}{ext}"
+
+
+def data_files(meta: Dict) -> Dict[str, Optional[str]]:
+    """Data file names of the generation `meta` points at (unversioned names for old indexes)."""
+    files = meta.get("files")
+    if files is None:
+        return dict(_DATA_FILES)
+    return {kind: files.get(kind) for kind in _DATA_FILES}
+
+
+def _read_meta(path: str) -> Optional[Dict]:
+    try:
+        with open(os.path.join(path, META_FILE), encoding="utf-8") as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return None
+
+
+class IndexWriter:
+    """
+    Streaming index writer: batches of (vectors, records) are appended as they
+    arrive, so the build job never holds the whole corpus in memory. close()
+    writes a new generation of data files beside the live one and only then
+    replaces meta.json (atomically), so a reader sees either the old index or
+    the new one, never a mix. The generation before the previous one is
+    deleted afterwards; the previous one is kept for readers that loaded
+    the old meta.json but have not opened its files yet.
+    """
+
+    def __init__(self, path: str, dim: Optional[int] = None, dtype: str = "float32",
+                 extra_meta: Optional[Dict] = None):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.extra_meta = dict(extra_meta or {})
+        self.count = 0
+        self._dead: List[np.ndarray] = []
+        self._offsets: List[int] = [0]
+        self.gen = uuid.uuid4().hex[:12]
+        self._raw_path = os.path.join(path, _versioned(EMBEDDINGS_FILE, self.gen)) + ".raw"
+        self._chunks_tmp = os.path.join(path, _versioned(CHUNKS_FILE, self.gen)) + ".tmp"
+        self._raw = open(self._raw_path, "wb")
+        self._chunks = open(self._chunks_tmp, "wb")
+
+    def add(self, vectors: np.ndarray, records: Sequence[Dict]) -> int:
+        """Append rows; returns the row number of the first one."""
+        vecs = normalize_rows(np.atleast_2d(vectors)).astype(self.dtype)
+        if len(records) != vecs.shape[0]:
+            raise ValueError(
+                f"record count ({len(records)}) does not match vector count ({vecs.shape[0]})"
+            )
+        if self.dim is None:
+            self.dim = int(vecs.shape[1])
+        elif vecs.shape[1] != self.dim:
+            raise ValueError(f"vector dim {vecs.shape[1]} != index dim {self.dim}")
+        self._raw.write(np.ascontiguousarray(vecs).tobytes())
+        for rec in records:
+            blob = json.dumps(rec, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            self._chunks.write(blob)
+            self._offsets.append(self._offsets[-1] + len(blob))
+        first = self.count
+        self.count += vecs.shape[0]
+        return first
+
+    def extend_from(self, index: "VectorIndex", rows: Optional[np.ndarray] = None) -> int:
+        """
+        Copy rows of an existing index verbatim (no re-normalisation, no JSON
+        round-trip). All rows when `rows` is None. Tombstones are not carried
+        over; mark them again with tombstone(). Returns the first new row number.
+        """
+        if self.dim is None:
+            self.dim = index.dim
+        elif index.dim != self.dim:
+            raise ValueError(f"index dim {index.dim} != writer dim {self.dim}")
+        first = self.count
+        n = len(index)
+        base = self._offsets[-1]
+        if rows is None:
+            for start in range(0, n, _BLOCK_ROWS):
+                block = index.vectors[start:start + _BLOCK_ROWS]
+                self._raw.write(np.ascontiguousarray(block, dtype=self.dtype).tobytes())
+            end = int(index.offsets[-1])
+            for start in range(0, end, 1 << 24):
+                self._chunks.write(index._chunks[start:min(start + (1 << 24), end)])
+            self._offsets.extend((index.offsets[1:] - index.offsets[0] + base).tolist())
+            self.count += n
+            return first
+        rows = np.asarray(rows, dtype=np.int64)
+        for start in range(0, rows.shape[0], _BLOCK_ROWS):
+            sel = rows[start:start + _BLOCK_ROWS]
+            self._raw.write(np.ascontiguousarray(index.vectors[sel], dtype=self.dtype).tobytes())
+            for row in sel.tolist():
+                blob = index._chunks[int(index.offsets[row]):int(index.offsets[row + 1])]
+                self._chunks.write(blob)
+                self._offsets.append(self._offsets[-1] + len(blob))
+        self.count += rows.shape[0]
+        return first
+
+    def tombstone(self, rows) -> None:
+        """Mark already-written rows as deleted."""
+        self._dead.append(np.asarray(rows, dtype=np.int64).reshape(-1))
+
+    def close(self) -> None:
+        self._raw.close()
+        self._chunks.close()
+        dim = self.dim or 0
+
+        def _write_embeddings(tmp):
+            out = np.lib.format.open_memmap(tmp, mode="w+", dtype=self.dtype, shape=(self.count, dim))
+            if self.count and dim:
+                out[:] = np.memmap(self._raw_path, dtype=self.dtype, mode="r", shape=(self.count, dim))
+            out.flush()
+            del out
+
+        def _write_offsets(tmp):
+            # pass a handle: np.save would append ".npy" to the ".tmp" name
+            with open(tmp, "wb") as fh:
+                np.save(fh, np.asarray(self._offsets, dtype=np.int64))
+
+        files: Dict[str, Optional[str]] = {kind: _versioned(name, self.gen) for kind, name in _DATA_FILES.items()}
+        _replace_atomic(os.path.join(self.path, files["embeddings"]), _write_embeddings)
+        _replace_atomic(os.path.join(self.path, files["offsets"]), _write_offsets)
+        os.replace(self._chunks_tmp, os.path.join(self.path, files["chunks"]))
+        os.remove(self._raw_path)
+
+        dead = np.zeros(self.count, dtype=bool)
+        for rows in self._dead:
+            dead[rows] = True
+        if dead.any():
+            def _write_tombstones(tmp):
+                with open(tmp, "wb") as fh:
+                    np.save(fh, dead)
+            _replace_atomic(os.path.join(self.path, files["tombstones"]), _write_tombstones)
+        else:
+            files["tombstones"] = None
+
+        meta = {
+            "version": INDEX_VERSION,
+            "count": self.count,
+            "live": int(self.count - dead.sum()),
+            "dim": dim,
+            "dtype": str(self.dtype),
+            "gen": self.gen,
+            "files": files,
+        }
+        meta.update(self.extra_meta)
+
+        def _write_meta(tmp):
+            with open(tmp, "w", encoding="utf-8") as fh:
+                json.dump(meta, fh, indent=2)
+
+        previous = _read_meta(self.path)
+        _replace_atomic(os.path.join(self.path, META_FILE), _write_meta)   # the switch-over
+        keep = set(files.values()) | (set(data_files(previous).values()) if previous else set())
+        self._prune(keep)
+
+    def _prune(self, keep) -> None:
+        """Delete data files of generations other than `keep` (current and previous)."""
+        for name in _DATA_FILES.values():
+            stem, ext = os.path.splitext(name)
+            for found in glob.glob(os.path.join(self.path, f"{stem}*{ext}")):
+                if os.path.basename(found) not in keep:
+                    try:
+                        os.remove(found)
+                    except FileNotFoundError:
+                        pass
+
+    def abort(self) -> None:
+        self._raw.close()
+        self._chunks.close()
+        for tmp in (self._raw_path, self._chunks_tmp):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def __enter__(self) -> "IndexWriter":
+        return self
+
+    def __exit__(self, exc_type, *_):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def write_index(
+    path: str,
+    vectors: np.ndarray,
+    records: Iterable[Dict],
+    dtype: str = "float32",
+    extra_meta: Optional[Dict] = None,
+) -> None:
+    """Write a complete index in one call; `records` pairs 1:1 with vector rows."""
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    with IndexWriter(path, vectors.shape[1], dtype, extra_meta) as writer:
+        writer.add(vectors, list(records))
+
+
+class VectorIndex:
+    """Read-only, memory-mapped view of an index directory."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, META_FILE), encoding="utf-8") as fh:
+            self.meta: Dict = json.load(fh)
+        if self.meta.get("version") != INDEX_VERSION:
+            raise ValueError(f"unsupported index version: {self.meta.get('version')}")
+        files = data_files(self.meta)
+
+        self.vectors = np.load(os.path.join(path, files["embeddings"]), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, files["offsets"]))
+        if self.vectors.shape[0] + 1 != self.offsets.shape[0]:
+            raise ValueError("embeddings and offsets are out of sync")
+
+        tomb_path = os.path.join(path, files["tombstones"]) if files["tombstones"] else None
+        self.tombstones: Optional[np.ndarray] = (
+            np.load(tomb_path) if tomb_path and os.path.exists(tomb_path) else None
+        )
+
+        self._chunks_fh = open(os.path.join(path, files["chunks"]), "rb")
+        size = os.fstat(self._chunks_fh.fileno()).st_size
+        self._chunks = mmap.mmap(self._chunks_fh.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def __len__(self) -> int:
+        return int(self.vectors.shape[0])
+
+    @property
+    def gen(self) -> Optional[str]:
+        """Generation of the data files (None for indexes written before generations)."""
+        return self.meta.get("gen")
+
+    @property
+    def dim(self) -> int:
+        return int(self.vectors.shape[1])
+
+    def record(self, row: int) -> Dict:
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return json.loads(self._chunks[start:end])
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        """Cosine similarity of `query` against every row (vectorised, blocked)."""
+        q = normalize_rows(np.asarray(query, dtype=np.float32).reshape(-1))
+        if q.shape[0] != self.dim:
+            raise ValueError(f"query dim {q.shape[0]} != index dim {self.dim}")
+        return blocked_dot(self.vectors, q, np.empty(len(self), dtype=np.float32))
+
+    def search(self, query: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        """Return up to k (row, score) pairs, best first."""
+        n = len(self)
+        if n == 0 or k <= 0:
+            return []
+        scores = self.scores(query)
+        if self.tombstones is not None:
+            scores[self.tombstones] = -np.inf
+        return top_k(scores, k)
+
+
+def check_built_from(index: VectorIndex, gen: Optional[str], count: int, what: str) -> None:
+    """Raise ValueError unless a sidecar built from generation `gen` with `count` rows matches `index`."""
+    if count != len(index):
+        raise ValueError(f"{what} covers {count} rows, index has {len(index)}")
+    if gen != index.gen:
+        raise ValueError(f"{what} was built from index generation {gen}, index is at {index.gen}")
+
+
+def top_k(scores: np.ndarray, k: int) -> List[Tuple[int, float]]:
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return []
+    if k < scores.shape[0]:
+        idx = np.argpartition(-scores, k - 1)[:k]
+    else:
+        idx = np.arange(scores.shape[0])
+    idx = idx[np.argsort(-scores[idx], kind="stable")]
+    return [(int(i), float(scores[i])) for i in idx if np.isfinite(scores[i])]
+
+
+def load_index(path: str) -> Optional[VectorIndex]:
+    """Load the index at `path`, or return None if no index has been built there."""
+    if not os.path.exists(os.path.join(path, META_FILE)):
+        return None
+    return VectorIndex(path)
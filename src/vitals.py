@@ -0,0 +1,244 @@
+# vitals.py
+"""
+Stored vitals for series a request does not carry itself.
+
+One `fetch(user_id, names)` returns every requested series in a single round
+trip, however many are missing; rows are streamed page by page into
+per-series columns and become Series (series.py) at the end.
+
+    TimestreamRepository  the DataStack table; one SELECT ... measure_name IN (...)
+                          read with the query paginator
+    SQLiteRepository      one local file with the same shape (stand-in for tests
+                          and local runs); rows read with fetchmany
+    MemoryRepository      per-process dict of Series
+    CachedRepository      read-through per-user cache in front of any of them
+
+Timestream records: dimension `user_id`, measure_name = series name
+("glucose", "bp_sys", ...), multi-measure values `week` (BIGINT),
+`value_data` and `value_predicted` (DOUBLE) -- the weekly payload schema.
+
+User ids must match USER_ID_RE and series names must be in SERIES before
+they reach any query; the handler only passes the authenticated caller's id.
+"""
+from __future__ import annotations
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import os
+import re
+import sqlite3
+import threading
+
+from cache import TTLCache
+from series import Series
+
+SERIES = ("health_age", "glucose", "weight", "bp_sys", "bp_dia", "bmi", "rhr")
+# Cognito / JWT subjects, Lambda authorizer principals ("auth0|123", e-mails)
+USER_ID_RE = re.compile(r"^[A-Za-z0-9._@:|+-]{1,128}$")
+VITALS_LOOKBACK_DAYS = int(os.getenv("VITALS_LOOKBACK_DAYS", "730"))
+VITALS_CACHE_SIZE = int(os.getenv("VITALS_CACHE_SIZE", "256"))      # users per container
+VITALS_CACHE_TTL_S = float(os.getenv("VITALS_CACHE_TTL_S", "900"))
+
+Row = Tuple[str, object, object, object]   # (series, week, value_data, value_predicted)
+
+
+def parse_user_id(value) -> Optional[str]:
+    if value is None or value == "":
+        return None
+    if not isinstance(value, str) or not USER_ID_RE.match(value):
+        raise ValueError("'user_id' must be 1-128 characters of letters, digits or . _ @ : | + -")
+    return value
+
+
+def _checked(user_id: str, names: Sequence[str]) -> None:
+    """Allowlist check before a user id or series name is written into a query."""
+    if not isinstance(user_id, str) or not USER_ID_RE.match(user_id):
+        raise ValueError("invalid user id for the vitals store")
+    unknown = [n for n in names if n not in SERIES]
+    if unknown:
+        raise ValueError(f"unknown vitals series: {', '.join(map(repr, unknown))}")
+
+
+class _Columns:
+    """Per-series column lists filled row by row, turned into Series once."""
+
+    def __init__(self, names: Sequence[str]):
+        self.cols: Dict[str, Tuple[List, List, List]] = {n: ([], [], []) for n in names}
+
+    def extend(self, rows: Iterable[Row]) -> None:
+        for name, week, obs, pred in rows:
+            cols = self.cols.get(name)
+            if cols is not None:
+                cols[0].append(week)
+                cols[1].append(obs)
+                cols[2].append(pred)
+
+    def series(self) -> Dict[str, Series]:
+        return {n: Series.build(*c) if c[0] else Series.empty() for n, c in self.cols.items()}
+
+
+class VitalsRepository:
+    name = "base"
+
+    def fetch(self, user_id: str, names: Sequence[str], deadline=None) -> Dict[str, Series]:
+        """
+        Series `names` of the user in one round trip; Series.empty() where
+        there is no data. Raises TimeoutError if `deadline` (pipeline.Deadline)
+        passes while the result is still being read.
+        """
+        raise NotImplementedError
+
+
+class MemoryRepository(VitalsRepository):
+    name = "memory"
+
+    def __init__(self):
+        self.data: Dict[str, Dict[str, Series]] = {}
+
+    def put(self, user_id: str, name: str, series: Series) -> None:
+        self.data.setdefault(user_id, {})[name] = series
+
+    def fetch(self, user_id: str, names: Sequence[str], deadline=None) -> Dict[str, Series]:
+        stored = self.data.get(user_id, {})
+        return {n: stored.get(n) or Series.empty() for n in names}
+
+
+class SQLiteRepository(VitalsRepository):
+    name = "sqlite"
+    PAGE = 512   # rows per fetchmany
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS vitals ("
+            " user_id TEXT NOT NULL, series TEXT NOT NULL, week INTEGER NOT NULL,"
+            " value_data REAL, value_predicted REAL,"
+            " PRIMARY KEY (user_id, series, week)) WITHOUT ROWID;"
+        )
+
+    def put(self, user_id: str, name: str, series: Series) -> None:
+        rows = [(user_id, name, p["week"], p["value_data"], p["value_predicted"]) for p in series.to_points()]
+        with self._lock:
+            with self._db:
+                self._db.execute("BEGIN")
+                self._db.executemany("INSERT OR REPLACE INTO vitals VALUES (?, ?, ?, ?, ?)", rows)
+
+    def fetch(self, user_id: str, names: Sequence[str], deadline=None) -> Dict[str, Series]:
+        _checked(user_id, names)
+        cols = _Columns(names)
+        if names:
+            marks = ",".join("?" * len(names))
+            with self._lock:
+                cur = self._db.execute(
+                    "SELECT series, week, value_data, value_predicted FROM vitals"
+                    f" WHERE user_id = ? AND series IN ({marks})", (user_id, *names)
+                )
+                while True:
+                    rows = cur.fetchmany(self.PAGE)
+                    if not rows:
+                        break
+                    if deadline is not None:
+                        deadline.check()
+                    cols.extend(rows)
+        return cols.series()
+
+
+class CachedRepository(VitalsRepository):
+    """
+    Read-through cache of each user's series, kept at module scope so a warm
+    container answers repeat turns without touching the store. A miss loads
+    every series of the user in one fetch, so later turns missing a different
+    subset are hits too; entries expire after `ttl` and the least recently
+    used user is evicted past `maxsize`.
+
+    Ingestion invalidates with `invalidate(user_id)` (see handler's
+    "invalidate_vitals" event) or, across containers, by sending a new
+    `version` (e.g. the time of the last upload) with the request.
+    """
+
+    def __init__(self, inner: VitalsRepository, maxsize: int = VITALS_CACHE_SIZE,
+                 ttl: float = VITALS_CACHE_TTL_S):
+        self.inner = inner
+        self.cache = TTLCache(maxsize, ttl)
+        self.name = inner.name
+
+    def fetch(self, user_id: str, names: Sequence[str], deadline=None, version: str = "") -> Dict[str, Series]:
+        entry = self.cache.get(user_id)
+        if entry is None or entry[0] != version or any(n not in entry[1] for n in names):
+            entry = (version, self.inner.fetch(user_id, list(dict.fromkeys([*SERIES, *names])), deadline))
+            self.cache.put(user_id, entry)
+        return {n: entry[1][n] for n in names}
+
+    def invalidate(self, user_id: Optional[str] = None) -> None:
+        """Drop one user's series, or every user's with no argument."""
+        if user_id is None:
+            self.cache.clear()
+        else:
+            self.cache.pop(user_id)
+
+    def stats(self) -> Dict:
+        return self.cache.stats()
+
+
+def _quote(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _scalar(datum: Dict):
+    return None if datum.get("NullValue") else datum.get("ScalarValue")
+
+
+class TimestreamRepository(VitalsRepository):
+    name = "timestream"
+
+    def __init__(self, database: str, table: str, lookback_days: int = VITALS_LOOKBACK_DAYS, client=None):
+        if client is None:
+            import boto3  # only needed when this backend is configured
+            client = boto3.client("timestream-query")
+        self.client = client
+        self.database = database
+        self.table = table
+        self.lookback_days = lookback_days
+
+    def query_for(self, user_id: str, names: Sequence[str]) -> str:
+        _checked(user_id, names)   # _quote is a second line of defence, not the first
+        return (
+            "SELECT measure_name, week, value_data, value_predicted"
+            f' FROM "{self.database}"."{self.table}"'
+            f" WHERE user_id = {_quote(user_id)}"
+            f" AND measure_name IN ({', '.join(_quote(n) for n in names)})"
+            f" AND time > ago({int(self.lookback_days)}d)"
+        )
+
+    def fetch(self, user_id: str, names: Sequence[str], deadline=None) -> Dict[str, Series]:
+        cols = _Columns(names)
+        if not names:
+            return cols.series()
+        pages = self.client.get_paginator("query").paginate(QueryString=self.query_for(user_id, names))
+        order: Optional[List[int]] = None
+        for page in pages:
+            if deadline is not None:
+                deadline.check()   # a partial series would misstate the user's data
+            if order is None and page.get("ColumnInfo"):
+                header = [c["Name"] for c in page.get("ColumnInfo", [])]
+                order = [header.index(c) for c in ("measure_name", "week", "value_data", "value_predicted")]
+            if order is not None:
+                cols.extend(tuple(_scalar(r["Data"][i]) for i in order) for r in page.get("Rows", []))
+        return cols.series()
+
+
+def from_spec(spec: str) -> Optional[VitalsRepository]:
+    """"" -> disabled, "memory", "sqlite:<path>", "timestream:<database>/<table>"."""
+    kind, _, rest = (spec or "").partition(":")
+    if not kind:
+        return None
+    if kind == "memory":
+        return MemoryRepository()
+    if kind == "sqlite":
+        return SQLiteRepository(rest or "/tmp/vitals.db")
+    if kind == "timestream":
+        database, _, table = rest.partition("/")
+        if not database or not table:
+            raise ValueError("timestream vitals store needs a table: timestream:<database>/<table>")
+        return TimestreamRepository(database, table)
+    raise ValueError(f"unknown vitals store spec: {spec!r}")
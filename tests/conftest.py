@@ -0,0 +1,8 @@
+# tests/conftest.py
+import os
+import sys
+
+# The Lambda code lives flat in src/ and imports its siblings top-level.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+# handler builds its boto3 clients at import time.
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
@@ -0,0 +1,72 @@
+# tests/test_bedrock_stub.py
+import json
+
+import pytest
+from botocore.exceptions import ClientError
+
+import bedrock_stub
+import providers
+
+CACHING_MODEL = "us.anthropic.claude-3-5-haiku-20241022-v1:0"
+
+
+def _messages(question):
+    return [{"role": "system", "content": "system prompt " * 40, "cache": True},
+            {"role": "user", "name": "vitals", "content": "vitals " * 80, "cache": True},
+            {"role": "user", "content": question}]
+
+
+def test_parse_spec():
+    faults = bedrock_stub.parse_spec("throttle=0.3, latency_ms=0,seed=7")
+    assert (faults.throttle, faults.latency_ms, faults.seed, faults.error) == (0.3, 0, 7, 0.0)
+    with pytest.raises(ValueError):
+        bedrock_stub.parse_spec("throttle")
+    assert bedrock_stub.from_spec("") is None
+
+
+def test_injected_throttling_is_a_client_error():
+    stub = bedrock_stub.FaultyBedrock(bedrock_stub.Faults(throttle=1.0, latency_ms=0))
+    with pytest.raises(ClientError) as err:
+        stub.invoke_model(modelId=CACHING_MODEL, body=b"{}")
+    assert err.value.response["Error"]["Code"] == "ThrottlingException"
+    assert stub.calls[0]["outcome"] == "ThrottlingException"
+
+
+def test_shared_prefix_is_written_once_then_read():
+    stub = bedrock_stub.FaultyBedrock(bedrock_stub.Faults(latency_ms=0))
+    adapter = providers.for_model(CACHING_MODEL)
+    first = adapter.invoke(stub, CACHING_MODEL, _messages("latest glucose?"), 100).token_usage
+    second = adapter.invoke(stub, CACHING_MODEL, _messages("and my weight?"), 100).token_usage
+    assert first["cache_write_input_tokens"] > 0 and "cache_read_input_tokens" in first
+    assert first["cache_read_input_tokens"] == 0
+    assert second["cache_read_input_tokens"] == first["cache_write_input_tokens"]
+    assert second["cache_write_input_tokens"] == 0
+    assert second["input_tokens"] < first["cache_write_input_tokens"]
+
+
+def test_no_cache_points_no_cache_usage(monkeypatch):
+    monkeypatch.setattr(providers, "PROMPT_CACHE", "off")
+    stub = bedrock_stub.FaultyBedrock(bedrock_stub.Faults(latency_ms=0))
+    adapter = providers.for_model(CACHING_MODEL)
+    for question in ("latest glucose?", "and my weight?"):
+        usage = adapter.invoke(stub, CACHING_MODEL, _messages(question), 100).token_usage
+        assert "cache_read_input_tokens" not in usage
+
+
+def test_converse_and_streams_report_cache_usage():
+    model_id = "us.amazon.nova-lite-v1:0"
+    stub = bedrock_stub.FaultyBedrock(bedrock_stub.Faults(latency_ms=0))
+    converse = providers.for_model(model_id)
+    assert converse.invoke(stub, model_id, _messages("q1"), 50).token_usage["cache_write_input_tokens"] > 0
+    stream = converse.stream(stub, model_id, _messages("q2"), 50)
+    assert "".join(stream) == stub.answer
+    assert stream.token_usage["cache_read_input_tokens"] > 0
+
+    anthropic = providers.for_model(CACHING_MODEL)
+    anthropic.invoke(stub, CACHING_MODEL, _messages("q1"), 50)
+    stream = anthropic.stream(stub, CACHING_MODEL, _messages("q2"), 50)
+    assert "".join(stream) == stub.answer
+    usage = stream.token_usage
+    assert usage["cache_read_input_tokens"] > 0
+    assert usage["total_tokens"] == sum(usage[k] for k in ("input_tokens", "output_tokens",
+                                                           "cache_read_input_tokens", "cache_write_input_tokens"))
@@ -0,0 +1,61 @@
+# tests/test_bm25.py
+import numpy as np
+import pytest
+
+import bm25
+import embedder as emb
+import retrieval
+import vector_index
+
+DOCS = [
+    "HbA1c above 6.5 percent indicates type-2 diabetes.",
+    "Resting heart rate between 60 and 100 is normal.",
+    "Blood pressure above 130/80 is stage 1 hypertension.",
+    "Regular exercise lowers resting heart rate.",
+]
+
+
+def test_tokenize_keeps_clinical_terms():
+    assert bm25.tokenize("What is my HbA1c and type-2 risk at 6.5?") == ["hba1c", "type-2", "risk", "6.5"]
+
+
+def test_search_ranks_matching_rows(tmp_path):
+    bm25.build(str(tmp_path), enumerate(DOCS), len(DOCS))
+    index = bm25.load(str(tmp_path))
+    hits = index.search("resting heart rate", k=5)
+    assert {row for row, _ in hits} == {1, 3}
+    assert all(score > 0 for _, score in hits)
+    assert index.search("hba1c", k=5)[0][0] == 0
+    assert index.search("unknownterm", k=5) == []
+
+
+def test_rrf_rewards_agreement():
+    fused = bm25.reciprocal_rank_fusion([[(1, 0.9), (2, 0.8)], [(2, 7.0), (3, 5.0)]], k=60)
+    assert fused[0][0] == 2
+    assert {row for row, _ in fused} == {1, 2, 3}
+
+
+def test_hybrid_search_thresholds_both_rankers(tmp_path):
+    path = str(tmp_path)
+    embedder = emb.from_spec("hashing:64")
+    vector_index.write_index(path, embedder.embed(DOCS), [{"text": d} for d in DOCS],
+                             extra_meta={"embedder": embedder.spec})
+    bm25.build(path, enumerate(DOCS), len(DOCS))
+    retriever = retrieval.Retriever(vector_index.load_index(path), embedder, bm25.load(path))
+
+    assert retriever.search("hba1c", k=4, min_score=2.0, min_bm25=0.0)[0].row == 0
+    # nothing clears either cutoff: no reference material at all
+    assert retriever.search("hba1c", k=4, min_score=2.0, min_bm25=1e9) == []
+
+
+def test_files_from_another_index_generation_are_refused(tmp_path):
+    path = str(tmp_path)
+    embedder = emb.from_spec("hashing:64")
+    vector_index.write_index(path, embedder.embed(DOCS), [{"text": d} for d in DOCS])
+    bm25.build(path, enumerate(DOCS), len(DOCS), index_gen=vector_index.load_index(path).gen)
+    assert bm25.load(path, vector_index.load_index(path)) is not None
+
+    # same row count, different rows: only the generation tells them apart
+    vector_index.write_index(path, embedder.embed(DOCS[::-1]), [{"text": d} for d in DOCS[::-1]])
+    with pytest.raises(ValueError, match="generation"):
+        bm25.load(path, vector_index.load_index(path))
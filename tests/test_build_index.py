@@ -0,0 +1,64 @@
+# tests/test_build_index.py
+import os
+
+import pytest
+
+import build_index
+import embedder as emb
+import vector_index
+
+
+def _write(root, name, text):
+    with open(os.path.join(root, name), "w", encoding="utf-8") as fh:
+        fh.write(text)
+
+
+def _texts(out):
+    index = vector_index.load_index(out)
+    dead = index.tombstones if index.tombstones is not None else [False] * len(index)
+    return sorted(index.record(r)["text"] for r in range(len(index)) if not dead[r])
+
+
+def test_incremental_update_embeds_only_changed_files(tmp_path):
+    src, out = str(tmp_path / "docs"), str(tmp_path / "index")
+    os.makedirs(src)
+    _write(src, "a.md", "# A\n\nAlpha paragraph about glucose.")
+    _write(src, "b.md", "# B\n\nBeta paragraph about blood pressure.")
+    embedder = emb.from_spec("hashing:32")
+
+    first = build_index.update(src, out, embedder, workers=1)
+    assert first["mode"] == "full" and first["chunks"] == 2
+
+    assert build_index.update(src, out, embedder, workers=1)["mode"] == "unchanged"
+
+    _write(src, "b.md", "# B\n\nBeta paragraph about heart rate.")
+    os.remove(os.path.join(src, "a.md"))
+    _write(src, "c.md", "# A\n\nAlpha paragraph about glucose.")     # a.md's text, moved
+    stats = build_index.update(src, out, embedder, workers=1, compact_ratio=1.0)
+    assert stats["mode"] == "incremental"
+    assert stats["changed"] == 2 and stats["removed"] == 1
+    assert stats["reused"] == 1 and stats["embedded"] == 1
+    assert _texts(out) == ["# A\n\nAlpha paragraph about glucose.", "# B\n\nBeta paragraph about heart rate."]
+
+
+def test_update_compacts_when_mostly_dead(tmp_path):
+    src, out = str(tmp_path / "docs"), str(tmp_path / "index")
+    os.makedirs(src)
+    for i in range(4):
+        _write(src, f"{i}.txt", f"Document number {i}.")
+    embedder = emb.from_spec("hashing:16")
+    build_index.update(src, out, embedder, workers=1)
+    for i in range(3):
+        os.remove(os.path.join(src, f"{i}.txt"))
+
+    stats = build_index.update(src, out, embedder, workers=1, compact_ratio=0.5)
+    assert stats["mode"] == "compact"
+    index = vector_index.load_index(out)
+    assert len(index) == 1 and index.tombstones is None
+    assert index.record(0)["text"] == "Document number 3."
+
+
+def test_cli_rejects_overlap_over_half_a_chunk(tmp_path, capsys):
+    with pytest.raises(SystemExit):
+        build_index.main([str(tmp_path), "--chunk-chars", "100", "--overlap", "51"])
+    assert "at most half of --chunk-chars" in capsys.readouterr().err
@@ -0,0 +1,83 @@
+# tests/test_cache.py
+import numpy as np
+
+from cache import ResponseCache, TTLCache, VectorCache, fingerprint
+
+
+class Clock:
+    def __init__(self, t=1000.0):
+        self.t = t
+
+    def __call__(self):
+        return self.t
+
+
+def test_ttl_cache_expires_entries():
+    clock = Clock()
+    cache = TTLCache(maxsize=4, ttl=10, clock=clock)
+    cache.put("a", 1)
+    assert cache.get("a") == 1
+    clock.t += 11
+    assert cache.get("a") is None and len(cache) == 0
+    assert cache.stats() == {"hits": 1, "misses": 1, "size": 0}
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=100)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")                  # b is now the oldest
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+
+def test_zero_size_cache_stores_nothing():
+    cache = TTLCache(maxsize=0)
+    cache.put("a", 1)
+    assert cache.get("a") is None
+
+
+def test_vector_cache_round_trips_through_npz(tmp_path):
+    path = str(tmp_path / "q.npz")
+    cache = VectorCache(8, 100, path, save_every_s=0)
+    cache.put("glucose", np.arange(4, dtype=np.float32))
+    assert cache.save() and not cache.save()      # nothing changed since
+    fresh = VectorCache(8, 100, path)
+    assert fresh.load() == 1
+    np.testing.assert_array_equal(fresh.get("glucose"), np.arange(4, dtype=np.float32))
+
+
+def test_vector_cache_saves_at_most_every_interval(tmp_path):
+    clock = Clock()
+    cache = VectorCache(8, 100, str(tmp_path / "q.npz"), save_every_s=60, clock=clock)
+    cache.put("a", np.ones(2, dtype=np.float32))
+    assert not cache.maybe_save()
+    clock.t += 61
+    assert cache.maybe_save()
+    cache.put("b", np.ones(2, dtype=np.float32))
+    assert not cache.maybe_save()
+
+
+def test_fingerprint_is_order_sensitive_and_stable():
+    assert fingerprint("a", {"x": 1, "y": 2}) == fingerprint("a", {"y": 2, "x": 1})
+    assert fingerprint("a", "b") != fingerprint("b", "a")
+
+
+def test_response_cache_exact_tier():
+    cache = ResponseCache(maxsize=8, ttl=100)
+    cache.put("scope", "how is my glucose", {"answer": "fine"})
+    assert cache.get("scope", "how is my glucose") == ({"answer": "fine"}, "exact")
+    assert cache.get("other-scope", "how is my glucose") == (None, None)
+    assert cache.stats() == {"exact": 1, "semantic": 0, "misses": 1, "size": 1}
+
+
+def test_response_cache_semantic_tier_stays_within_scope():
+    cache = ResponseCache(maxsize=8, ttl=100, min_sim=0.9)
+    q = np.array([1.0, 0.0], dtype=np.float32)
+    cache.put("scope", "how is my glucose", {"answer": "fine"}, q)
+    near = np.array([0.99, 0.141], dtype=np.float32)
+    far = np.array([0.0, 1.0], dtype=np.float32)
+    assert cache.get("scope", "is my glucose ok", near) == ({"answer": "fine"}, "semantic")
+    assert cache.get("scope", "what about sleep", far) == (None, None)
+    assert cache.get("other-scope", "is my glucose ok", near) == (None, None)
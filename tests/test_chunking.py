@@ -0,0 +1,48 @@
+# tests/test_chunking.py
+import pytest
+
+import chunking
+
+
+def _covers(text, spans):
+    covered = set()
+    for s, e in spans:
+        covered.update(range(s, e))
+    return covered >= set(range(len(text.rstrip())))
+
+
+def test_chunk_spans_respect_size_and_cover_text():
+    text = " ".join(f"Sentence number {i} is here." for i in range(60))
+    spans = chunking.chunk_spans(text, chunk_chars=120, overlap=30)
+    assert len(spans) > 1
+    assert all(0 < e - s <= 120 for s, e in spans)
+    assert _covers(text, spans)
+    # consecutive chunks overlap but always move forward
+    assert all(b[0] > a[0] and b[0] <= a[1] for a, b in zip(spans, spans[1:]))
+
+
+def test_chunk_spans_hard_splits_long_sentence():
+    text = "x" * 250
+    spans = chunking.chunk_spans(text, chunk_chars=100, overlap=10)
+    assert all(e - s <= 100 for s, e in spans)
+    assert spans[0] == (0, 100) and spans[-1][1] == 250
+
+
+def test_chunk_spans_edge_cases():
+    assert chunking.chunk_spans("", 100, 10) == []
+    assert chunking.chunk_spans("short.", 100, 0) == [(0, 6)]
+    assert chunking.chunk_spans("ab", chunk_chars=1, overlap=0) == [(0, 1), (1, 2)]
+
+
+@pytest.mark.parametrize("chunk_chars,overlap", [(0, 0), (-5, 0), (10, 10), (10, 6), (10, -1)])
+def test_chunk_spans_rejects_bad_arguments(chunk_chars, overlap):
+    with pytest.raises(ValueError):
+        chunking.chunk_spans("some text.", chunk_chars, overlap)
+
+
+def test_chunk_document_records():
+    doc = {"doc_id": "a.md", "title": "A", "url": "", "date": "2024-01-01", "text": "One. Two. Three."}
+    chunks = chunking.chunk_document(doc, chunk_chars=6, overlap=0)
+    assert [c["text"] for c in chunks] == ["One.", "Two.", "Three."]
+    assert [c["id"] for c in chunks] == ["a.md#0", "a.md#1", "a.md#2"]
+    assert chunks[0]["hash"] == chunking.content_hash("One.")
@@ -0,0 +1,70 @@
+# tests/test_conversations.py
+import pytest
+
+import conversations
+
+
+class Clock:
+    def __init__(self, t=1_000_000.0):
+        self.t = t
+
+    def __call__(self):
+        return self.t
+
+
+def _turns(*texts):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": t} for i, t in enumerate(texts)]
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store_and_clock(request, tmp_path, monkeypatch):
+    clock = Clock()
+    if request.param == "memory":
+        return conversations.MemoryStore(ttl=100, clock=clock), clock
+    monkeypatch.setattr(conversations.time, "time", clock)
+    return conversations.SQLiteStore(str(tmp_path / "c.db"), ttl=100), clock
+
+
+def test_recent_reads_newest_turns_within_budget(store_and_clock):
+    store, _ = store_and_clock
+    store.append("s", _turns("a" * 400, "b" * 400, "c" * 40, "d" * 40))
+    recent = store.recent("s", max_tokens=60)
+    assert [m["content"][0] for m in recent] == ["c", "d"]
+    assert store.recent("other", 1000) == []
+
+
+def test_turns_expire_ttl_after_they_were_written(store_and_clock):
+    store, clock = store_and_clock
+    store.append("s", _turns("first", "reply"))
+    store.put_summary("s", "older turns")
+    clock.t += 60
+    store.append("s", _turns("second", "reply"))
+    clock.t += 50            # first exchange and summary are 110s old, second is 50s old
+    assert [m["content"] for m in store.recent("s", 1000)] == ["second", "reply"]
+    assert store.get_summary("s") == ""
+
+
+def test_clear(store_and_clock):
+    store, _ = store_and_clock
+    store.append("s", _turns("q", "a"))
+    store.put_summary("s", "x")
+    store.clear("s")
+    assert store.recent("s", 1000) == [] and store.get_summary("s") == ""
+
+
+def test_session_keys_are_scoped_by_owner():
+    assert conversations.session_key("alice", "s1") != conversations.session_key("bob", "s1")
+    assert conversations.session_key(None, "s1") == conversations.session_key("", "s1")
+
+
+@pytest.mark.parametrize("value", ["x" * 129, "bad id", 42])
+def test_parse_session_id_rejects_bad_ids(value):
+    with pytest.raises(ValueError):
+        conversations.parse_session_id(value)
+
+
+def test_from_spec():
+    assert conversations.from_spec("") is None
+    assert conversations.from_spec("memory").name == "memory"
+    with pytest.raises(ValueError):
+        conversations.from_spec("dynamodb:")
@@ -0,0 +1,47 @@
+# tests/test_downsample.py
+import numpy as np
+import pytest
+
+import downsample
+from series import Series
+
+
+def test_lttb_keeps_endpoints_and_spike():
+    x = np.arange(100)
+    y = np.zeros(100)
+    y[37] = 50.0
+    idx = downsample.lttb_indices(x, y, 10)
+    assert len(idx) == 10 and idx[0] == 0 and idx[-1] == 99
+    assert 37 in idx
+    assert np.all(np.diff(idx) > 0)
+
+
+def test_minmax_keeps_extremes_within_budget():
+    rng = np.random.default_rng(0)
+    y = rng.normal(size=200)
+    idx = downsample.minmax_indices(y, 20)
+    assert len(idx) <= 20
+    assert y.argmin() in idx and y.argmax() in idx
+
+
+@pytest.mark.parametrize("method", ["lttb", "minmax", "none"])
+def test_select_keeps_latest_observation_and_forecast(method):
+    n = 60
+    observed = [100.0 + (i % 5) if i < 50 else None for i in range(n)]
+    predicted = [None] * 50 + [110.0] * 10
+    s = Series.build(range(n), observed, predicted)
+    idx = downsample.select(s, 20, method)
+    assert len(idx) == 20
+    assert 49 in idx and set(range(50, 60)) <= set(idx.tolist())
+
+
+def test_select_returns_everything_that_fits():
+    s = Series.build(range(5), [1, 2, 3, 4, 5], [None] * 5)
+    assert downsample.select(s, 10).tolist() == [0, 1, 2, 3, 4]
+
+
+def test_parse_method():
+    assert downsample.parse_method(None) == "lttb"
+    assert downsample.parse_method("MinMax") == "minmax"
+    with pytest.raises(ValueError):
+        downsample.parse_method("median")
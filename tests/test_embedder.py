@@ -0,0 +1,54 @@
+# tests/test_embedder.py
+import io
+import json
+
+import boto3
+import numpy as np
+
+import embedder as emb
+import pipeline
+
+
+class RecordingBedrock:
+    """bedrock-runtime stand-in that remembers which client served each call."""
+
+    def __init__(self, name="base"):
+        self.name = name
+        self.calls = []
+
+    def invoke_model(self, modelId, body):
+        self.calls.append(json.loads(body))
+        return {"body": io.BytesIO(json.dumps({"embedding": [3.0, 4.0]}).encode())}
+
+
+def test_bedrock_embedder_normalises_and_learns_dim():
+    client = RecordingBedrock()
+    embedder = emb.from_spec("bedrock:amazon.titan-embed-text-v2:0:256", client=client)
+    assert embedder.model_id == "amazon.titan-embed-text-v2:0" and embedder.dim == 256
+    vecs = embedder.embed(["a", "b"])
+    assert np.allclose(vecs, [[0.6, 0.8]] * 2) and embedder.dim == 2
+    assert client.calls[0] == {"inputText": "a", "dimensions": 256, "normalize": True}
+
+
+def test_bedrock_embedder_read_timeout_ends_before_the_deadline():
+    base = boto3.client("bedrock-runtime")
+    embedder = emb.BedrockEmbedder("amazon.titan-embed-text-v1", client=base)
+    assert embedder._client_until(None) is base
+    assert embedder._client_until(pipeline.Deadline(3.5)).meta.config.read_timeout == 3
+    assert embedder._client_until(pipeline.Deadline(1.2)).meta.config.read_timeout == 1
+
+
+def test_cached_embedder_passes_the_deadline_on_misses():
+    seen = []
+
+    class Inner(emb.HashingEmbedder):
+        def embed(self, texts, deadline=None):
+            seen.append((list(texts), deadline))
+            return super().embed(texts, deadline)
+
+    deadline = pipeline.Deadline(5)
+    from cache import TTLCache
+    cached = emb.CachedEmbedder(Inner(32), TTLCache(8, 60))
+    cached.embed_one("How is my glucose?", deadline)
+    cached.embed_one("how is my glucose", deadline)
+    assert seen == [(["How is my glucose?"], deadline)]
@@ -0,0 +1,64 @@
+# tests/test_fastpath.py
+import math
+
+import pytest
+
+import fastpath
+from series import Series
+
+NAN = math.nan
+VITALS = {
+    "glucose": Series.build([1, 2, 3, 4, 5], [100, 104, 98, 110, NAN], [NAN, NAN, NAN, NAN, 112]),
+    "bp_sys": Series.build([1, 2, 3], [120, 118, 125], [NAN, NAN, NAN]),
+    "bp_dia": Series.build([1, 2, 3], [80, 77, 82], [NAN, NAN, NAN]),
+    "weight": Series.build([1, 2, 3], [82.4, 81.9, 81.2], [NAN, NAN, NAN]),
+}
+
+
+@pytest.mark.parametrize("question,stat,expected", [
+    ("What was my latest glucose?", "latest", "Your latest observed fasting glucose is 110 mg/dL (week 4)."),
+    ("average glucose over the visible weeks", "mean",
+     "Your average observed fasting glucose over weeks 1–4 is 103 mg/dL (4 readings)."),
+    ("lowest systolic in the last 2 weeks", "min",
+     "Your lowest observed systolic blood pressure over weeks 2–3 is 118 mmHg (week 2)."),
+    ("glucose in week 2", "week", "Your observed fasting glucose in week 2 is 104 mg/dL."),
+    ("What is my current body weight?", "latest", "Your latest observed weight is 81.2 kg (week 3)."),
+    ("forecast glucose", "forecast",
+     "Your fasting glucose is predicted to be 112 mg/dL by week 5 (a forecast, not a measurement)."),
+])
+def test_confident_lookups(question, stat, expected):
+    result = fastpath.answer(question, VITALS)
+    assert result.stat == stat and result.confident
+    assert result.answer == expected
+
+
+def test_blood_pressure_covers_both_series():
+    result = fastpath.answer("What is my blood pressure?", VITALS)
+    assert result.series == ["bp_sys", "bp_dia"] and result.stat == "latest"
+    assert "125 mmHg" in result.answer and "82 mmHg" in result.answer
+
+
+@pytest.mark.parametrize("question", [
+    "How am I doing with my glucose?",        # asks for judgement
+    "Should I worry about my blood pressure?",
+    "What time is it?",                       # no metric
+    "Highest and lowest glucose?",            # two statistics
+])
+def test_not_answered_directly(question):
+    assert not fastpath.answer(question, VITALS).confident
+
+
+def test_judgement_question_still_yields_hints():
+    result = fastpath.answer("Is my latest glucose normal?", VITALS)
+    assert not result.confident
+    assert fastpath.hints(result) == "Your latest observed fasting glucose is 110 mg/dL (week 4)."
+
+
+def test_missing_series_is_not_answered():
+    result = fastpath.answer("latest resting heart rate", VITALS)
+    assert result.confidence == 0.0 and not result.confident
+
+
+def test_change():
+    fact = fastpath.compute("change", VITALS["bp_sys"])
+    assert fact == {"value": 5.0, "start": 120.0, "end": 125.0, "from_week": 1, "to_week": 3}
@@ -5,6 +5,7 @@ import json
 import types
 
 import handler
+import vitals
 
 class DummyBedrockClient:
     def __init__(self):
@@ -26,10 +27,11 @@ def test_handler_wires_history_and_vitals(monkeypatch):
     dummy = DummyBedrockClient()
     handler.bedrock = dummy
 
-    # stub fetch_latest to avoid AWS calls when series missing
-    monkeypatch.setattr(handler, "fetch_latest", lambda k: None)
+    # no vitals store: avoid AWS calls when series are missing
+    monkeypatch.setattr(handler, "_VITALS", None)
+    monkeypatch.setattr(handler.providers, "PROMPT_CACHE", "on")
     # stub RAG retrieval
-    monkeypatch.setattr(handler, "retrieve_reference_material", lambda q, c: "")
+    monkeypatch.setattr(handler, "retrieve_reference_material", lambda q, c, deadline=None: "")
 
     event = {
         "body": json.dumps({
@@ -51,22 +53,122 @@ def test_handler_wires_history_and_vitals(monkeypatch):
     body = json.loads(result["body"])
     assert body["answer"].startswith("Hi there!")
 
-    # Validate the request sent to Bedrock
+    # Validate the request sent to Bedrock. Most stable first: the system
+    # prompt (top-level), the user's vitals, the history, then the question;
+    # a cache point ends the vitals and the history (PROMPT_CACHE=on).
     sent = json.loads(dummy.last_invocation["body"].decode())
-    assert sent["messages"][0]["role"] == "system"
-    assert sent["messages"][1] == {
-        "role": "assistant",
-        "name": "vitals",
-        "content": json.dumps(
-            {"glucose": [100.0, 105.0, 110.0], "bp_sys": [120.0, 122.0], "bp_dia": [78.0, 80.0]},
-            separators=(",", ":"),
-        )
-    }
-    # history appears before latest user question
-    assert sent["messages"][2:4] == [
-        {"role": "user", "content": "hi how am i doing?"},
-        {"role": "assistant", "content": "You are trending slightly up."},
-    ]
-    assert sent["messages"][-1]["role"] == "user"
-    assert "What do my last readings say?" in sent["messages"][-1]["content"]
+    assert sent["system"][0]["text"] == handler._SYSTEM_PROMPTS[handler.CONTEXT_ENCODING]
+    assert sent["system"][-1]["cache_control"] == {"type": "ephemeral"}
+    vitals_block, first_question = sent["messages"][0]["content"]
+    assert sent["messages"][0]["role"] == "user"
+    assert vitals_block["cache_control"] == {"type": "ephemeral"}
+    assert vitals_block["text"].startswith("Context data:\n")
+    context = json.loads(vitals_block["text"][len("Context data:\n"):])
+    assert [p["value_data"] for p in context["glucose"]] == [100, 105, 110]
+    # history follows the vitals, merged into alternating turns
+    assert first_question == {"type": "text", "text": "hi how am i doing?"}
+    assert sent["messages"][1] == {"role": "assistant", "content": [
+        {"type": "text", "text": "You are trending slightly up.", "cache_control": {"type": "ephemeral"}}]}
+    # reference material (none here) and the latest question come last, uncached
+    assert sent["messages"][-1] == {"role": "user", "content": [
+        {"type": "text", "text": "What do my last readings say?"}]}
+    assert len(sent["messages"]) == 3
+
+
+def test_caller_comes_from_authorizer_not_body():
+    body = json.dumps({"prompt": "hi", "user_id": "someone-else"})
+    assert handler._caller({"body": body}) is None
+    jwt = {"requestContext": {"authorizer": {"jwt": {"claims": {"sub": "user-1"}}}}, "body": body}
+    assert handler._caller(jwt) == "user-1"
+    lam = {"requestContext": {"authorizer": {"lambda": {"principalId": "user-2"}}}}
+    assert handler._caller(lam) == "user-2"
+
+
+def _stub_turn(monkeypatch):
+    monkeypatch.setattr(handler, "bedrock", DummyBedrockClient())
+    monkeypatch.setattr(handler, "retrieve_reference_material", lambda q, c, deadline=None: "")
+    seen = []
+    real = handler._vitals_context
+    monkeypatch.setattr(handler, "_vitals_context", lambda user_id, *a: seen.append(user_id) or real(user_id, *a))
+    return seen
+
+
+def test_stored_vitals_are_read_for_the_authenticated_caller_only(monkeypatch):
+    seen = _stub_turn(monkeypatch)
+    body = json.dumps({"query": "How is my glucose?", "user_id": "someone-else",
+                       "timeseries": {"glucose": [100, 105]}})
+    assert handler.handler({"body": body}, None)["statusCode"] == 200
+    authed = {"body": body, "requestContext": {"authorizer": {"jwt": {"claims": {"sub": "user-1"}}}}}
+    assert handler.handler(authed, None)["statusCode"] == 403
+    authed["body"] = json.dumps({"query": "How is my glucose?", "timeseries": {"glucose": [100, 105]}})
+    assert handler.handler(authed, None)["statusCode"] == 200
+    assert seen == [None, "user-1"]
+
+
+def test_invalidate_vitals_event_drops_cached_users(monkeypatch):
+    inner = vitals.MemoryRepository()
+    cached = vitals.CachedRepository(inner, maxsize=8, ttl=60)
+    monkeypatch.setattr(handler, "_VITALS", cached)
+    for user_id in ("user-1", "user-2"):
+        cached.fetch(user_id, ["glucose"])
+    assert json.loads(handler.handler({"invalidate_vitals": "user-1"})["body"]) == {"invalidated": ["user-1"]}
+    assert cached.cache.get("user-1") is None and cached.cache.get("user-2") is not None
+    handler.handler({"invalidate_vitals": "*"})
+    assert len(cached.cache) == 0
+
+
+def test_model_ladder_routes_each_question(monkeypatch):
+    dummy = DummyBedrockClient()
+    monkeypatch.setattr(handler, "bedrock", dummy)
+    monkeypatch.setattr(handler, "retrieve_reference_material", lambda q, c, deadline=None: "")
+    monkeypatch.setattr(handler, "FASTPATH", False)
+    monkeypatch.setattr(handler, "MODEL_LADDER", handler.router.parse_ladder(
+        "anthropic.claude-3-haiku-20240307-v1:0@600,anthropic.claude-3-5-sonnet-20240620-v1:0@2000"))
+    for question, model_id, max_tokens in [
+        ("latest glucose?", "anthropic.claude-3-haiku-20240307-v1:0", 600),
+        ("Should I change my diet to lower it?", "anthropic.claude-3-5-sonnet-20240620-v1:0", 2000),
+    ]:
+        body = json.dumps({"query": question, "timeseries": {"glucose": [100, 105]}})
+        assert handler.handler({"body": body}, None)["statusCode"] == 200
+        assert dummy.last_invocation["modelId"] == model_id
+        assert json.loads(dummy.last_invocation["body"])["max_tokens"] <= max_tokens
+
+
+def test_second_turn_reads_the_stable_prefix_from_the_prompt_cache(monkeypatch):
+    monkeypatch.setattr(handler, "bedrock", handler.bedrock_stub.FaultyBedrock(handler.bedrock_stub.Faults(latency_ms=0)))
+    monkeypatch.setattr(handler, "retrieve_reference_material", lambda q, c, deadline=None: "")
+    monkeypatch.setattr(handler, "FASTPATH", False)
+    monkeypatch.setattr(handler, "MODEL_LADDER", [])
+    monkeypatch.setattr(handler, "MODEL_ID", "us.anthropic.claude-3-5-haiku-20241022-v1:0")
+    usage = []
+    for question in ("How has my glucose changed?", "Is that trend a concern?"):
+        body = json.dumps({"query": question, "timeseries": {"glucose": list(range(90, 150))}})
+        result = handler.handler({"body": body}, None)
+        assert result["statusCode"] == 200
+        usage.append(json.loads(result["body"])["token_usage"])
+    assert usage[0]["cache_write_input_tokens"] > 0
+    assert usage[1]["cache_read_input_tokens"] >= usage[0]["cache_write_input_tokens"]
+
+
+def test_degraded_reply_is_not_served_from_the_response_cache(monkeypatch):
+    monkeypatch.setattr(handler, "bedrock", handler.bedrock_stub.FaultyBedrock(handler.bedrock_stub.Faults(latency_ms=0)))
+    monkeypatch.setattr(handler, "retrieve_reference_material", lambda q, c, deadline=None: "")
+    monkeypatch.setattr(handler, "FASTPATH", False)
+    monkeypatch.setattr(handler, "MODEL_LADDER", [])
+    monkeypatch.setattr(handler, "MODEL_ID", "anthropic.claude-3-haiku-20240307-v1:0")
+    monkeypatch.setattr(handler, "_RESPONSE_CACHE", handler.ResponseCache(16, 60, 0.0))
+    body = json.dumps({"query": "Summarise my glucose readings", "timeseries": {"glucose": [100, 105]}})
+
+    monkeypatch.setattr(handler, "RETRIEVAL_MIN_S", 1e9)        # no time for retrieval: degraded
+    first = json.loads(handler.handler({"body": body}, None)["body"])
+    assert first["cached"] is False
+    monkeypatch.setattr(handler, "RETRIEVAL_MIN_S", 0.5)
+    second = json.loads(handler.handler({"body": body}, None)["body"])
+    assert second["cached"] is False                            # answered again with the full budget
+    assert json.loads(handler.handler({"body": body}, None)["body"])["cached"] is True
 
+    monkeypatch.setattr(handler, "RETRIEVAL_MIN_S", 1e9)
+    body = json.dumps({"query": "And my weight?", "timeseries": {"glucose": [100, 105]}})
+    status, lines = handler.stream_handler({"body": body})
+    assert status == 200 and json.loads(list(lines)[-1])["cached"] is False
+    assert json.loads(handler.handler({"body": body}, None)["body"])["cached"] is False
@@ -0,0 +1,77 @@
+# tests/test_history.py
+import threading
+
+import history
+import pipeline
+
+
+def _turns(n, size=200):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"turn {i}. " + "x" * size}
+            for i in range(n)]
+
+
+class RecordingLLM:
+    def __init__(self):
+        self.calls = []
+        self.threads = []
+
+    def __call__(self, prompt, max_tokens, deadline):
+        self.calls.append(deadline)
+        self.threads.append(threading.current_thread())
+        return "model summary"
+
+
+def test_split_keeps_newest_turns_within_budget():
+    compactor = history.HistoryCompactor(history.ExtractiveSummarizer(), recent_tokens=150)
+    older, recent = compactor.split(_turns(6))
+    assert older + recent == _turns(6)
+    assert recent and recent[-1] == _turns(6)[-1] and older
+
+
+def test_extractive_fold_is_bounded():
+    text = history.ExtractiveSummarizer().fold("", _turns(40), max_tokens=60)
+    assert text.splitlines()[-1].startswith("- coach: turn 39.")
+    assert "turn 0." not in text
+
+
+def test_llm_fold_runs_in_request_within_deadline():
+    llm = RecordingLLM()
+    compactor = history.HistoryCompactor(history.LLMSummarizer(llm), llm_min_s=3)
+    out = []
+    deadline = pipeline.Deadline(10)
+    compactor.fold_later("", _turns(2), out.append, deadline)
+    assert out == ["model summary"]
+    assert llm.calls == [deadline] and llm.threads == [threading.current_thread()]
+
+
+def test_llm_fold_falls_back_when_deadline_is_short():
+    llm = RecordingLLM()
+    compactor = history.HistoryCompactor(history.LLMSummarizer(llm), llm_min_s=3)
+    out = []
+    compactor.fold_later("", _turns(2), out.append, pipeline.Deadline(1))
+    assert llm.calls == [] and out[0].startswith("- user: turn 0.")
+
+
+def test_background_mode_folds_on_worker():
+    llm = RecordingLLM()
+    compactor = history.HistoryCompactor(history.LLMSummarizer(llm), background=True)
+    out = []
+    compactor.fold_later("", _turns(2), out.append, pipeline.Deadline(0))
+    compactor.flush(timeout=5)
+    assert out == ["model summary"] and llm.threads[0] is not threading.current_thread()
+
+
+def test_stateless_summary_reuses_cached_prefix_without_model_call():
+    llm = RecordingLLM()
+    compactor = history.HistoryCompactor(history.LLMSummarizer(llm))
+    first = compactor.summary_for(_turns(4))
+    assert compactor.summary_for(_turns(4)) == first
+    longer = compactor.summary_for(_turns(6))
+    assert longer.startswith(first) and llm.calls == []
+
+
+def test_llm_failure_uses_extractive_fold():
+    def broken(prompt, max_tokens, deadline):
+        raise RuntimeError("throttled")
+    text = history.LLMSummarizer(broken).fold("", _turns(2), 100)
+    assert text.startswith("- user: turn 0.")
@@ -0,0 +1,86 @@
+# tests/test_hnsw.py
+import numpy as np
+
+import hnsw
+import vector_index
+
+
+def _index(tmp_path, n=600, dim=24, seed=0):
+    rng = np.random.default_rng(seed)
+    vecs = rng.normal(size=(n, dim)).astype(np.float32)
+    vector_index.write_index(str(tmp_path), vecs, [{"text": str(i)} for i in range(n)])
+    return vector_index.load_index(str(tmp_path)), rng
+
+
+def _recall(index, searcher, queries, k):
+    found = 0
+    for q in queries:
+        exact = {row for row, _ in index.search(q, k)}
+        found += len(exact & {row for row, _ in searcher.search(q, k)})
+    return found / (k * len(queries))
+
+
+def test_recall_against_brute_force(tmp_path):
+    index, rng = _index(tmp_path)
+    hnsw.build(str(tmp_path), M=12, ef_construction=80)
+    graph = hnsw.load(index, ef_search=64)
+    queries = rng.normal(size=(30, index.dim)).astype(np.float32)
+    assert _recall(index, graph, queries, k=10) >= 0.9
+
+
+def test_finds_exact_row_and_scores_are_cosines(tmp_path):
+    index, _ = _index(tmp_path, n=200)
+    hnsw.build(str(tmp_path))
+    graph = hnsw.load(index)
+    hits = graph.search(np.asarray(index.vectors[17]), k=5)
+    assert hits[0][0] == 17 and abs(hits[0][1] - 1.0) < 1e-3
+    assert [s for _, s in hits] == sorted((s for _, s in hits), reverse=True)
+
+
+def test_resume_inserts_only_new_rows(tmp_path):
+    index, rng = _index(tmp_path, n=100)
+    hnsw.build(str(tmp_path))
+    with vector_index.IndexWriter(str(tmp_path), index.dim) as writer:
+        writer.extend_from(index)
+        writer.add(rng.normal(size=(20, index.dim)).astype(np.float32), [{"text": "new"}] * 20)
+    stats = hnsw.build(str(tmp_path), resume=True)
+    assert (stats["nodes"], stats["inserted"]) == (120, 20)
+    grown = vector_index.load_index(str(tmp_path))
+    assert hnsw.load(grown).search(np.asarray(grown.vectors[110]), k=1)[0][0] == 110
+
+
+def test_search_returns_k_live_rows_around_tombstones(tmp_path):
+    index, rng = _index(tmp_path, n=400)
+    query = rng.normal(size=index.dim).astype(np.float32)
+    nearest = [row for row, _ in index.search(query, 150)]
+    with vector_index.IndexWriter(str(tmp_path), index.dim) as writer:
+        writer.extend_from(index)
+        writer.tombstone(nearest)   # the whole neighbourhood the beam would settle in
+    hnsw.build(str(tmp_path), resume=True)
+    graph = hnsw.load(vector_index.load_index(str(tmp_path)), ef_search=10)
+
+    hits = graph.search(query, k=10)
+    assert len(hits) == 10
+    assert not {row for row, _ in hits} & set(nearest)
+
+
+def test_load_without_graph(tmp_path):
+    index, _ = _index(tmp_path, n=10)
+    assert hnsw.load(index) is None
+
+
+def test_bench_reports_recall_per_searcher(tmp_path, capsys):
+    import bench_retrieval
+
+    index, _ = _index(tmp_path, n=200)
+    queries = bench_retrieval.sample_queries(index, 20, noise=0.5)
+    truth = [[row for row, _ in index.search(q, 5)] for q in queries]
+    assert bench_retrieval.evaluate(index.search, queries, truth, 5)["recall"] == 1.0
+
+    hnsw.build(str(tmp_path))
+    bench_retrieval.main([str(tmp_path), "--queries", "20", "--k", "5", "--ef", "64"])
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].startswith("200 rows, dim 24, 20 queries, k=5")
+    flat, graph = (line.split() for line in lines[-2:])
+    assert flat[0] == "flat" and float(flat[2]) == 1.0
+    assert graph[:2] == ["hnsw", "64"] and float(graph[2]) > 0.8
@@ -0,0 +1,53 @@
+# tests/test_local_server.py
+import http.client
+import json
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import handler
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setenv("HISTORY_BACKGROUND", "1")
+    import local_server
+
+    monkeypatch.setattr(handler, "bedrock", handler.bedrock_stub.FaultyBedrock(handler.bedrock_stub.Faults(latency_ms=0)))
+    monkeypatch.setattr(handler, "retrieve_reference_material", lambda q, c, deadline=None: "")
+    monkeypatch.setattr(handler, "FASTPATH", False)
+    monkeypatch.setattr(handler, "MODEL_LADDER", [])
+    monkeypatch.setattr(handler, "MODEL_ID", "anthropic.claude-3-haiku-20240307-v1:0")
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), local_server._Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield httpd.server_address
+    httpd.shutdown()
+
+
+def _post(address, path, payload):
+    conn = http.client.HTTPConnection(*address, timeout=10)
+    conn.request("POST", path, body=json.dumps(payload))
+    resp = conn.getresponse()
+    return resp.status, resp.read().decode("utf-8")
+
+
+def test_buffered_and_streamed_answers_match(server):
+    payload = {"query": "How is my glucose trending?", "timeseries": {"glucose": [100, 104, 108]}}
+    status, body = _post(server, "/query", payload)
+    assert status == 200
+    buffered = json.loads(body)
+
+    status, body = _post(server, "/query/stream", dict(payload, query="And over the last weeks?"))
+    assert status == 200
+    lines = [json.loads(line) for line in body.splitlines()]
+    assert all("delta" in line for line in lines[:-1])
+    assert "".join(line["delta"] for line in lines[:-1]) == buffered["answer"]
+    assert lines[-1]["done"] is True and lines[-1]["ttft_ms"] is not None
+    assert lines[-1]["token_usage"]["output_tokens"] > 0
+
+
+def test_stream_reports_validation_errors_and_unknown_paths(server):
+    status, body = _post(server, "/query/stream", {"timeseries": {}})
+    assert status == 400 and "error" in json.loads(body)
+    assert _post(server, "/nope", {})[0] == 404
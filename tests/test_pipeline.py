@@ -0,0 +1,82 @@
+# tests/test_pipeline.py
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import pipeline
+
+
+class FakeClock:
+    def __init__(self, t=100.0):
+        self.t = t
+
+    def __call__(self):
+        return self.t
+
+
+def test_deadline_remaining_reserve_and_check():
+    clock = FakeClock()
+    d = pipeline.Deadline(5, clock)
+    assert d.remaining() == 5 and d.remaining(2) == 3
+    clock.t += 4
+    assert d.remaining(2) == 0 and not d.expired
+    clock.t += 1
+    assert d.expired
+    with pytest.raises(TimeoutError):
+        d.check()
+
+
+def test_deadline_from_lambda_context_keeps_reserve():
+    class Context:
+        def get_remaining_time_in_millis(self):
+            return 3000
+    assert pipeline.Deadline.from_context(Context(), reserve_ms=500).budget_s == pytest.approx(2.5)
+    assert pipeline.Deadline.from_context(None, default_s=7, reserve_ms=0).budget_s == pytest.approx(7)
+
+
+def test_stages_run_concurrently_and_time_themselves():
+    stages = pipeline.Stages(pipeline.Deadline(5))
+    t = time.perf_counter()
+    for name in ("a", "b", "c"):
+        stages.start(name, lambda n: time.sleep(0.2) or n, name)
+    assert [stages.result(n) for n in ("a", "b", "c")] == ["a", "b", "c"]
+    assert time.perf_counter() - t < 0.5
+    assert set(stages.ms) == {"a", "b", "c"} and stages.missed == []
+
+
+def test_slow_or_failing_stage_gets_its_fallback():
+    release = threading.Event()
+    stages = pipeline.Stages(pipeline.Deadline(0.2))
+    stages.start("slow", release.wait)
+    stages.start("broken", lambda: 1 / 0)
+    assert stages.result("broken", lambda: "fallback") == "fallback"
+    assert stages.result("slow", lambda: "fallback") == "fallback"
+    assert stages.result("never_started", lambda: "fallback") == "fallback"
+    assert stages.missed == ["broken", "slow"]
+    release.set()
+
+
+def test_stragglers_do_not_starve_later_stages():
+    pool = ThreadPoolExecutor(max_workers=2)
+    release = threading.Event()
+    earlier = pipeline.Stages(pipeline.Deadline(0.05), pool)
+    earlier.start("a", release.wait)
+    earlier.start("b", release.wait)
+    assert earlier.result("a") is None and earlier.result("b") is None   # both abandoned, workers still busy
+    later = pipeline.Stages(pipeline.Deadline(2), pool)
+    later.start("vitals", lambda: "ok")
+    assert later.result("vitals") == "ok" and later.missed == []
+    release.set()
+    pool.shutdown(wait=True)
+    assert pipeline._busy[pool] == 0
+
+
+def test_stage_queued_past_its_deadline_is_not_run():
+    ran = []
+    stages = pipeline.Stages(pipeline.Deadline(0))
+    stages.start("late", ran.append, 1)
+    assert stages.result("late", lambda: "fallback") == "fallback"
+    time.sleep(0.05)
+    assert ran == []
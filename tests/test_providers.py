@@ -0,0 +1,119 @@
+# tests/test_providers.py
+import io
+import json
+
+import pytest
+
+import providers
+
+MESSAGES = [
+    {"role": "system", "content": "be brief", "cache": True},
+    {"role": "user", "name": "vitals", "content": "{}", "cache": True},
+    {"role": "user", "content": "hi"},
+    {"role": "assistant", "content": "hello", "cache": True},
+    {"role": "user", "name": "reference_material", "content": "[1] doc"},
+    {"role": "user", "content": "question?"},
+]
+
+
+def test_split_blocks_merges_roles_labels_names_and_keeps_cache_points():
+    system, turns = providers.split_blocks(MESSAGES)
+    assert system == [("be brief", True)]
+    assert turns == [
+        ("user", [("Context data:\n{}", True), ("hi", False)]),
+        ("assistant", [("hello", True)]),
+        ("user", [("Reference material:\n[1] doc", False), ("question?", False)]),
+    ]
+
+
+def test_split_system_drops_a_leading_assistant_turn():
+    system, turns = providers.split_system([{"role": "assistant", "content": "stale"},
+                                            {"role": "user", "content": "a"},
+                                            {"role": "user", "content": "b"}])
+    assert system == "" and turns == [("user", "a\n\nb")]
+
+
+@pytest.mark.parametrize("model_id, provider, adapter", [
+    ("anthropic.claude-3-haiku-20240307-v1:0", "anthropic", "anthropic"),
+    ("us.anthropic.claude-3-5-haiku-20241022-v1:0", "anthropic", "anthropic"),
+    ("meta.llama3-8b-instruct-v1:0", "meta", "meta"),
+    ("mistral.mistral-7b-instruct-v0:2", "mistral", "mistral"),
+    ("amazon.titan-text-express-v1", "amazon", "titan"),
+    ("us.amazon.nova-lite-v1:0", "amazon", "converse"),
+    ("cohere.command-r-v1:0", "cohere", "generic"),
+])
+def test_for_model_picks_the_family_adapter(model_id, provider, adapter):
+    assert providers.provider_of(model_id) == provider
+    assert providers.for_model(model_id).name == adapter
+
+
+def test_caches_prompt_follows_prompt_cache(monkeypatch):
+    assert providers.caches_prompt("us.anthropic.claude-3-5-haiku-20241022-v1:0")
+    assert not providers.caches_prompt("anthropic.claude-3-sonnet-20240229-v1:0")
+    monkeypatch.setattr(providers, "PROMPT_CACHE", "off")
+    assert not providers.caches_prompt("us.anthropic.claude-3-5-haiku-20241022-v1:0")
+    monkeypatch.setattr(providers, "PROMPT_CACHE", "on")
+    assert providers.caches_prompt("anthropic.claude-3-sonnet-20240229-v1:0")
+
+
+def test_anthropic_body_with_and_without_cache_points():
+    adapter = providers.AnthropicAdapter()
+    plain = adapter.body(MESSAGES, 100)
+    assert plain["system"] == "be brief" and plain["max_tokens"] == 100
+    assert [m["role"] for m in plain["messages"]] == ["user", "assistant", "user"]
+    assert plain["messages"][0]["content"] == "Context data:\n{}\n\nhi"
+    cached = adapter.body(MESSAGES, 100, cache=True)
+    assert cached["system"] == [{"type": "text", "text": "be brief", "cache_control": {"type": "ephemeral"}}]
+    marked = [b["text"] for m in cached["messages"] for b in m["content"] if "cache_control" in b]
+    assert marked == ["Context data:\n{}", "hello"]
+
+
+def test_converse_request_puts_cache_points_after_stable_blocks(monkeypatch):
+    model_id = "us.amazon.nova-lite-v1:0"
+    request = providers.ConverseAdapter().request(model_id, MESSAGES, 50)
+    assert request["system"] == [{"text": "be brief"}, {"cachePoint": {"type": "default"}}]
+    assert request["messages"][0]["content"] == [{"text": "Context data:\n{}"}, {"cachePoint": {"type": "default"}},
+                                                 {"text": "hi"}]
+    monkeypatch.setattr(providers, "PROMPT_CACHE", "off")
+    request = providers.ConverseAdapter().request(model_id, MESSAGES, 50)
+    assert request["system"] == [{"text": "be brief"}]
+    assert request["inferenceConfig"] == {"maxTokens": 50}
+
+
+def test_text_model_prompts():
+    meta = providers.MetaAdapter().body(MESSAGES, 10)["prompt"]
+    assert meta.startswith("<|begin_of_text|><|start_header_id|>system<|end_header_id|>\n\nbe brief<|eot_id|>")
+    assert meta.endswith("<|start_header_id|>assistant<|end_header_id|>\n\n")
+    mistral = providers.MistralAdapter().body(MESSAGES, 10)["prompt"]
+    assert mistral.startswith("<s>[INST] be brief\n\nContext data:") and " hello</s>[INST] " in mistral
+    titan = providers.TitanAdapter().body(MESSAGES, 10)
+    assert titan["inputText"].endswith("User: Reference material:\n[1] doc\n\nquestion?\n\nBot:")
+    assert titan["textGenerationConfig"]["maxTokenCount"] == 10
+
+
+class Client:
+    def __init__(self, body, headers=None):
+        self.body, self.headers = body, headers or {}
+
+    def invoke_model(self, modelId, body):
+        self.sent = json.loads(body)
+        return {"body": io.BytesIO(json.dumps(self.body).encode()),
+                "ResponseMetadata": {"RequestId": "r-1", "HTTPHeaders": self.headers}}
+
+
+def test_invoke_prefers_header_token_counts_and_reports_cache_usage():
+    body = {"content": [{"type": "text", "text": "ok"}], "model": "claude", "stop_reason": "end_turn",
+            "usage": {"input_tokens": 12, "output_tokens": 3, "cache_read_input_tokens": 900}}
+    reply = providers.AnthropicAdapter().invoke(Client(body, {"x-amzn-bedrock-output-token-count": "4"}),
+                                                "anthropic.claude-3-haiku-20240307-v1:0", MESSAGES, 10)
+    assert (reply.answer, reply.model_version, reply.request_id, reply.stop_reason) == ("ok", "claude", "r-1", "end_turn")
+    assert reply.token_usage == {"input_tokens": 12, "output_tokens": 4, "cache_read_input_tokens": 900,
+                                 "cache_write_input_tokens": 0, "total_tokens": 916}
+
+
+def test_extract_any_reads_openai_shaped_bodies():
+    answer, version, usage = providers.extract_any({
+        "choices": [{"message": {"content": "hey"}, "usage": {"prompt_tokens": 5, "completion_tokens": 2}}],
+        "version": "v9"})
+    assert (answer, version) == ("hey", "v9")
+    assert usage["input_tokens"] == 5 and usage["output_tokens"] == 2
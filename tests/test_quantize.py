@@ -0,0 +1,50 @@
+# tests/test_quantize.py
+import numpy as np
+import pytest
+
+import quantize
+import vector_index
+
+
+def _index(tmp_path, n=2000, dim=32):
+    rng = np.random.default_rng(1)
+    # clustered data, like real embeddings
+    centers = rng.normal(size=(20, dim))
+    vecs = (centers[rng.integers(0, 20, n)] + 0.3 * rng.normal(size=(n, dim))).astype(np.float32)
+    vector_index.write_index(str(tmp_path), vecs, [{"text": str(i)} for i in range(n)])
+    return vector_index.load_index(str(tmp_path)), rng
+
+
+def test_int8_round_trip_error_is_small():
+    rng = np.random.default_rng(0)
+    vecs = vector_index.normalize_rows(rng.normal(size=(500, 64)).astype(np.float32))
+    scale = quantize.int8_scale(vecs)
+    codes = quantize.int8_encode(vecs, scale)
+    assert codes.dtype == np.int8
+    assert np.abs(codes * scale - vecs).max() <= scale.max() / 2 + 1e-6
+
+
+def test_pq_round_trip_beats_random_centroid(tmp_path):
+    index, _ = _index(tmp_path)
+    vecs = np.asarray(index.vectors)
+    books = quantize.pq_train(vecs, m=8, iters=10)
+    codes = quantize.pq_encode(vecs, books)
+    recon = np.concatenate([books[j][codes[:, j]] for j in range(8)], axis=1)
+    err = np.linalg.norm(recon - vecs, axis=1).mean()
+    assert codes.shape == (len(index), 8) and codes.dtype == np.uint8
+    assert err < 0.5                   # rows are unit length
+
+
+def test_pq_m_must_divide_dim():
+    with pytest.raises(ValueError):
+        quantize.pq_train(np.zeros((10, 30), dtype=np.float32), m=8)
+
+
+@pytest.mark.parametrize("mode", ["int8", "pq"])
+def test_reranked_search_matches_exact(tmp_path, mode):
+    index, rng = _index(tmp_path)
+    quantize.build(str(tmp_path), mode, pq_m=8)
+    searcher = quantize.load(index, rerank=64)
+    for q in rng.normal(size=(10, index.dim)).astype(np.float32):
+        exact = [row for row, _ in index.search(q, 5)]
+        assert [row for row, _ in searcher.search(q, 5)] == exact
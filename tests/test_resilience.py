@@ -0,0 +1,169 @@
+# tests/test_resilience.py
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+
+import pipeline
+import resilience
+
+
+def test_timed_clients_are_built_up_front_and_fit_the_deadline():
+    base = boto3.client("bedrock-runtime")
+    timed = resilience.TimedClients(base, max_s=10)
+    assert sorted(timed.clients) == [1, 2, 3, 4, 6, 8, 10]
+    client = timed.until(pipeline.Deadline(7.5))
+    assert client is timed.clients[6]
+    assert client.meta.config.read_timeout == 6
+    assert client.meta.config.retries["total_max_attempts"] == 1
+    assert timed.until(pipeline.Deadline(60)) is timed.clients[10]
+    with pytest.raises(TimeoutError):
+        timed.until(pipeline.Deadline(0.5))
+
+
+def test_timed_clients_pass_stubs_through():
+    stub = object()
+    timed = resilience.TimedClients(stub)
+    assert timed.clients == {} and timed.until(pipeline.Deadline(5)) is stub
+    with pytest.raises(TimeoutError):
+        timed.until(pipeline.Deadline(0))
+
+
+def throttled():
+    return ClientError({"Error": {"Code": "ThrottlingException", "Message": "slow down"}}, "InvokeModel")
+
+
+def invalid():
+    return ClientError({"Error": {"Code": "ValidationException", "Message": "bad body"}}, "InvokeModel")
+
+
+class Clock:
+    def __init__(self):
+        self.t = 0.0
+
+    def __call__(self):
+        return self.t
+
+
+def test_breaker_opens_after_failures_and_one_probe_decides():
+    clock = Clock()
+    breaker = resilience.CircuitBreaker(failures=2, window_s=10, cooldown_s=5, clock=clock)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record(False)
+    assert breaker.state == "open" and not breaker.allow()
+    clock.t = 5
+    assert breaker.allow() and breaker.state == "half_open"
+    assert not breaker.allow()                 # only one probe at a time
+    breaker.record(False)
+    assert breaker.state == "open"
+    clock.t = 10
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_breaker_forgets_failures_outside_the_window():
+    clock = Clock()
+    breaker = resilience.CircuitBreaker(failures=2, window_s=10, cooldown_s=5, clock=clock)
+    breaker.record(False)
+    clock.t = 11
+    breaker.record(False)
+    assert breaker.state == "closed"
+
+
+def test_neutral_outcome_frees_the_probe_without_closing_the_breaker():
+    clock = Clock()
+    breaker = resilience.CircuitBreaker(failures=1, window_s=10, cooldown_s=5, clock=clock)
+    breaker.record(False)
+    clock.t = 5
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.state == "half_open" and breaker.allow()   # the next call probes instead
+
+
+def test_non_retryable_errors_neither_retry_nor_count_against_the_model():
+    calls = []
+
+    def attempt(model_id):
+        calls.append(model_id)
+        raise invalid()
+
+    r = resilience.Resilient(max_attempts=3, hedge=False, sleep=lambda s: None)
+    for _ in range(10):
+        stats = resilience.CallStats("m")
+        with pytest.raises(ClientError):
+            r.call(attempt, stats, pipeline.Deadline(30))
+        assert stats.attempts == 1 and stats.errors == ["ValidationException"]
+    assert r.states() == {"m": "closed"}
+
+    def out_of_time(model_id):
+        raise TimeoutError("no time left for the call")
+    with pytest.raises(TimeoutError):
+        r.call(out_of_time, resilience.CallStats("m"), pipeline.Deadline(30))
+    assert r.states() == {"m": "closed"}
+
+
+def test_retryable_errors_are_retried_with_backoff_within_the_deadline():
+    outcomes = [throttled(), throttled(), "ok"]
+    slept = []
+
+    def attempt(model_id):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    r = resilience.Resilient(max_attempts=3, hedge=False, sleep=slept.append)
+    stats = resilience.CallStats("m")
+    assert r.call(attempt, stats, pipeline.Deadline(30)) == "ok"
+    assert stats.attempts == 3 and stats.errors == ["ThrottlingException"] * 2 and len(slept) == 2
+    assert all(0 <= s <= resilience.BACKOFF_CAP_S for s in slept)
+
+    stats = resilience.CallStats("m")
+    with pytest.raises(ClientError):   # no time for a second attempt
+        r.call(lambda m: (_ for _ in ()).throw(throttled()), stats, pipeline.Deadline(0.5))
+    assert stats.attempts == 1
+
+
+def test_open_breaker_falls_back_then_fails_fast():
+    r = resilience.Resilient(max_attempts=1, hedge=False, fallback_model="backup")
+    r._state("main")[0].state = "open"
+    r._state("main")[0].opened_at = float("inf")
+    stats = resilience.CallStats("main")
+    assert r.call(lambda model_id: model_id, stats, pipeline.Deadline(30)) == "backup"
+    assert stats.fell_back and stats.model_id == "backup"
+    r._state("backup")[0].state = "open"
+    r._state("backup")[0].opened_at = float("inf")
+    with pytest.raises(resilience.CircuitOpenError):
+        r.call(lambda model_id: model_id, resilience.CallStats("main"), pipeline.Deadline(30))
+
+
+def test_hedged_call_takes_the_first_reply(monkeypatch):
+    monkeypatch.setattr(resilience, "HEDGE_MIN_SAMPLES", 1)
+    monkeypatch.setattr(resilience, "HEDGE_MIN_DELAY_S", 0.05)
+    r = resilience.Resilient(hedge=True)
+    r._state("m")[1].add(0.05)
+    release = threading.Event()
+    calls = []
+
+    def attempt(model_id):
+        calls.append(model_id)
+        if len(calls) == 1:
+            release.wait(5)        # the first request hangs
+            return "slow"
+        return "fast"
+
+    stats = resilience.CallStats("m")
+    assert r.call(attempt, stats, pipeline.Deadline(30)) == "fast"
+    assert stats.hedged == 1 and len(calls) == 2
+    release.set()
+
+
+def test_timed_clients_are_safe_to_share_across_hedge_threads():
+    timed = resilience.TimedClients(boto3.client("bedrock-runtime"), max_s=10)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        got = set(pool.map(lambda _: id(timed.until(pipeline.Deadline(9))), range(32)))
+    assert got == {id(timed.clients[8])}
@@ -0,0 +1,92 @@
+# tests/test_retrieval.py
+import os
+
+import pytest
+
+import build_index
+import embedder as emb
+import retrieval
+from utils import est_tokens
+
+DOCS = {
+    "glucose.md": "# Glucose\n\nFasting glucose above 100 mg/dL suggests prediabetes.",
+    "bp.md": "# Blood pressure\n\nSystolic pressure above 130 mmHg is stage 1 hypertension.",
+    "sleep.md": "# Sleep\n\nAdults need seven or more hours of sleep each night.",
+}
+
+
+def test_load_retriever_uses_the_index_embedder(tmp_path):
+    src, out = tmp_path / "docs", str(tmp_path / "index")
+    os.makedirs(src)
+    for name, text in DOCS.items():
+        (src / name).write_text(text, encoding="utf-8")
+    build_index.update(str(src), out, emb.from_spec("hashing:128"), workers=1)
+
+    retriever = retrieval.load_retriever(out)
+    assert retriever.embedder.spec == "hashing:128"
+    hits = retriever.search("what fasting glucose means prediabetes", k=1, min_score=0.0)
+    assert "prediabetes" in hits[0].record["text"]
+    assert retrieval.load_retriever(str(tmp_path / "missing")) is None
+
+
+def _hit(row, text, title=None):
+    return retrieval.Hit(row, 1.0, {"text": text, "title": title})
+
+
+def test_format_passages_numbers_and_drops_whole_passages_over_budget():
+    hits = [_hit(0, "first passage", "Glucose"), _hit(1, "second passage"), _hit(2, "third " * 200)]
+    text = retrieval.format_passages(hits, max_tokens=est_tokens("[1] Glucose\nfirst passage") + 10)
+    assert text.startswith("[1] Glucose\nfirst passage")
+    assert "[2] second passage" in text and "[3]" not in text
+    assert retrieval.format_passages(hits[2:], max_tokens=5) == ""
+
+
+@pytest.mark.parametrize("k", [1, 2])
+def test_search_returns_at_most_k(tmp_path, k):
+    src, out = tmp_path / "docs", str(tmp_path / "index")
+    os.makedirs(src)
+    for name, text in DOCS.items():
+        (src / name).write_text(text, encoding="utf-8")
+    build_index.update(str(src), out, emb.from_spec("hashing:128"), workers=1)
+    assert len(retrieval.load_retriever(out).search("sleep hours glucose pressure", k=k, min_score=-1.0)) <= k
+
+
+def test_stale_quantised_codes_fall_back_to_the_flat_scan(tmp_path, caplog):
+    import quantize
+    import vector_index
+
+    embedder = emb.from_spec("hashing:64")
+    texts = list(DOCS.values())
+    path = str(tmp_path)
+    vector_index.write_index(path, embedder.embed(texts[:2]), [{"text": t} for t in texts[:2]],
+                             extra_meta={"embedder": embedder.spec})
+    quantize.build(path, "int8")
+    vector_index.write_index(path, embedder.embed(texts), [{"text": t} for t in texts],   # rows added, not re-quantised
+                             extra_meta={"embedder": embedder.spec})
+
+    retriever = retrieval.load_retriever(path)
+    assert retriever is not None and retriever.quant is None
+    assert "ignoring quantised codes" in caplog.text
+    assert "seven or more hours" in retriever.search("hours of sleep", k=1, min_score=0.0)[0].record["text"]
+
+
+def test_sidecars_from_an_older_index_generation_are_ignored(tmp_path, caplog):
+    import bm25
+    import hnsw
+    import vector_index
+
+    embedder = emb.from_spec("hashing:64")
+    texts = list(DOCS.values())
+    path = str(tmp_path)
+    vector_index.write_index(path, embedder.embed(texts), [{"text": t} for t in texts],
+                             extra_meta={"embedder": embedder.spec})
+    bm25.build(path, enumerate(texts), len(texts), index_gen=vector_index.load_index(path).gen)
+    hnsw.build(path)
+    texts.reverse()   # rewritten with the same row count: row ids now mean other passages
+    vector_index.write_index(path, embedder.embed(texts), [{"text": t} for t in texts],
+                             extra_meta={"embedder": embedder.spec})
+
+    retriever = retrieval.load_retriever(path)
+    assert retriever.lexical is None and retriever.ann is None
+    assert "ignoring BM25 files" in caplog.text and "ignoring HNSW graph" in caplog.text
+    assert "seven or more hours" in retriever.search("hours of sleep", k=1, min_score=0.0)[0].record["text"]
@@ -0,0 +1,45 @@
+# tests/test_router.py
+import pytest
+
+import router
+
+LADDER = router.parse_ladder("small@600, mid@1000 ,large@2000")
+
+
+def test_parse_ladder_keeps_colons_in_model_ids():
+    assert router.parse_ladder("anthropic.claude-3-haiku-20240307-v1:0@600") == [
+        router.Rung("anthropic.claude-3-haiku-20240307-v1:0", 600)]
+    assert router.parse_ladder("") == [] and [r.model_id for r in LADDER] == ["small", "mid", "large"]
+
+
+@pytest.mark.parametrize("spec", ["small", "small@", "@600", "small@lots"])
+def test_parse_ladder_rejects_malformed_entries(spec):
+    with pytest.raises(ValueError):
+        router.parse_ladder(spec)
+
+
+@pytest.mark.parametrize("question, stat, level", [
+    ("latest glucose?", "latest", "simple"),
+    ("what was my bmi last week", None, "simple"),
+    ("Should I exercise more?", None, "complex"),
+    ("What is my glucose? And my weight?", None, "complex"),
+    ("glucose " * 100, None, "complex"),
+])
+def test_classify(question, stat, level):
+    assert router.classify(question, 10, stat)[0] == level
+
+
+def test_large_context_makes_a_short_question_medium_unless_it_is_a_lookup():
+    assert router.classify("what was my bmi last week", 10_000) == ("medium", "default")
+    assert router.classify("what was my bmi last week", 10_000, "latest") == ("simple", "lookup:latest")
+
+
+def test_route_maps_levels_onto_the_ladder():
+    assert router.route("latest glucose?", "", LADDER, "latest").model_id == "small"
+    assert router.route("what was my bmi last week", "x" * 10_000, LADDER).model_id == "mid"
+    advice = router.route("Should I exercise more?", "", LADDER)
+    assert (advice.model_id, advice.max_tokens, advice.reason) == ("large", 2000, "advice")
+    two = LADDER[::2]
+    assert router.route("what was my bmi last week", "x" * 10_000, two).model_id == "large"   # medium: upper rung
+    only = router.route("Should I exercise more?", "", LADDER[:1])
+    assert (only.model_id, only.level) == ("small", "single")
@@ -0,0 +1,32 @@
+# tests/test_series.py
+import json
+import math
+
+import numpy as np
+
+from series import Series
+
+
+def test_build_cleans_sorts_and_drops_empty_points():
+    s = Series.build([3, "1", None, 2, 4], ["103", 101, 5, None, "bad"], [None, None, None, 99.5, None])
+    assert s.weeks.tolist() == [1, 2, 3]          # week None dropped; week 4 has no value at all
+    assert s.observed[0] == 101 and math.isnan(s.observed[1])
+    assert s.has_predicted.tolist() == [False, True, False]
+
+
+def test_points_round_trip():
+    points = [{"week": 1, "value_data": 100.0, "value_predicted": None},
+              {"week": 2, "value_data": None, "value_predicted": 104.5}]
+    s = Series.from_points(points)
+    assert s.to_points() == points
+    assert json.loads(s.to_json()) == points
+
+
+def test_iter_json_precision_and_slices():
+    s = Series.build([1, 2, 3], [1.23456, 2.5, 3.0], [None] * 3)
+    assert list(s.iter_json(1, 2, precision=1)) == ['{"week":2,"value_data":2.5,"value_predicted":null}']
+    assert len(s.slice(1)) == 2 and s.take(np.array([0, 2])).weeks.tolist() == [1, 3]
+
+
+def test_empty():
+    assert not Series.empty() and len(Series.empty()) == 0
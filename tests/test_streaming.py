@@ -0,0 +1,71 @@
+# tests/test_streaming.py
+import json
+
+from streaming import BedrockStream, ConverseStream
+
+
+def _events(*bodies):
+    return {"body": [{"chunk": {"bytes": json.dumps(b).encode()}} for b in bodies],
+            "ResponseMetadata": {"RequestId": "req-1"}}
+
+
+def test_anthropic_stream_yields_deltas_and_usage():
+    stream = BedrockStream(_events(
+        {"type": "message_start", "message": {"model": "claude-x", "usage": {"input_tokens": 12, "output_tokens": 1}}},
+        {"type": "content_block_delta", "delta": {"type": "text_delta", "text": "Your glucose "}},
+        {"type": "content_block_delta", "delta": {"type": "text_delta", "text": "looks stable."}},
+        {"type": "message_delta", "usage": {"output_tokens": 7}},
+        {"type": "message_stop", "amazon-bedrock-invocationMetrics": {"inputTokenCount": 12, "outputTokenCount": 7}},
+    ))
+    assert list(stream) == ["Your glucose ", "looks stable."]
+    assert stream.text == "Your glucose looks stable."
+    assert stream.token_usage == {"input_tokens": 12, "output_tokens": 7, "total_tokens": 19}
+    assert stream.model_version == "claude-x" and stream.request_id == "req-1"
+    assert stream.ttft_ms is not None and stream.latency_ms >= stream.ttft_ms
+
+
+def test_other_provider_shapes_and_bad_chunks():
+    response = _events({"generation": "a"}, {"outputs": [{"text": "b"}]},
+                       {"choices": [{"delta": {"content": "c"}}]}, {"outputText": "d"})
+    response["body"].insert(1, {"chunk": {"bytes": b"not json"}})
+    response["body"].append({"internalServerException": {}})
+    stream = BedrockStream(response)
+    assert "".join(stream) == "abcd"
+    assert stream.token_usage is None
+
+
+def test_converse_stream():
+    stream = ConverseStream({"stream": [
+        {"messageStart": {"role": "assistant"}},
+        {"contentBlockDelta": {"delta": {"text": "Hi"}}},
+        {"contentBlockDelta": {"delta": {"text": " there"}}},
+        {"metadata": {"usage": {"inputTokens": 5, "outputTokens": 2}}},
+    ], "ResponseMetadata": {}})
+    assert list(stream) == ["Hi", " there"]
+    assert stream.token_usage == {"input_tokens": 5, "output_tokens": 2, "total_tokens": 7}
+
+
+def test_cache_usage_from_message_start_and_invocation_metrics():
+    stream = BedrockStream(_events(
+        {"type": "message_start", "message": {"usage": {"input_tokens": 4, "output_tokens": 1,
+                                                        "cache_read_input_tokens": 900,
+                                                        "cache_creation_input_tokens": 0}}},
+        {"type": "content_block_delta", "delta": {"type": "text_delta", "text": "ok"}},
+        {"type": "message_stop", "amazon-bedrock-invocationMetrics": {
+            "inputTokenCount": 4, "outputTokenCount": 2,
+            "cacheReadInputTokenCount": 900, "cacheWriteInputTokenCount": 50}},
+    ))
+    assert list(stream) == ["ok"]
+    assert stream.token_usage == {"input_tokens": 4, "output_tokens": 2, "cache_read_input_tokens": 900,
+                                  "cache_write_input_tokens": 50, "total_tokens": 956}
+
+
+def test_converse_stream_cache_usage():
+    stream = ConverseStream({"stream": [
+        {"contentBlockDelta": {"delta": {"text": "Hi"}}},
+        {"metadata": {"usage": {"inputTokens": 5, "outputTokens": 2, "cacheReadInputTokens": 0,
+                                "cacheWriteInputTokens": 300}}},
+    ], "ResponseMetadata": {}})
+    assert list(stream) == ["Hi"]
+    assert stream.token_usage == {"input_tokens": 5, "output_tokens": 2, "cache_read_input_tokens": 0,
+                                  "cache_write_input_tokens": 300, "total_tokens": 307}
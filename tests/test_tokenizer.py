@@ -0,0 +1,66 @@
+# tests/test_tokenizer.py
+import math
+
+import pytest
+
+import tokenizer
+from cache import TTLCache
+
+CORPUS = ["Your average fasting glucose over weeks 3-10 is 112.5 mg/dL."] * 20 + [
+    "Resting heart rate and blood pressure trends over the last weeks."] * 20
+
+
+@pytest.fixture(autouse=True)
+def _fresh_tokenizers():
+    tokenizer.set_default(None)
+    yield
+    tokenizer.set_default(None)
+
+
+def test_bpe_round_trip_and_compression(tmp_path):
+    tok = tokenizer.BPETokenizer.train(CORPUS, vocab_size=400)
+    ids = tok.encode(CORPUS[0])
+    assert tok.decode(ids) == CORPUS[0]
+    assert len(ids) < len(CORPUS[0].encode()) / 2
+    path = str(tmp_path / "bpe.tiktoken")
+    tok.save(path)
+    assert tokenizer.BPETokenizer.load(path).encode(CORPUS[0]) == ids
+
+
+def test_char_ratio_per_model_family():
+    assert tokenizer.chars_per_token_for("us.anthropic.claude-3-haiku") == 3.5
+    assert tokenizer.chars_per_token_for("unknown.model") == tokenizer.DEFAULT_CHARS_PER_TOKEN
+    assert tokenizer.CharRatioTokenizer(4.0).count("x" * 40) == 11
+
+
+def test_cached_tokenizer_counts_each_text_once():
+    calls = []
+
+    class Counting(tokenizer.CharRatioTokenizer):
+        def count(self, text):
+            calls.append(text)
+            return super().count(text)
+
+    tok = tokenizer.CachedTokenizer(Counting(4.0), TTLCache(16, ttl=math.inf))
+    assert tok.count("hello world") == tok.count("hello world")
+    assert tok.count("hello world!") != 0
+    assert calls == ["hello world", "hello world!"]
+
+
+def test_calibration_learns_and_clamps_factor():
+    tok = tokenizer.Calibrated(tokenizer.CharRatioTokenizer(4.0))
+    base = tok.count("x" * 400)
+    tok.observe(["x" * 400], 2 * base)
+    assert tok.count("x" * 400) == 2 * base
+    tok.observe(["x" * 400], 100 * base)        # clamped to 2x
+    assert tok.stats()["factor"] == 2.0
+
+
+def test_models_are_calibrated_separately(monkeypatch):
+    monkeypatch.setenv("MODEL_ID", "anthropic.claude-3-haiku")
+    default = tokenizer.get()
+    assert tokenizer.get("anthropic.claude-3-haiku") is default
+    other = tokenizer.get("meta.llama3-70b")
+    other.observe(["x" * 400], 1000)
+    assert other.stats()["factor"] != 1.0
+    assert default.stats()["factor"] == 1.0
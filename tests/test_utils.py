@@ -78,3 +78,43 @@ def test_build_context_from_payload_compact_json():
     ctx = utils.build_context_from_payload("ignored", ts, max_context_tokens=9999)
     # should be compact JSON without spaces
     assert ctx == json.dumps(ts, separators=(",", ":"))
+
+
+def test_build_context_from_payload_drops_missing_series():
+    ctx = utils.build_context_from_payload("q", {"glucose": [1, 2], "weight": None})
+    assert json.loads(ctx) == {"glucose": [1, 2]}
+
+
+def test_build_context_from_payload_plain_lists_keep_newest_within_budget():
+    ts = {"glucose": list(range(1000))}
+    ctx = utils.build_context_from_payload("q", ts, max_context_tokens=50)
+    values = json.loads(ctx)["glucose"]      # still valid JSON, never cut mid-number
+    assert 0 < len(values) < 1000 and values[-1] == 999
+
+
+def _long_series(n=200):
+    from series import Series
+    return {"glucose": Series.build(range(n), [100 + i % 7 for i in range(n)], [None] * n),
+            "bp_sys": Series.build(range(n), [120] * n, [None] * n)}
+
+
+def test_build_context_from_payload_fits_token_budget_newest_first():
+    ctx = utils.build_context_from_payload("q", _long_series(), max_context_tokens=200)
+    assert utils.est_tokens(ctx) <= 200
+    parsed = json.loads(ctx)
+    assert parsed["glucose"][-1]["week"] == 199 and parsed["bp_sys"][-1]["week"] == 199
+    assert len(parsed["glucose"]) < 200
+
+
+def test_build_context_from_payload_encodings():
+    ts = _long_series(3)
+    assert utils.build_context_from_payload("q", ts).startswith('{"glucose":[{"week":0,')   # points by default
+    columns = json.loads(utils.build_context_from_payload("q", ts, encoding="columns"))
+    assert columns["week"] == [0, 1, 2] and columns["bp_sys"] == [120, 120, 120]
+    table = utils.build_context_from_payload("q", ts, encoding="table").splitlines()
+    assert table[0].startswith("week,glucose") and table[1].startswith("0,100")
+    try:
+        utils.build_context_from_payload("q", ts, encoding="yaml")
+        assert False, "Expected ValueError for unknown encoding"
+    except ValueError:
+        pass
@@ -0,0 +1,65 @@
+# tests/test_vector_index.py
+import json
+import os
+
+import numpy as np
+
+import vector_index
+
+
+def _records(n, tag="doc"):
+    return [{"text": f"{tag} {i}", "source": tag} for i in range(n)]
+
+
+def test_write_and_search_roundtrip(tmp_path):
+    rng = np.random.default_rng(0)
+    vecs = rng.normal(size=(50, 8)).astype(np.float32)
+    vector_index.write_index(str(tmp_path), vecs, _records(50))
+
+    index = vector_index.load_index(str(tmp_path))
+    assert len(index) == 50 and index.dim == 8
+    (row, score), *_ = index.search(vecs[7], k=3)
+    assert row == 7 and score > 0.99
+    assert index.record(7)["text"] == "doc 7"
+
+
+def test_rebuild_swaps_generation_and_keeps_previous_one(tmp_path):
+    path = str(tmp_path)
+    vecs = np.eye(4, dtype=np.float32)
+    vector_index.write_index(path, vecs, _records(4, "v1"))
+    old = vector_index.load_index(path)
+    first = vector_index.data_files(old.meta)
+
+    vector_index.write_index(path, vecs[:2], _records(2, "v2"))
+    second = vector_index.data_files(vector_index.load_index(path).meta)
+    assert {first["embeddings"], first["chunks"]}.isdisjoint(second.values())
+    # A reader that loaded the old meta.json can still open the old generation.
+    assert os.path.exists(os.path.join(path, first["embeddings"]))
+    assert old.record(3)["text"] == "v1 3"
+
+    vector_index.write_index(path, vecs[:1], _records(1, "v3"))
+    assert not os.path.exists(os.path.join(path, first["embeddings"]))
+    assert len(vector_index.load_index(path)) == 1
+
+
+def test_tombstones_hide_rows(tmp_path):
+    vecs = np.eye(3, dtype=np.float32)
+    with vector_index.IndexWriter(str(tmp_path), 3) as writer:
+        writer.add(vecs, _records(3))
+        writer.tombstone([1])
+    index = vector_index.load_index(str(tmp_path))
+    assert 1 not in [row for row, _ in index.search(vecs[1], k=3)]
+
+
+def test_reads_unversioned_layout(tmp_path):
+    path = str(tmp_path)
+    vector_index.write_index(path, np.eye(2, dtype=np.float32), _records(2))
+    with open(os.path.join(path, vector_index.META_FILE)) as fh:
+        meta = json.load(fh)
+    for kind, name in vector_index.data_files(meta).items():
+        if name:
+            os.replace(os.path.join(path, name), os.path.join(path, vector_index._DATA_FILES[kind]))
+    del meta["files"]
+    with open(os.path.join(path, vector_index.META_FILE), "w") as fh:
+        json.dump(meta, fh)
+    assert vector_index.load_index(path).record(1)["text"] == "doc 1"
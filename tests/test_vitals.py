@@ -0,0 +1,95 @@
+# tests/test_vitals.py
+import pytest
+
+import utils
+import vitals
+from series import Series
+
+
+def _glucose():
+    return Series.from_points([{"week": 1, "value_data": 100.0, "value_predicted": None},
+                               {"week": 2, "value_data": 104.0, "value_predicted": 106.0}])
+
+
+def test_series_agree_with_payload_allowlist():
+    assert set(vitals.SERIES) == utils._ALLOWED_SERIES
+
+
+@pytest.mark.parametrize("user_id", ["user-1", "auth0|5f1c", "a.b+c@example.com", "us-east-1:1a2b"])
+def test_parse_user_id_accepts_authorizer_ids(user_id):
+    assert vitals.parse_user_id(user_id) == user_id
+
+
+@pytest.mark.parametrize("user_id", ["x' OR '1'='1", "a b", "a;b", "a" * 129, 42, "é"])
+def test_parse_user_id_rejects_everything_else(user_id):
+    with pytest.raises(ValueError):
+        vitals.parse_user_id(user_id)
+
+
+def test_timestream_query_is_validated_before_quoting():
+    repo = vitals.TimestreamRepository("db", "tbl", lookback_days=30, client=object())
+    sql = repo.query_for("user-1", ["glucose", "weight"])
+    assert "user_id = 'user-1'" in sql and "IN ('glucose', 'weight')" in sql and "ago(30d)" in sql
+    with pytest.raises(ValueError):
+        repo.query_for("u' OR '1'='1", ["glucose"])
+    with pytest.raises(ValueError):
+        repo.query_for("user-1", ["glucose') OR ('1'='1"])
+
+
+@pytest.mark.parametrize("make", [vitals.MemoryRepository, lambda: vitals.SQLiteRepository(":memory:")])
+def test_fetch_returns_every_requested_series(make):
+    repo = make()
+    repo.put("user-1", "glucose", _glucose())
+    got = repo.fetch("user-1", ["glucose", "weight"])
+    assert got["glucose"].to_points() == _glucose().to_points()
+    assert len(got["weight"]) == 0
+    assert len(repo.fetch("user-2", ["glucose"])["glucose"]) == 0
+
+
+def test_sqlite_fetch_rejects_unknown_series():
+    with pytest.raises(ValueError):
+        vitals.SQLiteRepository(":memory:").fetch("user-1", ["cholesterol"])
+
+
+class CountingRepository(vitals.MemoryRepository):
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    def fetch(self, user_id, names, deadline=None):
+        self.calls.append((user_id, tuple(names)))
+        return super().fetch(user_id, names, deadline)
+
+
+def test_cached_repository_loads_every_series_once_per_user():
+    inner = CountingRepository()
+    inner.put("user-1", "glucose", _glucose())
+    cached = vitals.CachedRepository(inner, maxsize=8, ttl=60)
+    assert cached.fetch("user-1", ["glucose"])["glucose"].to_points() == _glucose().to_points()
+    assert len(cached.fetch("user-1", ["weight", "bmi"])["weight"]) == 0   # other subset: still a hit
+    assert inner.calls == [("user-1", vitals.SERIES)]
+
+
+def test_cached_repository_refreshes_on_new_version_and_invalidate():
+    inner = CountingRepository()
+    cached = vitals.CachedRepository(inner, maxsize=8, ttl=60)
+    cached.fetch("user-1", ["glucose"], version="v1")
+    inner.put("user-1", "glucose", _glucose())
+    assert len(cached.fetch("user-1", ["glucose"], version="v1")["glucose"]) == 0   # stale but cached
+    assert len(cached.fetch("user-1", ["glucose"], version="v2")["glucose"]) == 2
+    cached.fetch("user-2", ["glucose"])
+    cached.invalidate("user-1")
+    cached.fetch("user-1", ["glucose"], version="v2")
+    cached.fetch("user-2", ["glucose"])
+    assert [u for u, _ in inner.calls] == ["user-1", "user-1", "user-2", "user-1"]
+    cached.invalidate()
+    cached.fetch("user-2", ["glucose"])
+    assert len(inner.calls) == 5
+
+
+def test_cached_repository_evicts_least_recently_used_user():
+    inner = CountingRepository()
+    cached = vitals.CachedRepository(inner, maxsize=2, ttl=60)
+    for user_id in ("a", "b", "a", "c", "a", "b"):
+        cached.fetch(user_id, ["glucose"])
+    assert [u for u, _ in inner.calls] == ["a", "b", "c", "b"]